@@ -1,11 +1,42 @@
-from typing import Optional
+from typing import Any, Optional
 
 from requests import Request
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.responses import Response
+from starlette_admin.contrib.sqla.middleware import DBSessionMiddleware
 from starlette_admin.contrib.sqlmodel import Admin as BaseAdmin
 
+from chowda.db import RoutingSession, reads_primary
+
+
+class RoutingSessionMiddleware(BaseHTTPMiddleware):
+    """Gives each admin request a RoutingSession, which reads list, detail and count
+    queries from the read replica. Requests that may write, and requests soon after a
+    write in the same session, only use the primary."""
+
+    async def dispatch(
+        self, request: Request, call_next: RequestResponseEndpoint
+    ) -> Response:
+        with RoutingSession(
+            primary=reads_primary(request), expire_on_commit=False
+        ) as session:
+            request.state.session = session
+            return await call_next(request)
+
 
 class Admin(BaseAdmin):
     """Custom Admin class"""
 
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Replace the default session middleware, which only uses one engine
+        self.middlewares = [
+            Middleware(RoutingSessionMiddleware)
+            if middleware.cls is DBSessionMiddleware
+            else middleware
+            for middleware in self.middlewares
+        ]
+
     def custom_render_js(self, request: Request) -> Optional[str]:
         return request.url_for('static', path='js/custom-render.js')
@@ -1,8 +1,11 @@
 from fastapi import APIRouter
 
-from chowda.routers import events, sony_ci
+from chowda.routers import batches, collections, events, metrics, sony_ci
 
 api = APIRouter()
 
+api.include_router(batches, prefix='/batches')
+api.include_router(collections, prefix='/collections')
 api.include_router(events, prefix='/event')
+api.include_router(metrics, prefix='/metrics')
 api.include_router(sony_ci, prefix='/sony_ci')
@@ -4,8 +4,6 @@ Main Chowda application"""
 
 from fastapi import Depends, FastAPI
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware import Middleware
-from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import HTMLResponse
 from starlette.routing import Route
 
@@ -13,9 +11,15 @@ from chowda._version import __version__
 from chowda.admin import Admin
 from chowda.api import api
 from chowda.auth import OAuthProvider
-from chowda.auth.utils import get_admin_user, verified_access_token
-from chowda.config import SECRET, STATIC_DIR, TEMPLATES_DIR
+from chowda.auth.utils import (
+    get_admin_user,
+    get_clammer_user,
+    verified_access_token,
+)
+from chowda.config import STATIC_DIR, TEMPLATES_DIR
 from chowda.db import engine
+from chowda.event_buffer import close_event_buffer
+from chowda.exports import close_export_expirer, start_export_expirer
 from chowda.models import (
     MMIF,
     Batch,
@@ -23,11 +27,18 @@ from chowda.models import (
     Collection,
     MediaFile,
     MetaflowRun,
+    MMIFSummary,
     Pipeline,
     SonyCiAsset,
     User,
 )
+from chowda.partitions import close_partition_maintainer, start_partition_maintainer
+from chowda.progress import close_progress_broker
+from chowda.reconciler import close_run_reconciler
 from chowda.routers.dashboard import dashboard
+from chowda.routers.exports import exports
+from chowda.routers.progress import progress
+from chowda.sessions import session_middleware
 from chowda.views import (
     BatchView,
     ClamsAppView,
@@ -35,6 +46,7 @@ from chowda.views import (
     DashboardView,
     MediaFileView,
     MetaflowRunView,
+    MMIFSummaryView,
     MMIFView,
     PipelineView,
     SonyCiAssetView,
@@ -50,7 +62,15 @@ app = FastAPI(
             lambda r: HTMLResponse('<h1>Chowda!</h1><br><a href="/admin">Login</a>'),
         )
     ],
-    middleware=[Middleware(SessionMiddleware, secret_key=SECRET)],
+    middleware=[session_middleware()],
+    on_startup=[start_partition_maintainer, start_export_expirer],
+    on_shutdown=[
+        close_run_reconciler,
+        close_event_buffer,
+        close_progress_broker,
+        close_partition_maintainer,
+        close_export_expirer,
+    ],
 )
 app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
 
@@ -58,6 +78,10 @@ app.include_router(api, prefix='/api', dependencies=[Depends(verified_access_tok
 app.include_router(
     dashboard, prefix='/dashboard', dependencies=[Depends(get_admin_user)]
 )
+app.include_router(exports, prefix='/exports', dependencies=[Depends(get_clammer_user)])
+app.include_router(
+    progress, prefix='/progress', dependencies=[Depends(get_clammer_user)]
+)
 
 
 # Create admin
@@ -81,6 +105,7 @@ admin.add_view(PipelineView(Pipeline, icon='fa fa-boxes-stacked'))
 admin.add_view(UserView(User, icon='fa fa-users'))
 admin.add_view(MetaflowRunView(MetaflowRun, icon='fa fa-person-running'))
 admin.add_view(MMIFView(MMIF, icon='fa fa-person-running'))
+admin.add_view(MMIFSummaryView(MMIFSummary, icon='fa fa-list-check'))
 
 
 # Mount admin to app
@@ -0,0 +1,213 @@
+"""Archive
+
+Moves superseded MetaflowRuns, and MMIFs that nothing references, out of the hot
+`metaflow_runs` and `mmifs` tables into `archived_metaflow_runs` and
+`archived_mmifs`, so relationship loads and list views only read current rows.
+
+A run is superseded when a later run of the same MediaFile exists in the same batch.
+The latest run of each MediaFile in a batch is never archived, since batch progress
+is computed from it. An MMIF is archived with its superseded run, or on its own if it
+has no run, unless it is the latest MMIF of its MediaFile, a batch input, or the
+source of a batch MediaFile. Only rows older than `ARCHIVE_AFTER_DAYS` are archived.
+
+Rows are moved `ARCHIVE_BATCH_SIZE` at a time, one short transaction per batch, and
+rows locked by other transactions are skipped until the next run. A batch that fails
+is logged, and its rows are skipped for the rest of the run. The summaries of
+archived MMIFs are deleted. If `ARCHIVE_PARQUET_LOCATION` is set, each batch is also
+written to zstd-compressed Parquet files there once it is committed, which requires
+`pyarrow`.
+
+Run with `python -m chowda.archive`, e.g. from a scheduled job.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Collection, Dict, List, Optional, Set, Type
+
+from sqlalchemy import delete, exists, insert, or_
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, SQLModel, select
+
+from chowda.config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_PARQUET_LOCATION,
+)
+from chowda.db import engine
+from chowda.log import log
+from chowda.models import (
+    MMIF,
+    ArchivedMetaflowRun,
+    ArchivedMMIF,
+    LatestMMIF,
+    MediaFileBatchLink,
+    MetaflowRun,
+    MMIFBatchInputLink,
+    MMIFSummary,
+)
+
+LaterRun = aliased(MetaflowRun)
+
+# Runs with a later run of the same MediaFile in the same batch
+SUPERSEDED = exists().where(
+    LaterRun.batch_id == MetaflowRun.batch_id,
+    LaterRun.media_file_id == MetaflowRun.media_file_id,
+    LaterRun.created_at > MetaflowRun.created_at,
+)
+
+# MMIFs that must stay in the hot table
+REFERENCED = or_(
+    exists().where(LatestMMIF.mmif_id == MMIF.id),
+    exists().where(MMIFBatchInputLink.mmif_id == MMIF.id),
+    exists().where(MediaFileBatchLink.source_mmif_id == MMIF.id),
+)
+
+
+def archivable_runs(cutoff: datetime, limit: int, skipped: Collection[str] = ()):
+    """Superseded runs created before `cutoff`, with no referenced MMIF"""
+    return (
+        select(MetaflowRun.id)
+        .where(MetaflowRun.created_at < cutoff, SUPERSEDED)
+        .where(~exists().where(MMIF.metaflow_run_id == MetaflowRun.id, REFERENCED))
+        .where(MetaflowRun.id.not_in(skipped))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def run_mmifs(run_ids: List[str]):
+    """Unreferenced MMIFs of runs"""
+    return (
+        select(MMIF.id, MMIF.metaflow_run_id)
+        .where(MMIF.metaflow_run_id.in_(run_ids), ~REFERENCED)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def archivable_mmifs(cutoff: datetime, limit: int, skipped: Collection[int] = ()):
+    """Unreferenced MMIFs without a run, created before `cutoff`"""
+    return (
+        select(MMIF.id)
+        .where(MMIF.created_at < cutoff, MMIF.metaflow_run_id.is_(None), ~REFERENCED)
+        .where(MMIF.id.not_in(skipped))
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def write_parquet(location: str, name: str, rows: List[Dict[str, Any]]):
+    """Write archived rows to a new zstd-compressed Parquet file in location/name/"""
+    import pyarrow
+    import pyarrow.parquet
+
+    directory = os.path.join(location, name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory,
+        f'{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{rows[0]["id"]}.parquet',
+    )
+    pyarrow.parquet.write_table(
+        pyarrow.Table.from_pylist(rows), path, compression='zstd'
+    )
+
+
+def move(
+    db: Session, model: Type[SQLModel], archive: Type[SQLModel], ids: List[Any]
+) -> List[Dict[str, Any]]:
+    """Move rows from a table to its archive table, and return the moved rows"""
+    if not ids:
+        return []
+    rows = [
+        row._asdict()
+        for row in db.execute(
+            delete(model).where(model.id.in_(ids)).returning(*model.__table__.c)
+        )
+    ]
+    db.execute(insert(archive), rows)
+    return rows
+
+
+def archive_batch(
+    cutoff: datetime,
+    batch_size: int,
+    parquet_location: Optional[str] = None,
+    skipped: Optional[Dict[str, Set[Any]]] = None,
+) -> Dict[str, int]:
+    """Archive up to `batch_size` runs and `batch_size` MMIFs in one transaction, and
+    return the number of each archived
+
+    Runs and MMIFs in `skipped` are not archived. If the batch fails, its runs and
+    MMIFs are added to `skipped`.
+    """
+    skipped = skipped if skipped is not None else {'runs': set(), 'mmifs': set()}
+    run_ids, mmif_ids = [], []
+    try:
+        with Session(engine) as db:
+            run_ids = db.exec(
+                archivable_runs(cutoff, batch_size, skipped['runs'])
+            ).all()
+            mmifs = db.exec(run_mmifs(run_ids)).all()
+            # Runs are kept while any of their MMIFs is referenced or locked
+            kept = set(
+                db.exec(
+                    select(MMIF.metaflow_run_id).where(
+                        MMIF.metaflow_run_id.in_(run_ids),
+                        MMIF.id.not_in([mmif.id for mmif in mmifs]),
+                    )
+                )
+            )
+            run_ids = [run_id for run_id in run_ids if run_id not in kept]
+            mmif_ids = [
+                mmif.id for mmif in mmifs if mmif.metaflow_run_id not in kept
+            ] + db.exec(archivable_mmifs(cutoff, batch_size, skipped['mmifs'])).all()
+            db.execute(delete(MMIFSummary).where(MMIFSummary.mmif_id.in_(mmif_ids)))
+            moved = {
+                ArchivedMMIF: move(db, MMIF, ArchivedMMIF, mmif_ids),
+                ArchivedMetaflowRun: move(
+                    db, MetaflowRun, ArchivedMetaflowRun, run_ids
+                ),
+            }
+            db.commit()
+    except Exception:
+        skipped['runs'].update(run_ids)
+        skipped['mmifs'].update(mmif_ids)
+        raise
+    # Only committed rows are written, so a failed batch is never exported
+    if parquet_location:
+        for archive, rows in moved.items():
+            if rows:
+                write_parquet(parquet_location, archive.__tablename__, rows)
+    return {'mmifs': len(moved[ArchivedMMIF]), 'runs': len(moved[ArchivedMetaflowRun])}
+
+
+def archive(
+    after_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    parquet_location: Optional[str] = ARCHIVE_PARQUET_LOCATION,
+) -> Dict[str, int]:
+    """Archive superseded runs and unreferenced MMIFs older than `after_days`, in
+    batches, until none are left, and return the number of each archived"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=after_days)
+    totals = {'runs': 0, 'mmifs': 0}
+    skipped = {'runs': set(), 'mmifs': set()}
+    while True:
+        before = len(skipped['runs']) + len(skipped['mmifs'])
+        try:
+            counts = archive_batch(cutoff, batch_size, parquet_location, skipped)
+        except Exception:
+            log.exception('Error archiving a batch')
+            if len(skipped['runs']) + len(skipped['mmifs']) == before:
+                # Nothing was selected, so the next batch would fail the same way
+                break
+            continue
+        if not any(counts.values()):
+            break
+        for key, count in counts.items():
+            totals[key] += count
+        log.info(f'Archived {counts["runs"]} runs and {counts["mmifs"]} MMIFs')
+    return totals
+
+
+if __name__ == '__main__':
+    totals = archive()
+    print(f'Archived {totals["runs"]} runs and {totals["mmifs"]} MMIFs')
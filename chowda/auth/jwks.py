@@ -0,0 +1,130 @@
+"""JWKS
+
+A process-wide cache of the JSON Web Key Set used to verify API access tokens.
+
+Signing keys are looked up by their `kid`, so verifying a token only costs a local
+signature check. The key set is fetched once, and refreshed in the background when it
+is older than `AUTH0_JWKS_TTL` seconds, while the cached keys keep being served. A
+token signed with an unknown `kid` (e.g. after a key rotation) triggers a refresh,
+which waits at most `AUTH0_JWKS_TIMEOUT` seconds. Refreshes are single-flight:
+concurrent requests share one fetch, and unknown keys trigger at most one fetch every
+`AUTH0_JWKS_MIN_REFRESH` seconds.
+"""
+
+import threading
+from functools import lru_cache
+from time import monotonic
+from typing import Dict, Optional
+
+import httpx
+from jwt import PyJWK, PyJWKSet
+from jwt.exceptions import PyJWKClientError
+
+from chowda.config import (
+    AUTH0_JWKS_MIN_REFRESH,
+    AUTH0_JWKS_TIMEOUT,
+    AUTH0_JWKS_TTL,
+    AUTH0_JWKS_URL,
+)
+from chowda.log import log
+
+
+class JWKSCache:
+    """Signing keys from a JWKS URL, by `kid`
+
+    Attributes:
+        url: URL of the JSON Web Key Set
+        ttl: Seconds before the key set is refreshed in the background
+        min_refresh: Minimum seconds between refreshes for unknown keys
+        timeout: Seconds to wait for a key set to be fetched
+        counters: Number of keys found, key sets fetched, and fetch errors
+    """
+
+    def __init__(self, url: str, ttl: float, min_refresh: float, timeout: float):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.timeout = timeout
+        self.keys: Dict[Optional[str], PyJWK] = {}
+        self.fetched_at: Optional[float] = None
+        self.counters = dict.fromkeys(('hits', 'misses', 'fetches', 'errors'), 0)
+        self._lock = threading.Lock()
+        self._refreshed: Optional[threading.Event] = None
+
+    def fetch(self) -> Dict[Optional[str], PyJWK]:
+        """Download the key set"""
+        response = httpx.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return {key.key_id: key for key in PyJWKSet.from_dict(response.json()).keys}
+
+    def _refresh(self, refreshed: threading.Event):
+        try:
+            keys = self.fetch()
+        except Exception:
+            log.exception(f'Error fetching JWKS from {self.url}')
+            with self._lock:
+                self.counters['errors'] += 1
+        else:
+            with self._lock:
+                self.keys = keys
+                self.counters['fetches'] += 1
+        finally:
+            with self._lock:
+                self.fetched_at = monotonic()
+                self._refreshed = None
+            refreshed.set()
+
+    def refresh(self) -> threading.Event:
+        """Fetch the key set in a background thread, unless a fetch is already
+        running. Returns an Event that is set when the fetch is done."""
+        with self._lock:
+            if self._refreshed is not None:
+                return self._refreshed
+            refreshed = self._refreshed = threading.Event()
+        threading.Thread(
+            target=self._refresh, args=(refreshed,), name='jwks-refresh', daemon=True
+        ).start()
+        return refreshed
+
+    def signing_key(self, kid: Optional[str]) -> PyJWK:
+        """The signing key with a `kid`
+
+        Raises:
+            PyJWKClientError: if there is no such key, even after a refresh.
+        """
+        with self._lock:
+            key = self.keys.get(kid)
+            fetched_at = self.fetched_at
+        now = monotonic()
+        if key is not None:
+            with self._lock:
+                self.counters['hits'] += 1
+            if now - fetched_at > self.ttl:
+                self.refresh()
+            return key
+        with self._lock:
+            self.counters['misses'] += 1
+            refreshed = self._refreshed
+        if refreshed is None and (
+            fetched_at is None or now - fetched_at >= self.min_refresh
+        ):
+            refreshed = self.refresh()
+        if refreshed is not None:
+            refreshed.wait(self.timeout)
+        with self._lock:
+            key = self.keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: {kid}')
+        return key
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'keys': len(self.keys)}
+
+
+@lru_cache
+def jwks() -> JWKSCache:
+    """The process-wide cache of API signing keys"""
+    return JWKSCache(
+        AUTH0_JWKS_URL, AUTH0_JWKS_TTL, AUTH0_JWKS_MIN_REFRESH, AUTH0_JWKS_TIMEOUT
+    )
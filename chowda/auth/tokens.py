@@ -0,0 +1,81 @@
+"""Tokens
+
+A process-wide cache of verified API access tokens.
+
+Argo and other API clients send the same bearer token with every request, until it
+expires. Once a token has been decoded and its signature verified, the result is kept
+in a bounded LRU, keyed by a SHA-256 hash of the token so tokens themselves are never
+held in memory. Each entry expires at the token's `exp` claim. Tokens without an
+`exp` are never cached.
+"""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
+from time import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from chowda.config import ACCESS_TOKEN_CACHE_SIZE
+
+if TYPE_CHECKING:
+    from chowda.auth.utils import OAuthAccessToken
+
+
+def token_hash(token: str) -> bytes:
+    return sha256(token.encode()).digest()
+
+
+class AccessTokenCache:
+    """A bounded LRU of verified access tokens, until they expire
+
+    Attributes:
+        max_size: Maximum number of tokens cached
+        counters: Number of cache hits, misses and expired tokens
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.tokens: OrderedDict[bytes, Tuple[float, 'OAuthAccessToken']] = (
+            OrderedDict()
+        )
+        self.counters = dict.fromkeys(('hits', 'misses', 'expired'), 0)
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional['OAuthAccessToken']:
+        """A verified token, if it is cached and has not expired"""
+        key = token_hash(token)
+        with self._lock:
+            cached = self.tokens.get(key)
+            if cached is None:
+                self.counters['misses'] += 1
+                return None
+            expires_at, verified = cached
+            if expires_at <= time():
+                del self.tokens[key]
+                self.counters['expired'] += 1
+                return None
+            self.tokens.move_to_end(key)
+            self.counters['hits'] += 1
+            return verified
+
+    def add(self, token: str, verified: 'OAuthAccessToken', exp: Optional[float]):
+        """Cache a verified token until its `exp`"""
+        if exp is None:
+            return
+        with self._lock:
+            self.tokens[token_hash(token)] = (exp, verified)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'size': len(self.tokens)}
+
+
+@lru_cache
+def access_token_cache() -> Optional[AccessTokenCache]:
+    """The process-wide cache of verified access tokens, or None if disabled"""
+    if ACCESS_TOKEN_CACHE_SIZE <= 0:
+        return None
+    return AccessTokenCache(ACCESS_TOKEN_CACHE_SIZE)
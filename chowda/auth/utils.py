@@ -1,9 +1,10 @@
-from typing import Annotated, List, Set
+from functools import cached_property
+from typing import Annotated, FrozenSet, List, Set
 
 from fastapi import Depends, HTTPException, Request, status
 from pydantic import BaseModel, Field
 
-from chowda.config import AUTH0_API_AUDIENCE, AUTH0_JWKS_URL
+from chowda.config import AUTH0_API_AUDIENCE
 
 unauthorized_redirect = HTTPException(
     status_code=status.HTTP_303_SEE_OTHER,
@@ -23,6 +24,11 @@ class OAuthAccessToken(BaseModel):
     sub: str
     permissions: List[str] = []
 
+    @cached_property
+    def permission_set(self) -> FrozenSet[str]:
+        """The token's permissions, as a set for permission checks"""
+        return frozenset(self.permissions)
+
 
 class OAuthUser(BaseModel):
     """ID Token model for authorization."""
@@ -43,12 +49,19 @@ class OAuthUser(BaseModel):
 
 
 def get_oauth_user(request: Request) -> OAuthUser:
-    """Get the user token from the session."""
-    user = request.session.get('user', None)
-    if not user:
+    """Get the user token from the session.
+
+    The user is parsed once per request, and kept on `request.state`, since admin
+    views check permissions many times for each page."""
+    user = getattr(request.state, 'oauth_user', None)
+    if user is not None:
+        return user
+    session_user = request.session.get('user', None)
+    if not session_user:
         request.session['error'] = 'Not Logged In'
         raise unauthorized_redirect
-    return OAuthUser(**user)
+    request.state.oauth_user = OAuthUser(**session_user)
+    return request.state.oauth_user
 
 
 def get_admin_user(
@@ -63,6 +76,18 @@ def get_admin_user(
     return user
 
 
+def get_clammer_user(
+    request: Request, user: Annotated[OAuthUser, Depends(get_oauth_user)]
+) -> OAuthUser:
+    """Check if the user has the clammer or admin role using FastAPI Depends.
+    If not, sets a session error and raises an HTTPException."""
+    if not (user.is_clammer or user.is_admin):
+        request.session['error'] = 'Not Authorized'
+        raise unauthorized_redirect
+
+    return user
+
+
 def unverified_access_token(request: Request) -> str:
     """Extract and return the unverified access token from the Authorization header.
     Raises an HTTPUnauthorizedException if the header is missing or malformed."""
@@ -84,13 +109,14 @@ def unverified_access_token(request: Request) -> str:
 def jwt_signing_key(
     unverified_access_token: Annotated[str, Depends(unverified_access_token)]
 ) -> str:
-    """Get the JWT signing key from the JWKS URL."""
-    from jwt import PyJWKClient
+    """Get the JWT signing key for the token's `kid` from the cached JWKS."""
+    from jwt import get_unverified_header
+
+    from chowda.auth.jwks import jwks
 
-    jwks_client = PyJWKClient(AUTH0_JWKS_URL)
     try:
-        signing_key = jwks_client.get_signing_key_from_jwt(unverified_access_token)
-        return signing_key.key
+        kid = get_unverified_header(unverified_access_token).get('kid')
+        return jwks().signing_key(kid).key
 
     except Exception as exc:
         raise HTTPException(
@@ -104,9 +130,19 @@ def verified_access_token(
     jwt_signing_key: Annotated[str, Depends(jwt_signing_key)],
 ) -> OAuthAccessToken:
     """Decodes and verifies an access token. If any exceptions occur, an
-    HTTPUnauthorizedException is raised from the original exception."""
+    HTTPUnauthorizedException is raised from the original exception.
+
+    Verified tokens are cached until they expire."""
     from jwt import decode
 
+    from chowda.auth.tokens import access_token_cache
+
+    cache = access_token_cache()
+    if cache is not None:
+        cached = cache.get(unverified_access_token)
+        if cached is not None:
+            return cached
+
     try:
         decoded_token = decode(
             unverified_access_token,
@@ -114,13 +150,17 @@ def verified_access_token(
             algorithms=['RS256', 'HS256'],
             audience='https://chowda.wgbh-mla.org/api',
         )
-        return OAuthAccessToken(**decoded_token)
+        token = OAuthAccessToken(**decoded_token)
 
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc)
         ) from exc
 
+    if cache is not None:
+        cache.add(unverified_access_token, token, decoded_token.get('exp'))
+    return token
+
 
 def permissions(permissions: str | List[str] | Set[str]) -> None:
     """Dependency function to check if token has required permissions.
@@ -138,7 +178,7 @@ def permissions(permissions: str | List[str] | Set[str]) -> None:
     ) -> None:
         """Verify token has all required permissions, or raise a 403 Forbidden exception
         with the missing permissions in the detail message."""
-        missing_permissions = permissions - set(token.permissions)
+        missing_permissions = permissions - token.permission_set
         if missing_permissions:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -1,4 +1,5 @@
-from os import environ
+from os import environ, path
+from tempfile import gettempdir
 
 DB_USER = environ.get('DB_USER', 'postgres')
 DB_PASSWORD = environ.get('DB_PASSWORD', 'postgres')
@@ -8,6 +9,26 @@ DB_PORT = environ.get('DB_PORT', '5432')
 DB_URL = environ.get(
     'DB_URL', f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 )
+# The database URL for the async engine. Defaults to DB_URL with the asyncpg driver.
+ASYNC_DB_URL = environ.get('ASYNC_DB_URL')
+# Connection pool profile: 'queue' for long-running web workers, or 'null' to open a
+# connection for each use, for short-lived processes like Metaflow steps
+DB_POOL = environ.get('DB_POOL', 'queue')
+# Connections kept open in each pool, and extra connections allowed under load
+DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a connection from a full pool
+DB_POOL_TIMEOUT = float(environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which pooled connections are replaced. -1 keeps them open.
+DB_POOL_RECYCLE = int(environ.get('DB_POOL_RECYCLE', 30 * 60))
+# Test pooled connections before using them
+DB_POOL_PRE_PING = environ.get('DB_POOL_PRE_PING', 'true').lower() != 'false'
+# An optional read replica, for admin pages and exports. Defaults to the primary.
+READ_DB_URL = environ.get('READ_DB_URL')
+# The read replica URL for the async engine. Defaults to READ_DB_URL with asyncpg.
+ASYNC_READ_DB_URL = environ.get('ASYNC_READ_DB_URL')
+# Seconds an admin session reads from the primary after a write, to cover replica lag
+READ_AFTER_WRITE_SECONDS = float(environ.get('READ_AFTER_WRITE_SECONDS', 30))
 DEBUG = bool(environ.get('DEBUG'))
 
 TEMPLATES_DIR = environ.get('TEMPLATES_DIR', 'templates')
@@ -17,6 +38,14 @@ AUTH0_CLIENT_ID = environ.get('AUTH0_CLIENT_ID')
 AUTH0_CLIENT_SECRET = environ.get('AUTH0_CLIENT_SECRET')
 AUTH0_DOMAIN = environ.get('AUTH0_DOMAIN')
 AUTH0_JWKS_URL = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+# Seconds before the cached JWKS is refreshed in the background
+AUTH0_JWKS_TTL = float(environ.get('AUTH0_JWKS_TTL', 10 * 60))
+# Minimum seconds between JWKS refreshes for tokens with an unknown key id
+AUTH0_JWKS_MIN_REFRESH = float(environ.get('AUTH0_JWKS_MIN_REFRESH', 30))
+# Seconds to wait for the JWKS to be fetched
+AUTH0_JWKS_TIMEOUT = float(environ.get('AUTH0_JWKS_TIMEOUT', 5))
+# Number of verified API access tokens cached until they expire. 0 disables the cache.
+ACCESS_TOKEN_CACHE_SIZE = int(environ.get('ACCESS_TOKEN_CACHE_SIZE', 10_000))
 AUTH0_API_AUDIENCE = environ.get(
     'AUTH0_API_AUDIENCE', 'https://chowda.wgbh-mla.org/api'
 )
@@ -26,3 +55,87 @@ SECRET = environ.get('CHOWDA_SECRET')
 MMIF_S3_BUCKET_NAME = environ.get('MMIF_S3_BUCKET_NAME', 'clams-mmif')
 
 MARIO_URL = environ.get('MARIO_URL', 'https://mario.wgbh-mla.org/')
+
+# Number of GUIDs validated and linked per statement when uploading GUID lists
+GUID_CHUNK_SIZE = int(environ.get('GUID_CHUNK_SIZE', 10000))
+
+# Number of MMIF objects fetched from S3 at once while streaming a zip download, and the
+# size of the S3 connection pool
+MMIF_S3_CONCURRENCY = int(environ.get('MMIF_S3_CONCURRENCY', 8))
+# Number of attempts to fetch each MMIF from S3
+MMIF_S3_RETRIES = int(environ.get('MMIF_S3_RETRIES', 3))
+# Number of seconds presigned MMIF URLs in download manifests are valid for
+MMIF_PRESIGNED_URL_EXPIRES = int(environ.get('MMIF_PRESIGNED_URL_EXPIRES', 3600))
+
+# Directory for the local MMIF cache, which can be shared by several workers
+MMIF_CACHE_DIR = environ.get(
+    'MMIF_CACHE_DIR', path.join(gettempdir(), 'chowda-mmif-cache')
+)
+# Maximum size of the local MMIF cache in bytes. 0 disables the cache.
+MMIF_CACHE_SIZE = int(environ.get('MMIF_CACHE_SIZE', 2 * 1024**3))
+# Seconds a cached MMIF is served without revalidating it with S3
+MMIF_CACHE_TTL = int(environ.get('MMIF_CACHE_TTL', 5 * 60))
+
+# Where finished MMIF export archives are stored: a local directory, or s3://bucket/prefix
+EXPORT_LOCATION = environ.get(
+    'EXPORT_LOCATION', path.join(gettempdir(), 'chowda-exports')
+)
+# Number of seconds finished export archives are kept
+EXPORT_TTL = int(environ.get('EXPORT_TTL', 7 * 24 * 60 * 60))
+# Number of export jobs run at the same time
+EXPORT_WORKERS = int(environ.get('EXPORT_WORKERS', 2))
+# Run export jobs in a process pool instead of threads
+EXPORT_PROCESSES = bool(environ.get('EXPORT_PROCESSES'))
+# Seconds without progress before a queued or running export is restarted
+EXPORT_STALE_AFTER = int(environ.get('EXPORT_STALE_AFTER', 10 * 60))
+# Seconds between checks for export archives past their TTL
+EXPORT_EXPIRE_INTERVAL = int(environ.get('EXPORT_EXPIRE_INTERVAL', 60 * 60))
+
+# Summarize the contents of MMIFs when they are registered
+MMIF_SUMMARIES = environ.get('MMIF_SUMMARIES', 'true').lower() in ('true', '1', 'yes')
+# Number of MMIFs summarized at the same time in each process
+MMIF_SUMMARY_WORKERS = int(environ.get('MMIF_SUMMARY_WORKERS', 4))
+
+# Seconds MetaflowRun progress from Argo events is buffered before it is written.
+# 0 writes every event immediately.
+EVENT_FLUSH_INTERVAL = float(environ.get('EVENT_FLUSH_INTERVAL', 1))
+# Number of runs with buffered progress that triggers an early write
+EVENT_BUFFER_SIZE = int(environ.get('EVENT_BUFFER_SIZE', 500))
+# Number of threads looking up the status of Metaflow runs missing from events
+EVENT_RECONCILE_WORKERS = int(environ.get('EVENT_RECONCILE_WORKERS', 4))
+# Seconds Metaflow Run objects are cached for by the reconciler
+METAFLOW_RUN_CACHE_TTL = float(environ.get('METAFLOW_RUN_CACHE_TTL', 10))
+# Number of processed event keys kept in memory to answer duplicate events
+EVENT_KEY_CACHE_SIZE = int(environ.get('EVENT_KEY_CACHE_SIZE', 100_000))
+# Seconds processed event keys are kept in the database
+EVENT_KEY_TTL = int(environ.get('EVENT_KEY_TTL', 7 * 24 * 60 * 60))
+# Minimum seconds between deletions of expired event keys
+EVENT_KEY_CLEANUP_INTERVAL = int(environ.get('EVENT_KEY_CLEANUP_INTERVAL', 60 * 60))
+
+# Broker of live batch progress: 'local' for a single worker process, or 'postgres'
+# to share progress between workers with LISTEN/NOTIFY
+PROGRESS_BROKER = environ.get('PROGRESS_BROKER', 'local')
+# Seconds between keepalive comments on idle progress streams
+PROGRESS_KEEPALIVE = float(environ.get('PROGRESS_KEEPALIVE', 15))
+# Number of progress updates kept for each slow progress stream
+PROGRESS_QUEUE_SIZE = int(environ.get('PROGRESS_QUEUE_SIZE', 100))
+
+# Where admin sessions are stored: 'postgres', 'memory' (a single process, for tests
+# and development) or 'cookie' (signed cookies)
+SESSION_BACKEND = environ.get('SESSION_BACKEND', 'postgres')
+# Seconds admin sessions last without activity
+SESSION_MAX_AGE = int(environ.get('SESSION_MAX_AGE', 14 * 24 * 60 * 60))
+
+# Number of monthly partitions of metaflow_runs and mmifs created ahead of time
+PARTITION_MONTHS_AHEAD = int(environ.get('PARTITION_MONTHS_AHEAD', 3))
+# Seconds between checks for missing monthly partitions
+PARTITION_INTERVAL = int(environ.get('PARTITION_INTERVAL', 24 * 60 * 60))
+# Seconds partition maintenance waits for table locks before it gives up until the
+# next check
+PARTITION_LOCK_TIMEOUT = float(environ.get('PARTITION_LOCK_TIMEOUT', 5))
+# Superseded MetaflowRuns and unreferenced MMIFs older than this many days are archived
+ARCHIVE_AFTER_DAYS = int(environ.get('ARCHIVE_AFTER_DAYS', 30))
+# Number of runs, and of MMIFs, archived in each transaction
+ARCHIVE_BATCH_SIZE = int(environ.get('ARCHIVE_BATCH_SIZE', 1000))
+# Directory archived rows are also exported to, as Parquet files. Requires pyarrow.
+ARCHIVE_PARQUET_LOCATION = environ.get('ARCHIVE_PARQUET_LOCATION')
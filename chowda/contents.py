@@ -0,0 +1,86 @@
+"""Contents
+
+Content hashes of MMIFs, so re-runs that produce byte-identical MMIFs share one
+`MMIFContent`, and downloads only transfer identical contents once.
+
+Hashes are computed while MMIFs are streamed from S3 to be summarized, so hashing
+does not read any MMIF a second time.
+"""
+
+from hashlib import sha256
+from typing import BinaryIO, Iterable, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from chowda.models import MMIF, MMIFContent
+
+
+class HashingReader:
+    """Computes the SHA-256 of the bytes read from a file-like object"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.hash = sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+def link_content(db: Session, mmif: MMIF, content_hash: str, size: int) -> str:
+    """Link a MMIF to its contents, registering them if they are new.
+
+    Returns:
+        The location of the linked contents: the MMIF's own location, or that of an
+        earlier MMIF with identical contents.
+    """
+    db.execute(
+        insert(MMIFContent)
+        .values(sha256=content_hash, mmif_location=mmif.mmif_location, size=size)
+        .on_conflict_do_nothing(index_elements=['sha256'])
+    )
+    db.execute(update(MMIF).where(MMIF.id == mmif.id).values(content_hash=content_hash))
+    return db.scalars(
+        select(MMIFContent.mmif_location).where(MMIFContent.sha256 == content_hash)
+    ).one()
+
+
+def content_location():
+    """The location to download a MMIF from: its contents, if they are known"""
+    return func.coalesce(MMIFContent.mmif_location, MMIF.mmif_location)
+
+
+def selected_mmifs(
+    mmif_ids: Iterable[int] = (), batch_ids: Optional[Iterable[int]] = None
+):
+    """A filter for MMIFs by id, or for the output MMIFs of batches, so the ids of
+    large batches are never loaded"""
+    if batch_ids is not None:
+        return MMIF.batch_output_id.in_(batch_ids)
+    return MMIF.id.in_(mmif_ids)
+
+
+def distinct_mmif_locations(
+    db: Session, mmif_ids: Iterable[int] = (), batch_ids: Optional[Iterable[int]] = None
+) -> List[str]:
+    """Download locations of MMIFs, or of the output MMIFs of `batch_ids`, in MMIF
+    order, with identical contents only once.
+
+    MMIFs without a content hash are never collapsed."""
+    location = content_location()
+    return db.exec(
+        select(location)
+        .select_from(MMIF)
+        .outerjoin(MMIFContent, MMIFContent.sha256 == MMIF.content_hash)
+        .where(selected_mmifs(mmif_ids, batch_ids))
+        .group_by(location)
+        .order_by(func.min(MMIF.id))
+    ).all()
@@ -1,20 +1,200 @@
+import threading
+from time import perf_counter, time
+from typing import Any, AsyncIterator, Dict, Optional, Type
+
 from psycopg2.extensions import register_adapter
 from pydantic_core import Url
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, Pool, QueuePool
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.requests import Request
 
-from chowda.config import DB_URL, DEBUG
+from chowda.config import (
+    ASYNC_DB_URL,
+    ASYNC_READ_DB_URL,
+    DB_MAX_OVERFLOW,
+    DB_POOL,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_URL,
+    DEBUG,
+    READ_AFTER_WRITE_SECONDS,
+    READ_DB_URL,
+)
 from chowda.utils import adapt_url
 
 register_adapter(Url, adapt_url)
 
-engine = create_engine(DB_URL, echo=DEBUG)
 
+class PoolTimer:
+    """Counts connection checkouts from a pool, and how long they waited"""
+
+    def __init__(self):
+        self.counters = {'checkouts': 0, 'timeouts': 0, 'wait': 0.0, 'max_wait': 0.0}
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.counters['timeouts' if timed_out else 'checkouts'] += 1
+            self.counters['wait'] += seconds
+            self.counters['max_wait'] = max(self.counters['max_wait'], seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = self.counters['checkouts'] + self.counters['timeouts']
+            return {
+                'checkouts': self.counters['checkouts'],
+                'timeouts': self.counters['timeouts'],
+                'mean_wait_ms': 1000 * self.counters['wait'] / waits if waits else 0,
+                'max_wait_ms': 1000 * self.counters['max_wait'],
+            }
+
+
+def timed_pool(pool_class: Type[Pool]) -> Type[Pool]:
+    """A pool class that times checkouts. Recreated pools share the same timer."""
+
+    class TimedPool(pool_class):
+        timer = PoolTimer()
+
+        def _do_get(self):
+            start = perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                self.timer.record(perf_counter() - start, timed_out=True)
+                raise
+            self.timer.record(perf_counter() - start)
+            return connection
+
+    TimedPool.__name__ = f'Timed{pool_class.__name__}'
+    return TimedPool
+
+
+def pool_options(queue_pool: Type[Pool], profile: str = DB_POOL) -> Dict[str, Any]:
+    """Engine options for a `DB_POOL` profile"""
+    if profile == 'null':
+        return {'poolclass': timed_pool(NullPool)}
+    if profile != 'queue':
+        raise ValueError(f'Unknown DB_POOL: {profile}')
+    return {
+        'poolclass': timed_pool(queue_pool),
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+def pool_stats(engine: Engine | AsyncEngine) -> Dict[str, Any]:
+    """Checkout counts and latency of an engine's pool, and its connection gauges"""
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__, **pool.timer.stats()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return stats
+
+
+engine = create_engine(DB_URL, echo=DEBUG, **pool_options(QueuePool))
+
+# The same database, through asyncpg, for API routers
+async_engine = create_async_engine(
+    ASYNC_DB_URL or make_url(DB_URL).set(drivername='postgresql+asyncpg'),
+    echo=DEBUG,
+    **pool_options(AsyncAdaptedQueuePool),
+)
+
+
+# The read replica, or the primary if there is none
+read_engine = (
+    create_engine(READ_DB_URL, echo=DEBUG, **pool_options(QueuePool))
+    if READ_DB_URL
+    else engine
+)
+async_read_engine = (
+    create_async_engine(
+        ASYNC_READ_DB_URL or make_url(READ_DB_URL).set(drivername='postgresql+asyncpg'),
+        echo=DEBUG,
+        **pool_options(AsyncAdaptedQueuePool),
+    )
+    if READ_DB_URL
+    else async_engine
+)
+
+
+class RoutingSession(Session):
+    """A Session that reads from the read replica, and writes to the primary.
+
+    Once it writes, or locks rows, it only uses the primary, so it always reads its
+    own writes. With `primary=True`, it never uses the replica."""
+
+    def __init__(
+        self,
+        primary: bool = False,
+        primary_engine: Optional[Engine] = None,
+        replica_engine: Optional[Engine] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.primary = primary
+        self.primary_engine = primary_engine or engine
+        self.replica_engine = replica_engine or read_engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs) -> Engine:
+        if not self.primary and (
+            self._flushing
+            or not getattr(clause, 'is_select', False)
+            or getattr(clause, '_for_update_arg', None) is not None
+        ):
+            self.primary = True
+        return self.primary_engine if self.primary else self.replica_engine
+
+
+def may_write(request: Request) -> bool:
+    """Whether a request may write: anything but GET requests, and actions"""
+    return request.method not in ('GET', 'HEAD') or request.url.path.endswith(
+        ('/action', '/row-action')
+    )
+
+
+def reads_primary(request: Request) -> bool:
+    """Whether a request must read from the primary, because it may write, or its
+    session wrote within `READ_AFTER_WRITE_SECONDS`. Write requests mark their
+    session, so following requests read their writes."""
+    if 'session' not in request.scope:
+        return may_write(request)
+    if may_write(request):
+        request.session['primary_until'] = time() + READ_AFTER_WRITE_SECONDS
+        return True
+    primary_until = request.session.get('primary_until')
+    if primary_until is not None and primary_until < time():
+        del request.session['primary_until']
+        return False
+    return primary_until is not None
+
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency: an AsyncSession for the request"""
+    async with AsyncSession(async_engine, expire_on_commit=False) as db:
+        yield db
 
-# TODO: implement async engine
-def create_async_engine():
-    from sqlmodel.ext.asyncio.session import AsyncEngine
 
-    return AsyncEngine(engine)
+async def get_async_read_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency: a read-only AsyncSession on the read replica, unless the
+    request must read from the primary"""
+    bind = async_engine if reads_primary(request) else async_read_engine
+    async with AsyncSession(bind, expire_on_commit=False) as db:
+        yield db
 
 
 def init_db():
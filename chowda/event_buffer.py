@@ -0,0 +1,242 @@
+"""Event Buffer
+
+A write-behind buffer for MetaflowRun progress from Argo events.
+
+Each step and task of a run sends an event, but only the latest progress of a run is
+worth storing. Progress is coalesced by `run_id` in memory, and written for all
+buffered runs in a single `UPDATE ... FROM (VALUES ...)` statement, every
+`EVENT_FLUSH_INTERVAL` seconds, or as soon as `EVENT_BUFFER_SIZE` runs are buffered.
+
+Terminal events, which finish a run, are not buffered: they are written immediately
+by the events router, and discard any progress still buffered for the run. Buffered
+progress never overwrites a finished run, or progress from a later event. The keys of
+buffered events are stored in the same transaction as their progress, and the progress
+that was written is published to the Batch pages following it.
+
+The ids of runs that events were buffered for are remembered, so only the first event
+of a run checks that the run exists. Expired event keys are deleted by the flush
+thread.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from sqlalchemy import DateTime, String, column, or_, update, values
+from sqlmodel import Session
+
+from chowda.config import EVENT_BUFFER_SIZE, EVENT_FLUSH_INTERVAL
+from chowda.db import engine
+from chowda.event_keys import delete_expired_event_keys, event_keys, store_keys
+from chowda.log import log
+from chowda.models import MetaflowRun
+from chowda.progress import progress_delta, publish_progress
+
+# MetaflowRun columns written from buffered events
+PROGRESS_COLUMNS = ('current_step', 'current_task')
+
+# Number of run ids remembered as existing
+KNOWN_RUNS = 10_000
+
+Progress = Dict[str, Any]
+
+
+def merge(pending: Dict[str, Progress], run_id: str, progress: Progress):
+    """Buffer the progress of a run, keeping the latest event, and the keys of all"""
+    existing = pending.get(run_id)
+    if existing is None:
+        pending[run_id] = progress
+        return
+    latest = progress if progress['event_at'] >= existing['event_at'] else existing
+    pending[run_id] = {**latest, 'keys': existing['keys'] | progress['keys']}
+
+
+class EventBuffer:
+    """Coalesces MetaflowRun progress by run id, and writes it in batches
+
+    Attributes:
+        interval: Maximum number of seconds progress is buffered for
+        max_size: Number of buffered runs that triggers a flush
+        counters: Number of events buffered, runs written and flushes in this process
+    """
+
+    def __init__(self, interval: float, max_size: int):
+        self.interval = interval
+        self.max_size = max_size
+        self.pending: Dict[str, Progress] = {}
+        self.known_runs: OrderedDict[str, None] = OrderedDict()
+        self.counters = dict.fromkeys(('events', 'written', 'flushes', 'errors'), 0)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def add(
+        self,
+        run_id: str,
+        event_at: datetime,
+        key: Optional[str] = None,
+        **progress: Optional[str],
+    ) -> bool:
+        """Buffer the progress of a run from an event sent at `event_at`, replacing
+        any progress buffered from earlier events.
+
+        Returns False if the buffer is closed, and the progress must be written
+        directly."""
+        with self._lock:
+            if self._closed:
+                return False
+            merge(
+                self.pending,
+                run_id,
+                {**progress, 'event_at': event_at, 'keys': {key} if key else set()},
+            )
+            self.known_runs[run_id] = None
+            self.known_runs.move_to_end(run_id)
+            while len(self.known_runs) > KNOWN_RUNS:
+                self.known_runs.popitem(last=False)
+            self.counters['events'] += 1
+            full = len(self.pending) >= self.max_size
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.run, name='event-buffer', daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def knows(self, run_id: str) -> bool:
+        """Whether progress has been buffered for a run, which therefore exists"""
+        with self._lock:
+            return run_id in self.known_runs
+
+    def discard(self, run_id: str):
+        """Drop any progress buffered for a run"""
+        with self._lock:
+            self.pending.pop(run_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'pending': len(self.pending)}
+
+    def run(self):
+        """Flush the buffer every `interval` seconds, or when it is full, and delete
+        expired event keys when they are due"""
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+            if event_keys().cleanup_due():
+                try:
+                    delete_expired_event_keys()
+                except Exception:
+                    log.exception('Error deleting expired event keys')
+
+    def flush(self) -> int:
+        """Write all buffered progress. Returns the number of runs updated.
+
+        Progress that fails to be written is buffered again, merged with any progress
+        for the same run that has arrived in the meantime."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            try:
+                updated = write_progress(batch)
+            except Exception:
+                log.exception(f'Error writing progress of {len(batch)} runs')
+                with self._lock:
+                    self.counters['errors'] += 1
+                    for run_id, progress in batch.items():
+                        merge(self.pending, run_id, progress)
+                return 0
+            with self._lock:
+                self.counters['written'] += len(updated)
+                self.counters['flushes'] += 1
+            publish_progress(
+                progress_delta(
+                    run_id,
+                    batch_id,
+                    **{name: batch[run_id].get(name) for name in PROGRESS_COLUMNS},
+                )
+                for run_id, batch_id in updated.items()
+            )
+            missing = batch.keys() - updated.keys()
+            if missing:
+                log.info(f'Progress not written for {len(missing)} runs')
+            return len(updated)
+
+    def close(self):
+        """Stop the background thread, and write any remaining progress"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout=self.interval + 30)
+        self.flush()
+
+
+def write_progress(batch: Dict[str, Progress]) -> Dict[str, Optional[int]]:
+    """Update the progress of unfinished runs in one statement, unless a later event
+    has already been written, and store the keys of the events.
+
+    Returns:
+        The ids of the runs that were updated, with the ids of their batches.
+    """
+    progress = values(
+        column('id', String),
+        *(column(name, String) for name in PROGRESS_COLUMNS),
+        column('event_at', DateTime(timezone=True)),
+        name='progress',
+    ).data(
+        [
+            (run_id, *(run.get(name) for name in PROGRESS_COLUMNS), run['event_at'])
+            for run_id, run in batch.items()
+        ]
+    )
+    keys = set().union(*(run['keys'] for run in batch.values()))
+    with Session(engine) as db:
+        updated = db.execute(
+            update(MetaflowRun)
+            .where(MetaflowRun.id == progress.c.id)
+            .where(MetaflowRun.finished.is_(False))
+            .where(
+                or_(
+                    MetaflowRun.last_event_at.is_(None),
+                    MetaflowRun.last_event_at <= progress.c.event_at,
+                )
+            )
+            .values(
+                {
+                    **{name: progress.c[name] for name in PROGRESS_COLUMNS},
+                    'last_event_at': progress.c.event_at,
+                }
+            )
+            .returning(MetaflowRun.id, MetaflowRun.batch_id)
+        ).all()
+        if keys:
+            db.execute(store_keys(keys))
+        db.commit()
+    return dict(updated)
+
+
+@lru_cache
+def event_buffer() -> Optional[EventBuffer]:
+    """The process-wide event buffer, or None if buffering is disabled"""
+    if EVENT_FLUSH_INTERVAL <= 0:
+        return None
+    return EventBuffer(EVENT_FLUSH_INTERVAL, EVENT_BUFFER_SIZE)
+
+
+def close_event_buffer():
+    """Write buffered events before the process exits"""
+    if event_buffer.cache_info().currsize:
+        buffer = event_buffer()
+        if buffer is not None:
+            buffer.close()
@@ -0,0 +1,130 @@
+"""Event Keys
+
+Idempotency keys for Argo events, so retried and replayed events are only processed
+once.
+
+Keys of recent events are kept in a bounded in-memory LRU, which answers most
+duplicates without touching the database. Keys are also stored in the `event_keys`
+table, with the progress they record, so duplicates are recognized across workers and
+restarts. Stored keys are deleted after `EVENT_KEY_TTL` seconds, outside of event
+requests.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from time import monotonic
+from typing import Any, Dict, Iterable
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+
+from chowda.config import (
+    EVENT_KEY_CACHE_SIZE,
+    EVENT_KEY_CLEANUP_INTERVAL,
+    EVENT_KEY_TTL,
+)
+from chowda.db import engine
+from chowda.models import EventKey
+
+
+def event_key(name: str, payload: Dict[str, Any]) -> str:
+    """The idempotency key of an event"""
+    parts = (
+        payload.get('flow_name'),
+        payload.get('run_id'),
+        payload.get('step_name'),
+        payload.get('task_id'),
+    )
+    return f'{name}:' + '/'.join(str(part or '') for part in parts)
+
+
+def event_time(payload: Dict[str, Any]) -> datetime:
+    """When an event was sent, from its `timestamp`, or now if it has none"""
+    timestamp = payload.get('timestamp')
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+    if isinstance(timestamp, str):
+        try:
+            sent_at = datetime.fromisoformat(timestamp)
+        except ValueError:
+            pass
+        else:
+            return sent_at if sent_at.tzinfo else sent_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc)
+
+
+class EventKeys:
+    """A bounded LRU of the keys of recently processed events
+
+    Attributes:
+        max_size: Maximum number of keys kept in memory
+        counters: Number of duplicates answered from memory and from the database
+    """
+
+    def __init__(self, max_size: int, cleanup_interval: float):
+        self.max_size = max_size
+        self.cleanup_interval = cleanup_interval
+        self.keys: OrderedDict[str, None] = OrderedDict()
+        self.counters = dict.fromkeys(('memory_hits', 'db_hits', 'new'), 0)
+        self._last_cleanup = monotonic()
+        self._lock = threading.Lock()
+
+    def seen(self, key: str) -> bool:
+        """Whether a key is in memory, marking it as recently used"""
+        with self._lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return True
+            return False
+
+    def add(self, key: str, stored: bool = False):
+        """Remember a key. `stored` keys were found in the database."""
+        with self._lock:
+            self.keys[key] = None
+            self.keys.move_to_end(key)
+            while len(self.keys) > self.max_size:
+                self.keys.popitem(last=False)
+            self.counters['db_hits' if stored else 'new'] += 1
+
+    def cleanup_due(self) -> bool:
+        """Whether expired keys should be deleted, at most once per interval"""
+        with self._lock:
+            if monotonic() - self._last_cleanup < self.cleanup_interval:
+                return False
+            self._last_cleanup = monotonic()
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'size': len(self.keys)}
+
+
+def store_keys(keys: Iterable[str]):
+    """A statement storing event keys, ignoring keys that are already stored"""
+    return (
+        insert(EventKey)
+        .values([{'key': key} for key in keys])
+        .on_conflict_do_nothing(index_elements=['key'])
+    )
+
+
+def delete_expired_keys():
+    """A statement deleting keys older than `EVENT_KEY_TTL`"""
+    return delete(EventKey).where(
+        EventKey.created_at < func.now() - timedelta(seconds=EVENT_KEY_TTL)
+    )
+
+
+def delete_expired_event_keys():
+    """Delete keys older than `EVENT_KEY_TTL` in their own transaction"""
+    with engine.begin() as db:
+        db.execute(delete_expired_keys())
+
+
+@lru_cache
+def event_keys() -> EventKeys:
+    """The process-wide LRU of event keys"""
+    return EventKeys(EVENT_KEY_CACHE_SIZE, EVENT_KEY_CLEANUP_INTERVAL)
@@ -0,0 +1,309 @@
+"""Exports
+
+Background jobs that build zip archives of MMIFs, so large downloads do not tie up a
+request while MMIFs are transferred from S3.
+
+Finished archives are stored in `EXPORT_LOCATION`, either a local directory or an
+`s3://bucket/prefix` URL, and deleted after `EXPORT_TTL` seconds. Requests for the
+same set of MMIFs share one job and one archive. Expired archives are deleted by a
+background thread every `EXPORT_EXPIRE_INTERVAL` seconds.
+"""
+
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from hashlib import sha256
+from multiprocessing import get_context
+from tempfile import NamedTemporaryFile
+from time import monotonic, time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+from starlette.responses import FileResponse, RedirectResponse, Response
+
+from chowda.config import (
+    EXPORT_EXPIRE_INTERVAL,
+    EXPORT_LOCATION,
+    EXPORT_PROCESSES,
+    EXPORT_STALE_AFTER,
+    EXPORT_TTL,
+    EXPORT_WORKERS,
+    MMIF_PRESIGNED_URL_EXPIRES,
+)
+from chowda.contents import distinct_mmif_locations
+from chowda.db import engine, read_engine
+from chowda.log import log
+from chowda.models import ExportJob, ExportStatus
+from chowda.s3 import iter_mmif_objects, mmif_zip_entries, s3_client
+from chowda.zipstream import zip_stream
+
+# Minimum number of seconds between progress updates of a running export
+PROGRESS_INTERVAL = 2
+
+ACTIVE = (ExportStatus.QUEUED, ExportStatus.RUNNING)
+
+
+def export_key(mmif_ids: Iterable[int]) -> str:
+    """A key identifying a set of MMIFs, independent of order and duplicates"""
+    ids = ','.join(str(id) for id in sorted(set(mmif_ids)))
+    return sha256(ids.encode()).hexdigest()
+
+
+def parse_s3_url(url: str) -> Tuple[str, str]:
+    """Split an s3://bucket/key URL into (bucket, key)"""
+    bucket, _, key = url.removeprefix('s3://').partition('/')
+    return bucket, key
+
+
+def init_worker():
+    """Do not share database connections or S3 clients with the parent process"""
+    engine.dispose(close=False)
+    s3_client.cache_clear()
+
+
+@lru_cache
+def export_executor() -> Executor:
+    """The process-wide executor that runs export jobs"""
+    if EXPORT_PROCESSES:
+        return ProcessPoolExecutor(
+            max_workers=EXPORT_WORKERS,
+            mp_context=get_context('spawn'),
+            initializer=init_worker,
+        )
+    return ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+
+
+def submit_export(
+    db: Session, mmif_ids: List[int], batch_id: Optional[int] = None
+) -> ExportJob:
+    """Start an export of `mmif_ids` in the background, or return the existing job for
+    the same MMIFs.
+
+    Failed, expired and stale jobs are restarted. Commits the session.
+    """
+    mmif_ids = sorted(set(mmif_ids))
+    key = export_key(mmif_ids)
+    created = db.execute(
+        insert(ExportJob)
+        .values(key=key, batch_id=batch_id, status=ExportStatus.QUEUED)
+        .on_conflict_do_nothing(index_elements=['key'])
+    ).rowcount
+    job = db.exec(select(ExportJob).where(ExportJob.key == key).with_for_update()).one()
+    stale = job.status in ACTIVE and is_stale(job)
+    if created or stale or job.status == ExportStatus.FAILED or is_expired(job):
+        if stale:
+            log.warning(f'Restarting stale export job {job.id}')
+        job.status = ExportStatus.QUEUED
+        job.mmif_count = len(mmif_ids)
+        job.completed = 0
+        job.location = job.size = job.error = job.expires_at = None
+        job.updated_at = func.now()
+        db.commit()
+        export_executor().submit(run_export, job.id, mmif_ids)
+        db.refresh(job)
+    else:
+        db.commit()
+    return job
+
+
+def is_stale(job: ExportJob) -> bool:
+    """Whether a queued or running job has stopped updating, e.g. after a restart"""
+    return bool(
+        job.updated_at
+        and datetime.now(timezone.utc) - job.updated_at
+        > timedelta(seconds=EXPORT_STALE_AFTER)
+    )
+
+
+def set_progress(job_id: int, **values):
+    with Session(engine) as db:
+        db.execute(
+            update(ExportJob)
+            .where(ExportJob.id == job_id)
+            .values(updated_at=func.now(), **values)
+        )
+        db.commit()
+
+
+def progress_entries(
+    job_id: int, entries: Iterable[Tuple[str, Iterator[bytes]]]
+) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """Pass through zip entries, recording the number completed"""
+    completed, last_update = 0, monotonic()
+    for entry in entries:
+        yield entry
+        completed += 1
+        if monotonic() - last_update > PROGRESS_INTERVAL:
+            set_progress(job_id, completed=completed)
+            last_update = monotonic()
+
+
+def run_export(job_id: int, mmif_ids: List[int]):
+    """Build the archive for an export job, and store it in EXPORT_LOCATION"""
+    with Session(engine) as db:
+        key = db.get(ExportJob, job_id).key
+    with Session(read_engine) as db:
+        mmif_locations = distinct_mmif_locations(db, mmif_ids)
+    # Identical MMIFs are only exported once
+    set_progress(job_id, status=ExportStatus.RUNNING, mmif_count=len(mmif_locations))
+    log.info(f'Exporting {len(mmif_locations)} MMIFs for export job {job_id}')
+    # Build local archives in the export directory, so they can be moved into place
+    tmp_dir = None if is_s3(EXPORT_LOCATION) else EXPORT_LOCATION
+    if tmp_dir:
+        os.makedirs(tmp_dir, exist_ok=True)
+    archive = NamedTemporaryFile(dir=tmp_dir, prefix='.', suffix='.zip', delete=False)
+    try:
+        with archive:
+            entries = mmif_zip_entries(iter_mmif_objects(mmif_locations))
+            for chunk in zip_stream(progress_entries(job_id, entries)):
+                archive.write(chunk)
+        size = os.path.getsize(archive.name)
+        location = store_archive(archive.name, f'{key}.zip')
+    except Exception as error:
+        log.exception(f'Export job {job_id} failed')
+        if os.path.exists(archive.name):
+            os.unlink(archive.name)
+        set_progress(job_id, status=ExportStatus.FAILED, error=f'{error!s}')
+        return
+    set_progress(
+        job_id,
+        status=ExportStatus.FINISHED,
+        completed=len(mmif_locations),
+        location=location,
+        size=size,
+        expires_at=func.now() + timedelta(seconds=EXPORT_TTL),
+    )
+    log.success(f'Export job {job_id} finished: {location}')
+
+
+def is_s3(location: str) -> bool:
+    return location.startswith('s3://')
+
+
+def store_archive(path: str, name: str) -> str:
+    """Move a finished archive to EXPORT_LOCATION, and return its location"""
+    if is_s3(EXPORT_LOCATION):
+        bucket, prefix = parse_s3_url(EXPORT_LOCATION)
+        key = f'{prefix.rstrip("/")}/{name}' if prefix else name
+        try:
+            s3_client().upload_file(path, bucket, key)
+        finally:
+            os.unlink(path)
+        return f's3://{bucket}/{key}'
+    location = os.path.join(EXPORT_LOCATION, name)
+    os.replace(path, location)
+    return location
+
+
+def delete_archive(location: str):
+    if is_s3(location):
+        bucket, key = parse_s3_url(location)
+        s3_client().delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(location):
+        os.unlink(location)
+
+
+def expire_exports(db: Session):
+    """Delete finished archives that are past their TTL"""
+    expired = db.exec(
+        select(ExportJob)
+        .where(ExportJob.status == ExportStatus.FINISHED)
+        .where(ExportJob.expires_at < func.now())
+        .with_for_update(skip_locked=True)
+    ).all()
+    for job in expired:
+        try:
+            delete_archive(job.location)
+        except Exception as error:
+            log.error(f'Error deleting export {job.location}: {error!s}')
+            continue
+        job.status = ExportStatus.EXPIRED
+        job.location = None
+    db.commit()
+
+
+class ExportExpirer:
+    """Deletes expired export archives in a background thread
+
+    Attributes:
+        interval: Seconds between checks for expired archives
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='export-expirer', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                with Session(engine) as db:
+                    expire_exports(db)
+            except Exception:
+                log.exception('Error expiring exports')
+            self._stopped.wait(self.interval)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+@lru_cache
+def export_expirer() -> ExportExpirer:
+    """The process-wide export expirer"""
+    return ExportExpirer(EXPORT_EXPIRE_INTERVAL)
+
+
+def start_export_expirer():
+    export_expirer().start()
+
+
+def close_export_expirer():
+    """Stop expiring exports before the process exits"""
+    if export_expirer.cache_info().currsize:
+        export_expirer().close()
+
+
+def find_export_job(db: Session, mmif_ids: List[int]) -> Optional[ExportJob]:
+    """The latest export job for a set of MMIFs, if there is one"""
+    return db.scalars(
+        select(ExportJob).where(ExportJob.key == export_key(mmif_ids))
+    ).first()
+
+
+def export_response(job: ExportJob) -> Response:
+    """Download a finished export, from S3 with a presigned URL, or from local disk"""
+    if is_s3(job.location):
+        bucket, key = parse_s3_url(job.location)
+        return RedirectResponse(
+            s3_client().generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket, 'Key': key},
+                ExpiresIn=MMIF_PRESIGNED_URL_EXPIRES,
+            )
+        )
+    return FileResponse(
+        job.location,
+        filename=f'chowda_mmif_export.{job.id}.zip',
+        media_type='application/zip',
+    )
+
+
+def is_expired(job: ExportJob) -> bool:
+    return job.status == ExportStatus.EXPIRED or bool(
+        job.status == ExportStatus.FINISHED
+        and job.expires_at
+        and job.expires_at.timestamp() < time()
+    )
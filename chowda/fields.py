@@ -1,7 +1,8 @@
 from dataclasses import dataclass
 from typing import Any
 
-from starlette.datastructures import FormData
+from sqlmodel import select
+from starlette.datastructures import FormData, UploadFile
 from starlette.requests import Request
 from starlette_admin._types import RequestAction
 from starlette_admin.fields import (
@@ -12,7 +13,9 @@ from starlette_admin.fields import (
     TextAreaField,
 )
 
-from chowda.models import MediaFile
+from chowda.exports import find_export_job, is_expired
+from chowda.models import MMIF, ExportStatus, MediaFile
+from chowda.uploads import guid_format, iter_guids, upload_chunks
 
 
 @dataclass
@@ -32,8 +35,13 @@ class MediaFilesGuidsField(TextAreaField):
     async def parse_form_data(
         self, request: Request, form_data: FormData, action: RequestAction
     ) -> Any:
-        """Maps a string of GUID to a list"""
-        return form_data.get(self.id).split()
+        """Maps a string of GUIDs, and an optional uploaded GUID file, to a list"""
+        guids = (form_data.get(self.id) or '').split()
+        file = form_data.get(f'{self.id}_file')
+        if isinstance(file, UploadFile) and file.filename:
+            format = guid_format(file.content_type, file.filename)
+            guids += [guid async for guid in iter_guids(upload_chunks(file), format)]
+        return guids
 
     async def serialize_value(
         self, request: Request, value: Any, action: RequestAction
@@ -169,6 +177,42 @@ class BatchUnstartedGuidsCount(IntegerField):
         return len(obj.unstarted_guids())
 
 
+@dataclass
+class BatchExportJobField(BaseField):
+    """The status and progress of the MMIF export job for a batch's output MMIFs"""
+
+    name: str = 'batch_export_job'
+    label: str = 'MMIF Export'
+    display_template: str = 'displays/batch_export_job.html'
+    read_only: bool = True
+    exclude_from_create: bool = True
+    exclude_from_edit: bool = True
+    exclude_from_list: bool = True
+
+    async def parse_obj(self, request: Request, obj: Any) -> Any:
+        db = request.state.session
+        # Only the ids of the output MMIFs are needed for the job's key
+        mmif_ids = db.scalars(
+            select(MMIF.id).where(MMIF.batch_output_id == obj.id)
+        ).all()
+        job = find_export_job(db, mmif_ids)
+        if not job:
+            return None
+        expired = is_expired(job)
+        return {
+            'id': job.id,
+            'status': (ExportStatus.EXPIRED if expired else job.status).value,
+            'mmif_count': job.mmif_count,
+            'completed': job.completed,
+            'error': job.error,
+            'download_url': (
+                f'/exports/{job.id}/download'
+                if job.status == ExportStatus.FINISHED and not expired
+                else None
+            ),
+        }
+
+
 @dataclass
 class FinishedField(BooleanField):
     """A field that displays a boolean value for the 'Finished' property.
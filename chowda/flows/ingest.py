@@ -1,4 +1,4 @@
-from metaflow import FlowSpec, secrets, step, trigger
+from metaflow import FlowSpec, environment, secrets, step, trigger
 
 from chowda.log import log
 from chowda.models import MediaType
@@ -30,6 +30,8 @@ class IngestFlow(FlowSpec):
         ]
         self.next(self.ingest_pages, foreach='chunks')
 
+    # Each step is a short-lived process: do not keep pooled connections open
+    @environment(vars={'DB_POOL': 'null'})
     @step
     def ingest_pages(self):
         """Ingest a batch of asset pages"""
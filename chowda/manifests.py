@@ -0,0 +1,134 @@
+"""Manifests
+
+Manifests of presigned S3 URLs for MMIF downloads, so clients can fetch large exports
+directly from S3 instead of through Chowda.
+"""
+
+import csv
+import enum
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from typing import Iterator, List, Optional
+
+from sqlmodel import Session, select
+from starlette.responses import StreamingResponse
+
+from chowda.config import MMIF_PRESIGNED_URL_EXPIRES
+from chowda.contents import content_location, selected_mmifs
+from chowda.db import engine
+from chowda.models import MMIF, MMIFContent
+from chowda.s3 import presign_mmif
+from chowda.zipstream import unique_name
+
+# Number of MMIF rows fetched from the database at a time
+MANIFEST_BATCH_SIZE = 1000
+
+
+class ManifestFormat(enum.Enum):
+    JSON = 'json'
+    CSV = 'csv'
+    ARIA2 = 'aria2'
+
+
+MEDIA_TYPES = {
+    ManifestFormat.JSON: 'application/json',
+    ManifestFormat.CSV: 'text/csv',
+    ManifestFormat.ARIA2: 'text/plain',
+}
+
+EXTENSIONS = {
+    ManifestFormat.JSON: 'json',
+    ManifestFormat.CSV: 'csv',
+    ManifestFormat.ARIA2: 'txt',
+}
+
+CSV_COLUMNS = ['id', 'media_file_id', 'mmif_location', 'filename', 'url']
+
+
+def signed_mmifs(
+    pks: List[str], expires: int, batch_ids: Optional[List[int]] = None
+) -> Iterator[dict]:
+    """Yield a manifest entry with a presigned URL for each distinct MMIF content, of
+    the MMIFs in `pks`, or the output MMIFs of `batch_ids`"""
+    names, locations = set(), set()
+    with Session(engine) as db:
+        rows = db.exec(
+            select(MMIF.id, MMIF.media_file_id, content_location())
+            .outerjoin(MMIFContent, MMIFContent.sha256 == MMIF.content_hash)
+            .where(selected_mmifs(pks, batch_ids))
+            .order_by(MMIF.id)
+            .execution_options(yield_per=MANIFEST_BATCH_SIZE)
+        )
+        for id, media_file_id, mmif_location in rows:
+            if mmif_location in locations:
+                continue
+            locations.add(mmif_location)
+            yield {
+                'id': id,
+                'media_file_id': media_file_id,
+                'mmif_location': mmif_location,
+                'filename': unique_name(mmif_location.split('/')[-1], names),
+                'url': presign_mmif(mmif_location, expires),
+            }
+
+
+def json_manifest(mmifs: Iterator[dict], expires_at: datetime) -> Iterator[str]:
+    yield f'{{"expires_at": {json.dumps(expires_at.isoformat())}, "mmifs": ['
+    for n, mmif in enumerate(mmifs):
+        yield (',\n' if n else '\n') + json.dumps(mmif)
+    yield '\n]}\n'
+
+
+def csv_manifest(mmifs: Iterator[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS)
+    writer.writeheader()
+    for mmif in mmifs:
+        writer.writerow(mmif)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def aria2_manifest(mmifs: Iterator[dict]) -> Iterator[str]:
+    """An aria2 input file: each URL, followed by its output file name"""
+    for mmif in mmifs:
+        yield f'{mmif["url"]}\n  out={mmif["filename"]}\n'
+
+
+def mmif_manifest(
+    pks: List[str],
+    format: ManifestFormat = ManifestFormat.JSON,
+    expires: int = MMIF_PRESIGNED_URL_EXPIRES,
+    batch_ids: Optional[List[int]] = None,
+) -> StreamingResponse:
+    """Stream a manifest of presigned S3 URLs for MMIFs.
+
+    URLs are signed locally without contacting S3, so a manifest costs one signature per
+    MMIF, however large the MMIFs are. The URLs expire after `expires` seconds.
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires)
+    mmifs = signed_mmifs(pks, expires, batch_ids)
+    # Sign the first URL before responding, so errors can still be reported
+    first = next(mmifs, None)
+    mmifs = chain([first], mmifs) if first else iter([])
+    if format == ManifestFormat.CSV:
+        content = csv_manifest(mmifs)
+    elif format == ManifestFormat.ARIA2:
+        content = aria2_manifest(mmifs)
+    else:
+        content = json_manifest(mmifs, expires_at)
+
+    current_datetime = datetime.now().strftime('%Y-%m-%d_%H%M%S')
+    filename = f'chowda_mmif_manifest.{current_datetime}.{EXTENSIONS[format]}'
+    return StreamingResponse(
+        content,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Expires': expires_at.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        },
+        media_type=MEDIA_TYPES[format],
+    )
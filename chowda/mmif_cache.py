@@ -0,0 +1,317 @@
+"""MMIF Cache
+
+A local disk cache of MMIF objects, keyed by `mmif_location` and S3 ETag.
+
+The cache directory can be shared by several workers. Each MMIF location has its own
+entry directory, holding a single file named by the ETag of the cached object:
+
+    <cache dir>/<hash[:2]>/<hash>/<etag>
+
+On a miss, the object is downloaded to a temporary file and renamed into place, so
+readers never see a partial object. Fetching an entry holds an exclusive lock on
+`<hash>.lock` while it is downloaded, so concurrent requests for the same MMIF only
+download it once. The lock is released before the cached file is returned, so a slow
+client does not hold up other readers.
+Entries validated within the last `ttl` seconds are served without a request to S3.
+Older entries are revalidated with a conditional `If-None-Match` request. The least
+recently used entries, and their lock files, are evicted when the cache grows beyond
+its size limit.
+"""
+
+import fcntl
+import os
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import IO, Callable, Dict, Iterator, Optional, Tuple
+
+from chowda.config import MMIF_CACHE_DIR, MMIF_CACHE_SIZE, MMIF_CACHE_TTL
+from chowda.log import log
+
+# S3 error codes for a conditional request whose ETag still matches
+NOT_MODIFIED = {'304', 'NotModified'}
+# S3 error codes for an object that no longer exists
+NOT_FOUND = {'404', 'NoSuchKey'}
+
+# ETags that can be safely used as file names
+ETAG = re.compile(r'^[0-9A-Za-z-]+$')
+
+# Fraction of the size limit to evict down to, so eviction does not run on every write
+LOW_WATER_MARK = 0.9
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """The error code of a botocore ClientError, if it is one"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+class CachedBody:
+    """A cached MMIF file, with the streaming interface of an S3 object `Body`"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self.file.read(-1 if amt is None else amt)
+
+    def iter_chunks(self, chunk_size: int = 1024) -> Iterator[bytes]:
+        try:
+            while chunk := self.file.read(chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+
+class MMIFCache:
+    """A size limited LRU cache of MMIF objects on local disk
+
+    Attributes:
+        directory: The cache directory
+        max_size: The maximum total size of cached files, in bytes
+        ttl: Seconds after validation that entries are served without a request to S3
+        counters: Number of hits, misses, revalidations and evictions in this process
+    """
+
+    def __init__(self, directory: str, max_size: int, ttl: float = 0):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = None
+        self.counters = dict.fromkeys(
+            ('hits', 'misses', 'revalidations', 'evictions'), 0
+        )
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'tmp'), exist_ok=True)
+
+    def count(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters for this process, and the estimated cache size"""
+        with self._lock:
+            return {
+                **self.counters,
+                'size': self.size or 0,
+                'max_size': self.max_size,
+            }
+
+    def entry(self, mmif_location: str) -> str:
+        """The entry directory of a MMIF location"""
+        key = sha256(mmif_location.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def lock(self, path: str, blocking: bool = True) -> Optional[IO]:
+        """Take an exclusive lock on `path`, shared with other processes, which is
+        released when the returned file is closed.
+
+        Returns None if `blocking` is False and the lock is held elsewhere."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, flags)
+            except BlockingIOError:
+                lock.close()
+                return None
+            try:
+                if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                    return lock
+            except FileNotFoundError:
+                pass
+            # The lock file was removed by eviction while we waited: lock the new one
+            lock.close()
+
+    @contextmanager
+    def locked(self, path: str, blocking: bool = True) -> Iterator[bool]:
+        """Hold an exclusive lock on `path`, shared with other processes.
+
+        Yields whether the lock was acquired, which is always True if `blocking`."""
+        lock = self.lock(path, blocking)
+        try:
+            yield lock is not None
+        finally:
+            if lock:
+                lock.close()
+
+    def cached(self, entry: str) -> Optional[Tuple[str, str]]:
+        """The (etag, path) of the file cached in an entry, if any"""
+        try:
+            names = os.listdir(entry)
+        except FileNotFoundError:
+            return None
+        for name in names:
+            return f'"{name}"', os.path.join(entry, name)
+        return None
+
+    def open(
+        self, mmif_location: str, get_object: Callable[..., dict]
+    ) -> Dict[str, object]:
+        """Open a MMIF from the cache, fetching it with `get_object` on a miss.
+
+        `get_object(mmif_location, etag)` should return an S3 `get_object` response,
+        sending `etag` as `If-None-Match` if it is given.
+        """
+        entry = self.entry(mmif_location)
+        lock = self.lock(f'{entry}.lock')
+        try:
+            cached = self.cached(entry)
+            if cached and self.fresh(entry):
+                self.count('hits')
+                return self.read(*cached)
+            try:
+                mmif = get_object(mmif_location, cached[0] if cached else None)
+            except Exception as error:
+                code = error_code(error)
+                if not cached:
+                    raise
+                if code in NOT_FOUND:
+                    self.remove(cached[1])
+                    raise
+                if code in NOT_MODIFIED:
+                    self.count('revalidations')
+                    os.utime(entry)
+                else:
+                    log.warning(
+                        f'Serving cached {mmif_location} after error: {error!s}'
+                    )
+                self.count('hits')
+                return self.read(*cached)
+
+            self.count('misses')
+            etag = mmif.get('ETag', '').strip('"')
+            if not ETAG.match(etag):
+                # Not safe to cache: pass the object through
+                return mmif
+            # Opened before the lock is released, so eviction cannot remove it first
+            fetched = self.read(f'"{etag}"', self.fetch(entry, etag, mmif['Body']))
+        finally:
+            lock.close()
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+        return fetched
+
+    def fresh(self, entry: str) -> bool:
+        """Whether an entry was validated within the last `ttl` seconds.
+
+        The modification time of the entry directory is the time it was last
+        validated."""
+        return time() - os.stat(entry).st_mtime < self.ttl
+
+    def read(self, etag: str, path: str) -> Dict[str, object]:
+        """Open a cached file, and mark it as recently used"""
+        os.utime(path)
+        file = open(path, 'rb')
+        return {
+            'Body': CachedBody(file),
+            'ContentLength': os.fstat(file.fileno()).st_size,
+            'ETag': etag,
+        }
+
+    def fetch(self, entry: str, etag: str, body) -> str:
+        """Download an S3 object `Body` into an entry, and return its path"""
+        size = 0
+        tmp = NamedTemporaryFile(dir=os.path.join(self.directory, 'tmp'), delete=False)
+        try:
+            with tmp:
+                for chunk in body.iter_chunks(1024 * 1024):
+                    tmp.write(chunk)
+                    size += len(chunk)
+            return self.store(entry, etag, tmp.name, size)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+        finally:
+            body.close()
+
+    def store(self, entry: str, etag: str, tmp: str, size: int) -> str:
+        """Move a downloaded file into an entry, atomically, replacing the file cached
+        there"""
+        cached = self.cached(entry)
+        os.makedirs(entry, exist_ok=True)
+        path = os.path.join(entry, etag)
+        os.replace(tmp, path)
+        if cached and cached[1] != path:
+            self.remove(cached[1])
+        os.utime(entry)
+        with self._lock:
+            if self.size is not None:
+                self.size += size
+        return path
+
+    def remove(self, path: str):
+        try:
+            size = os.stat(path).st_size
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self.size is not None:
+                self.size -= size
+
+    def files(self) -> Iterator[Tuple[float, int, str, str]]:
+        """Yield (mtime, size, path, entry) for every cached file"""
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or shard.name == 'tmp':
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir():
+                    continue
+                for file in os.scandir(entry.path):
+                    try:
+                        stat = file.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, file.path, entry.path
+
+    def evict(self):
+        """Remove the least recently used files until the cache is under its size limit.
+
+        Emptied entries are removed with their lock files. Only one worker evicts at a
+        time. Entries that are locked by a reader are skipped."""
+        with self.locked(os.path.join(self.directory, 'evict.lock'), False) as locked:
+            if not locked:
+                return
+            files = sorted(self.files())
+            size = sum(file[1] for file in files)
+            evictions = 0
+            for _mtime, file_size, path, entry in files:
+                if size <= self.max_size * LOW_WATER_MARK:
+                    break
+                with self.locked(f'{entry}.lock', False) as entry_locked:
+                    if not entry_locked:
+                        continue
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        continue
+                    if not os.listdir(entry):
+                        os.rmdir(entry)
+                        os.unlink(f'{entry}.lock')
+                size -= file_size
+                evictions += 1
+            with self._lock:
+                self.size = size
+            if evictions:
+                self.count('evictions', evictions)
+                log.info(f'Evicted {evictions} MMIFs from cache')
+
+
+@lru_cache
+def mmif_cache() -> Optional[MMIFCache]:
+    """The process-wide MMIF cache, or None if it is disabled"""
+    if MMIF_CACHE_SIZE <= 0:
+        return None
+    return MMIFCache(MMIF_CACHE_DIR, MMIF_CACHE_SIZE, MMIF_CACHE_TTL)
@@ -9,11 +9,26 @@ from typing import Any, Dict, List, Optional
 
 from metaflow import Run, namespace
 from pydantic.networks import AnyHttpUrl, EmailStr
-from sqlalchemy import JSON, Column, DateTime, Enum
+from sqlalchemy import (
+    DDL,
+    JSON,
+    BigInteger,
+    Column,
+    DateTime,
+    Enum,
+    Index,
+    Integer,
+    String,
+    event,
+    func,
+)
 from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, object_session
 from sqlmodel import AutoString, Field, Relationship, SQLModel
 from starlette.requests import Request
 
+from chowda.config import MMIF_SUMMARIES, PARTITION_MONTHS_AHEAD
+
 
 class AppStatus(enum.Enum):
     PENDING = 'pending'
@@ -38,6 +53,14 @@ class MediaType(enum.Enum):
     Audio = 'Audio'
 
 
+class ExportStatus(enum.Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+
+
 class ThumbnailType(enum.Enum):
     LARGE = 'large'
     MEDIUM = 'medium'
@@ -83,15 +106,11 @@ class MediaFileBatchLink(SQLModel, table=True):
     batch_id: Optional[int] = Field(
         default=None, foreign_key='batches.id', primary_key=True, index=True
     )
-    source_mmif_id: Optional[int] = Field(
-        default=None, foreign_key='mmifs.id', index=True
-    )
+    source_mmif_id: Optional[int] = Field(default=None, index=True)
 
 
 class MMIFBatchInputLink(SQLModel, table=True):
-    mmif_id: Optional[int] = Field(
-        default=None, foreign_key='mmifs.id', primary_key=True, index=True
-    )
+    mmif_id: Optional[int] = Field(default=None, primary_key=True, index=True)
     batch_id: Optional[int] = Field(
         default=None, foreign_key='batches.id', primary_key=True, index=True
     )
@@ -158,7 +177,7 @@ class SonyCiAsset(SQLModel, table=True):
     id: Optional[str] = Field(primary_key=True, index=True, default=None)
     name: str = Field(index=True)
     size: int = Field(sa_column=Column(postgresql.BIGINT))
-    type: MediaType = Field(sa_column=Column(Enum(MediaType)))
+    type: MediaType = Field(sa_column=Column(Enum(MediaType), index=True))
     format: Optional[str] = Field(default=None, index=True)
     thumbnails: Optional[List[Dict[str, Any]]] = Field(
         sa_column=Column(postgresql.ARRAY(JSON)), default=None
@@ -212,13 +231,17 @@ class Batch(SQLModel, table=True):
     input_mmifs: List['MMIF'] = Relationship(
         back_populates='batch_inputs',
         link_model=MMIFBatchInputLink,
+        sa_relationship_kwargs={
+            'primaryjoin': 'Batch.id == foreign(MMIFBatchInputLink.batch_id)',
+            'secondaryjoin': 'MMIF.id == foreign(MMIFBatchInputLink.mmif_id)',
+        },
     )
     metaflow_runs: List['MetaflowRun'] = Relationship(back_populates='batch')
 
     def unstarted_guids(self) -> set:
         """Returns the set of GUIDs that are not currently running"""
         ids: set = {media_file.guid for media_file in self.media_files}
-        running_guids: set = {run.media_file.guid for run in self.metaflow_runs}
+        running_guids: set = {run.media_file_id for run in self.metaflow_runs}
         return ids - running_guids
 
     async def __admin_repr__(self, request: Request) -> str:
@@ -282,7 +305,12 @@ class MetaflowRun(SQLModel, table=True):
     )
     media_file: Optional[MediaFile] = Relationship(back_populates='metaflow_runs')
     created_at: Optional[datetime] = Field(
-        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+        sa_column=Column(
+            DateTime(timezone=True),
+            primary_key=True,
+            default=datetime.utcnow,
+            server_default=func.now(),
+        )
     )
     finished: bool = Field(default=False)
     finished_at: Optional[datetime] = Field(
@@ -291,8 +319,31 @@ class MetaflowRun(SQLModel, table=True):
     successful: Optional[bool] = Field(default=None)
     current_step: Optional[str] = Field(default=None)
     current_task: Optional[str] = Field(default=None)
+    last_event_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=None)
+    )
 
-    mmif: Optional['MMIF'] = Relationship(back_populates='metaflow_run')
+    __table_args__ = (
+        # Runs of each MediaFile in a batch, by date
+        Index(
+            'ix_metaflow_runs_batch_id_media_file_id_created_at',
+            'batch_id',
+            'media_file_id',
+            'created_at',
+        ),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+    # Runs are identified by id alone; created_at is only in the primary key because
+    # the table is partitioned by it
+    __mapper_args__ = {'primary_key': ['id']}
+
+    mmif: Optional['MMIF'] = Relationship(
+        back_populates='metaflow_run',
+        sa_relationship_kwargs={
+            'primaryjoin': 'MetaflowRun.id == foreign(MMIF.metaflow_run_id)',
+            'uselist': False,
+        },
+    )
 
     @property
     def source(self):
@@ -301,6 +352,48 @@ class MetaflowRun(SQLModel, table=True):
         return Run(self.pathspec)
 
 
+class EventKey(SQLModel, table=True):
+    """Event key model
+
+    Idempotency keys of processed Argo events, so redelivered events are ignored.
+    Keys are deleted after `EVENT_KEY_TTL` seconds.
+
+    Attributes:
+        key: Event name, flow name, run id, step name and task id
+        created_at: When the event was processed
+    """
+
+    __tablename__ = 'event_keys'
+    key: str = Field(primary_key=True)
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(
+            DateTime(timezone=True), server_default=func.now(), index=True
+        )
+    )
+
+
+class WebSession(SQLModel, table=True):
+    """Web session model
+
+    Server-side admin sessions. The session cookie only holds an opaque session id,
+    which is stored hashed.
+
+    Attributes:
+        id: SHA-256 of the session id
+        data: Session contents
+        expires_at: When the session expires
+    """
+
+    __tablename__ = 'sessions'
+    id: str = Field(primary_key=True, max_length=64)
+    data: Dict[str, Any] = Field(
+        default={}, sa_column=Column(postgresql.JSONB, nullable=False)
+    )
+    expires_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False, index=True)
+    )
+
+
 class MMIF(SQLModel, table=True):
     """MMIF model
 
@@ -314,20 +407,41 @@ class MMIF(SQLModel, table=True):
         batch_output: Batch that generated this MMIF
         batch_inputs: Batch that uses this as an input
         mmif_location: S3 URL of the mmif
+        content_hash: SHA-256 of the MMIF contents, shared by identical MMIFs
+        content: MMIFContent
     """
 
     __tablename__ = 'mmifs'
-    id: Optional[int] = Field(primary_key=True, default=None, index=True)
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
+    __mapper_args__ = {'primary_key': ['id']}
+    id: Optional[int] = Field(
+        primary_key=True,
+        default=None,
+        index=True,
+        sa_column_kwargs={'autoincrement': True},
+    )
     created_at: Optional[datetime] = Field(
-        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+        sa_column=Column(
+            DateTime(timezone=True),
+            primary_key=True,
+            default=datetime.utcnow,
+            server_default=func.now(),
+        )
     )
     media_file_id: Optional[str] = Field(
         default=None, foreign_key='media_files.guid', index=True
     )
     media_file: Optional[MediaFile] = Relationship(back_populates='mmifs')
-    metaflow_run_id: Optional[str] = Field(default=None, foreign_key='metaflow_runs.id')
-    metaflow_run: Optional[MetaflowRun] = Relationship(back_populates='mmif')
-    batch_output_id: Optional[int] = Field(default=None, foreign_key='batches.id')
+    metaflow_run_id: Optional[str] = Field(default=None, index=True)
+    metaflow_run: Optional[MetaflowRun] = Relationship(
+        back_populates='mmif',
+        sa_relationship_kwargs={
+            'primaryjoin': 'foreign(MMIF.metaflow_run_id) == MetaflowRun.id',
+        },
+    )
+    batch_output_id: Optional[int] = Field(
+        default=None, foreign_key='batches.id', index=True
+    )
     batch_output: Optional[Batch] = Relationship(
         back_populates='output_mmifs',
         sa_relationship_kwargs={
@@ -337,9 +451,24 @@ class MMIF(SQLModel, table=True):
     batch_inputs: List[Batch] = Relationship(
         back_populates='input_mmifs',
         link_model=MMIFBatchInputLink,
+        sa_relationship_kwargs={
+            'primaryjoin': 'MMIF.id == foreign(MMIFBatchInputLink.mmif_id)',
+            'secondaryjoin': 'Batch.id == foreign(MMIFBatchInputLink.batch_id)',
+        },
     )
 
     mmif_location: Optional[str] = Field(default=None)
+    summary: Optional['MMIFSummary'] = Relationship(
+        back_populates='mmif',
+        sa_relationship_kwargs={
+            'primaryjoin': 'MMIF.id == foreign(MMIFSummary.mmif_id)',
+            'uselist': False,
+        },
+    )
+    content_hash: Optional[str] = Field(
+        default=None, foreign_key='mmif_contents.sha256', index=True
+    )
+    content: Optional['MMIFContent'] = Relationship(back_populates='mmifs')
 
     async def __admin_repr__(self, request: Request):
         return (
@@ -355,3 +484,501 @@ class MMIF(SQLModel, table=True):
             else self.id
         )
         return f'<span>{text}</span>'
+
+
+class ExportJob(SQLModel, table=True):
+    """MMIF export job model
+
+    Attributes:
+        id: Primary key
+        key: Hash of the exported MMIF ids. Requests for the same MMIFs share a job.
+        batch_id: Batch the export was first requested for
+        status: ExportStatus
+        mmif_count: Number of MMIFs in the export
+        completed: Number of MMIFs written to the archive so far
+        location: Local path or S3 URL of the finished archive
+        size: Size of the finished archive in bytes
+        error: Error message if the export failed
+        created_at: Creation timestamp
+        updated_at: Last status or progress update
+        expires_at: When the finished archive will be deleted
+    """
+
+    __tablename__ = 'export_jobs'
+    id: Optional[int] = Field(primary_key=True, default=None)
+    key: str = Field(unique=True, index=True)
+    batch_id: Optional[int] = Field(default=None, foreign_key='batches.id', index=True)
+    status: ExportStatus = Field(
+        default=ExportStatus.QUEUED, sa_column=Column(Enum(ExportStatus))
+    )
+    mmif_count: int = Field(default=0)
+    completed: int = Field(default=0)
+    location: Optional[str] = Field(default=None)
+    size: Optional[int] = Field(default=None, sa_type=BigInteger)
+    error: Optional[str] = Field(default=None)
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+    )
+    updated_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+    )
+    expires_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=None)
+    )
+
+
+class MMIFSummary(SQLModel, table=True):
+    """MMIF summary model
+
+    A summary of the contents of a MMIF, extracted when the MMIF is registered.
+
+    Attributes:
+        mmif_id: MMIF ID
+        mmif: MMIF
+        mmif_version: MMIF specification version
+        apps: App of each view, in order
+        view_count: Number of views
+        error_count: Number of views with errors
+        document_count: Number of documents
+        annotation_count: Number of annotations
+        annotation_types: Number of annotations of each type
+        durations: Duration of each document, by document ID
+        size: Size of the MMIF in bytes
+        created_at: Creation timestamp
+    """
+
+    __tablename__ = 'mmif_summaries'
+    mmif_id: Optional[int] = Field(default=None, primary_key=True)
+    mmif: Optional[MMIF] = Relationship(
+        back_populates='summary',
+        sa_relationship_kwargs={
+            'primaryjoin': 'foreign(MMIFSummary.mmif_id) == MMIF.id',
+        },
+    )
+    mmif_version: Optional[str] = Field(default=None)
+    apps: List[str] = Field(
+        default=[], sa_column=Column(postgresql.ARRAY(String), nullable=False)
+    )
+    view_count: int = Field(default=0, index=True)
+    error_count: int = Field(default=0, index=True)
+    document_count: int = Field(default=0)
+    annotation_count: int = Field(default=0, index=True)
+    annotation_types: Dict[str, int] = Field(
+        default={}, sa_column=Column(postgresql.JSONB, nullable=False)
+    )
+    durations: Dict[str, float] = Field(
+        default={}, sa_column=Column(postgresql.JSONB, nullable=False)
+    )
+    size: Optional[int] = Field(default=None, sa_type=BigInteger)
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+    )
+
+    __table_args__ = (
+        Index('ix_mmif_summaries_apps', 'apps', postgresql_using='gin'),
+        Index(
+            'ix_mmif_summaries_annotation_types',
+            'annotation_types',
+            postgresql_using='gin',
+        ),
+    )
+
+    async def __admin_repr__(self, request: Request):
+        return f'{self.mmif_id}'
+
+
+class MMIFContent(SQLModel, table=True):
+    """MMIF content model
+
+    Unique MMIF contents, by hash. MMIFs with identical contents are linked to one
+    MMIFContent, and downloaded from its `mmif_location`.
+
+    Attributes:
+        sha256: SHA-256 of the MMIF, in hex
+        mmif_location: S3 URL of the first MMIF with these contents
+        size: Size of the MMIF in bytes
+        mmifs: MMIFs with these contents
+        created_at: Creation timestamp
+    """
+
+    __tablename__ = 'mmif_contents'
+    sha256: str = Field(primary_key=True, max_length=64)
+    mmif_location: str
+    size: Optional[int] = Field(default=None, sa_type=BigInteger)
+    mmifs: List[MMIF] = Relationship(back_populates='content')
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=datetime.utcnow)
+    )
+
+    async def __admin_repr__(self, request: Request):
+        return self.sha256
+
+
+class LatestMMIF(SQLModel, table=True):
+    """Latest MMIF model
+
+    The newest MMIF of each MediaFile, by `created_at`. Maintained by a trigger on
+    `mmifs`, so it is always current, and must not be written to directly.
+
+    Attributes:
+        media_file_id: GUID
+        mmif_id: MMIF ID
+        mmif: MMIF
+        created_at: Creation timestamp of the MMIF
+    """
+
+    __tablename__ = 'latest_mmifs'
+    media_file_id: str = Field(foreign_key='media_files.guid', primary_key=True)
+    mmif_id: int = Field(sa_column=Column(Integer, nullable=False, index=True))
+    mmif: MMIF = Relationship(
+        sa_relationship_kwargs={
+            'primaryjoin': 'foreign(LatestMMIF.mmif_id) == MMIF.id',
+            'viewonly': True,
+        }
+    )
+    created_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True))
+    )
+
+
+class ArchivedMetaflowRun(SQLModel, table=True):
+    """Archived MetaflowRun model
+
+    A superseded MetaflowRun, moved out of `metaflow_runs` by `chowda.archive`. Has
+    the columns of MetaflowRun, without its constraints.
+
+    Attributes:
+        archived_at: When the run was archived
+    """
+
+    __tablename__ = 'archived_metaflow_runs'
+    id: str = Field(primary_key=True)
+    pathspec: str
+    batch_id: Optional[int] = Field(default=None, index=True)
+    media_file_id: Optional[str] = Field(default=None, index=True)
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
+    )
+    finished: bool = Field(default=False)
+    finished_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=None)
+    )
+    successful: Optional[bool] = Field(default=None)
+    current_step: Optional[str] = Field(default=None)
+    current_task: Optional[str] = Field(default=None)
+    last_event_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), default=None)
+    )
+    archived_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), server_default=func.now())
+    )
+
+
+class ArchivedMMIF(SQLModel, table=True):
+    """Archived MMIF model
+
+    An unreferenced MMIF, moved out of `mmifs` by `chowda.archive`. Has the columns
+    of MMIF, without its constraints.
+
+    Attributes:
+        archived_at: When the MMIF was archived
+    """
+
+    __tablename__ = 'archived_mmifs'
+    id: int = Field(primary_key=True, sa_column_kwargs={'autoincrement': False})
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
+    )
+    media_file_id: Optional[str] = Field(default=None, index=True)
+    metaflow_run_id: Optional[str] = Field(default=None, index=True)
+    batch_output_id: Optional[int] = Field(default=None)
+    mmif_location: Optional[str] = Field(default=None)
+    content_hash: Optional[str] = Field(default=None)
+    archived_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(timezone=True), server_default=func.now())
+    )
+
+
+class MetaflowRunId(SQLModel, table=True):
+    """MetaflowRun id model
+
+    The id of every row of the partitioned `metaflow_runs` table, kept up to date by
+    a trigger, so run ids are unique across partitions.
+    """
+
+    __tablename__ = 'metaflow_run_ids'
+    id: str = Field(primary_key=True)
+
+
+class MMIFId(SQLModel, table=True):
+    """MMIF id model
+
+    The id of every row of the partitioned `mmifs` table, kept up to date by a
+    trigger, so MMIF ids are unique across partitions.
+    """
+
+    __tablename__ = 'mmif_ids'
+    id: int = Field(primary_key=True, sa_column_kwargs={'autoincrement': False})
+
+
+# Keep latest_mmifs up to date. New MMIFs replace older ones in a single upsert;
+# updated and deleted MMIFs recompute the latest MMIF of their media file.
+LATEST_MMIFS_TRIGGER = """
+CREATE OR REPLACE FUNCTION refresh_latest_mmif(guid VARCHAR) RETURNS void AS $$
+    DELETE FROM latest_mmifs WHERE media_file_id = guid;
+    INSERT INTO latest_mmifs (media_file_id, mmif_id, created_at)
+    SELECT media_file_id, id, created_at FROM mmifs WHERE media_file_id = guid
+    ORDER BY created_at DESC NULLS LAST, id DESC LIMIT 1;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION update_latest_mmifs() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.media_file_id IS NOT NULL THEN
+            INSERT INTO latest_mmifs (media_file_id, mmif_id, created_at)
+            VALUES (NEW.media_file_id, NEW.id, NEW.created_at)
+            ON CONFLICT (media_file_id) DO UPDATE
+            SET mmif_id = EXCLUDED.mmif_id, created_at = EXCLUDED.created_at
+            WHERE (
+                COALESCE(latest_mmifs.created_at, '-infinity'), latest_mmifs.mmif_id
+            ) < (COALESCE(EXCLUDED.created_at, '-infinity'), EXCLUDED.mmif_id);
+        END IF;
+        RETURN NULL;
+    END IF;
+    PERFORM refresh_latest_mmif(OLD.media_file_id);
+    IF TG_OP = 'UPDATE' AND NEW.media_file_id IS DISTINCT FROM OLD.media_file_id THEN
+        PERFORM refresh_latest_mmif(NEW.media_file_id);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER mmifs_latest_mmif
+AFTER INSERT OR DELETE OR UPDATE OF media_file_id, created_at ON mmifs
+FOR EACH ROW EXECUTE FUNCTION update_latest_mmifs();
+
+INSERT INTO latest_mmifs (media_file_id, mmif_id, created_at)
+SELECT DISTINCT ON (media_file_id) media_file_id, id, created_at FROM mmifs
+WHERE media_file_id IS NOT NULL
+ORDER BY media_file_id, created_at DESC NULLS LAST, id DESC;
+"""
+
+DROP_LATEST_MMIFS_TRIGGER = """
+DROP TRIGGER IF EXISTS mmifs_latest_mmif ON mmifs;
+DROP FUNCTION IF EXISTS update_latest_mmifs();
+DROP FUNCTION IF EXISTS refresh_latest_mmif(VARCHAR);
+"""
+
+# The trigger is created on mmifs, which has no foreign keys to order it by
+LatestMMIF.__table__.add_is_dependent_on(MMIF.__table__)
+event.listen(LatestMMIF.__table__, 'after_create', DDL(LATEST_MMIFS_TRIGGER))
+event.listen(LatestMMIF.__table__, 'before_drop', DDL(DROP_LATEST_MMIFS_TRIGGER))
+
+# metaflow_runs and mmifs are range partitioned by created_at, with one partition per
+# month (UTC), e.g. mmifs_y2026m10, and a DEFAULT partition for any other rows.
+# Partitions are created ahead of time. Rows of a month that landed in the DEFAULT
+# partition are moved into the new partition of their month, in the same transaction.
+MONTHLY_PARTITIONS = """
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent TEXT, month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    lower_bound TIMESTAMPTZ := date_trunc('month', month::TIMESTAMP) AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMPTZ := (
+        date_trunc('month', month::TIMESTAMP) + INTERVAL '1 month'
+    ) AT TIME ZONE 'UTC';
+    partition TEXT := parent || to_char(month, '"_y"YYYY"m"MM');
+    default_partition TEXT := parent || '_default';
+    misplaced BOOLEAN;
+BEGIN
+    IF to_regclass(partition) IS NOT NULL THEN
+        RETURN partition;
+    END IF;
+    EXECUTE 'SELECT EXISTS (SELECT FROM ' || quote_ident(default_partition)
+        || ' WHERE created_at >= $1 AND created_at < $2)'
+        INTO misplaced USING lower_bound, upper_bound;
+    IF misplaced THEN
+        -- References are checked when the moved rows are back, at commit
+        SET CONSTRAINTS ALL DEFERRED;
+        EXECUTE 'CREATE TEMPORARY TABLE misplaced_rows (LIKE '
+            || quote_ident(parent) || ')';
+        EXECUTE 'WITH moved AS (DELETE FROM ' || quote_ident(default_partition)
+            || ' WHERE created_at >= $1 AND created_at < $2 RETURNING *)'
+            || ' INSERT INTO misplaced_rows SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+    END IF;
+    EXECUTE 'CREATE TABLE ' || quote_ident(partition)
+        || ' PARTITION OF ' || quote_ident(parent) || ' FOR VALUES FROM ('
+        || quote_literal(lower_bound) || ') TO (' || quote_literal(upper_bound) || ')';
+    IF misplaced THEN
+        EXECUTE 'INSERT INTO ' || quote_ident(parent)
+            || ' SELECT * FROM misplaced_rows';
+        DROP TABLE misplaced_rows;
+    END IF;
+    RETURN partition;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_monthly_partitions(parent TEXT, months_ahead INT)
+RETURNS SETOF TEXT AS $$
+    SELECT create_monthly_partition(
+        parent, (date_trunc('month', now() AT TIME ZONE 'UTC') + month)::DATE
+    )
+    FROM generate_series(0, months_ahead) n, make_interval(months => n) month;
+$$ LANGUAGE sql;
+"""
+
+CREATE_PARTITIONS = f"""
+CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT;
+SELECT create_monthly_partitions('%(table)s', {PARTITION_MONTHS_AHEAD});
+"""
+
+for table in (MetaflowRun.__table__, MMIF.__table__):
+    event.listen(table, 'after_create', DDL(MONTHLY_PARTITIONS + CREATE_PARTITIONS))
+
+# Partitioned tables can only have unique keys that include the partition key, so the
+# ids of metaflow_runs and mmifs are registered in the metaflow_run_ids and mmif_ids
+# tables, whose primary keys keep them unique, and references to them are enforced by
+# triggers instead of foreign key constraints. References behave like foreign keys:
+# referencing rows must reference an existing id, which they lock FOR KEY SHARE until
+# their transaction ends, and ids that are still referenced cannot be deleted.
+# latest_mmifs is kept up to date by its own trigger instead.
+PARTITIONED_REFERENCES = """
+CREATE OR REPLACE FUNCTION register_id() RETURNS trigger AS $$
+DECLARE
+    registered INT;
+BEGIN
+    -- TG_ARGV: partitioned table, id table
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE 'DELETE FROM ' || quote_ident(TG_ARGV[1]) || ' WHERE id = $1'
+            USING OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- Waits for concurrent inserts of the same id, like a unique index
+        EXECUTE 'INSERT INTO ' || quote_ident(TG_ARGV[1])
+            || ' (id) VALUES ($1) ON CONFLICT DO NOTHING' USING NEW.id;
+        GET DIAGNOSTICS registered = ROW_COUNT;
+        IF registered = 0 THEN
+            RAISE EXCEPTION USING ERRCODE = 'unique_violation',
+                MESSAGE = 'duplicate id in ' || TG_ARGV[0] || ': ' || NEW.id;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_reference() RETURNS trigger AS $$
+DECLARE
+    found BOOLEAN;
+BEGIN
+    -- TG_ARGV: referencing column, referenced table
+    EXECUTE 'SELECT ($1).' || quote_ident(TG_ARGV[0]) || ' IS NULL'
+        INTO found USING NEW;
+    IF NOT found THEN
+        EXECUTE 'SELECT true FROM ' || quote_ident(TG_ARGV[1])
+            || ' WHERE id = ($1).' || quote_ident(TG_ARGV[0]) || ' FOR KEY SHARE'
+            INTO found USING NEW;
+    END IF;
+    IF found IS NULL THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_TABLE_NAME || '.' || TG_ARGV[0]
+                || ' references a missing row of ' || TG_ARGV[1];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION restrict_references() RETURNS trigger AS $$
+DECLARE
+    referenced BOOLEAN;
+BEGIN
+    -- TG_ARGV: referenced table, referencing table, referencing column
+    EXECUTE 'SELECT NOT EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[0])
+        || ' WHERE id = ($1).id) AND EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[1])
+        || ' WHERE ' || quote_ident(TG_ARGV[2]) || ' = ($1).id)'
+        INTO referenced USING OLD;
+    IF referenced THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_ARGV[0] || ' ' || OLD.id || ' is still referenced from '
+                || TG_ARGV[1] || '.' || TG_ARGV[2];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER metaflow_runs_register_id
+AFTER INSERT OR DELETE OR UPDATE OF id ON metaflow_runs
+FOR EACH ROW EXECUTE FUNCTION register_id('metaflow_runs', 'metaflow_run_ids');
+
+CREATE TRIGGER mmifs_register_id AFTER INSERT OR DELETE OR UPDATE OF id ON mmifs
+FOR EACH ROW EXECUTE FUNCTION register_id('mmifs', 'mmif_ids');
+
+CREATE CONSTRAINT TRIGGER mmifs_metaflow_run_id
+AFTER INSERT OR UPDATE OF metaflow_run_id ON mmifs
+FOR EACH ROW EXECUTE FUNCTION check_reference('metaflow_run_id', 'metaflow_runs');
+
+CREATE CONSTRAINT TRIGGER metaflow_runs_mmifs_metaflow_run_id
+AFTER DELETE OR UPDATE OF id ON metaflow_runs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'metaflow_runs', 'mmifs', 'metaflow_run_id'
+);
+
+CREATE CONSTRAINT TRIGGER mediafilebatchlink_source_mmif_id
+AFTER INSERT OR UPDATE OF source_mmif_id ON mediafilebatchlink
+FOR EACH ROW EXECUTE FUNCTION check_reference('source_mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mediafilebatchlink_source_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mediafilebatchlink', 'source_mmif_id'
+);
+
+CREATE CONSTRAINT TRIGGER mmifbatchinputlink_mmif_id
+AFTER INSERT OR UPDATE OF mmif_id ON mmifbatchinputlink
+FOR EACH ROW EXECUTE FUNCTION check_reference('mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mmifbatchinputlink_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mmifbatchinputlink', 'mmif_id'
+);
+
+CREATE CONSTRAINT TRIGGER mmif_summaries_mmif_id
+AFTER INSERT OR UPDATE OF mmif_id ON mmif_summaries
+FOR EACH ROW EXECUTE FUNCTION check_reference('mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mmif_summaries_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mmif_summaries', 'mmif_id'
+);
+"""
+
+
+@event.listens_for(SQLModel.metadata, 'after_create')
+def create_partitioned_references(metadata, connection, tables=(), **kw):
+    """Create the reference triggers once every table exists, if mmifs was created"""
+    if MMIF.__table__ in tables:
+        connection.execute(DDL(PARTITIONED_REFERENCES))
+
+
+@event.listens_for(MMIF, 'after_insert')
+def mmif_inserted(mapper, connection, target: MMIF):
+    """Collect new MMIFs, to be summarized when their transaction commits"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('new_mmif_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def summarize_new_mmifs(session: Session):
+    mmif_ids = session.info.pop('new_mmif_ids', None)
+    if mmif_ids and MMIF_SUMMARIES:
+        from chowda.summaries import submit_summaries
+
+        submit_summaries(mmif_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_new_mmifs(session: Session):
+    """Drop the MMIFs collected in a transaction that was rolled back"""
+    session.info.pop('new_mmif_ids', None)
@@ -0,0 +1,210 @@
+"""Partitions
+
+Monthly partitions of the `metaflow_runs` and `mmifs` tables.
+
+Both tables are range partitioned by `created_at`, with one partition per calendar
+month (UTC), e.g. `mmifs_y2026m10`, and a `_default` partition for rows outside the
+monthly partitions. Queries filtered by `created_at` only scan the partitions of the
+months they select, and each partition is vacuumed on its own.
+
+Partitions for the next `PARTITION_MONTHS_AHEAD` months are created ahead of time,
+every `PARTITION_INTERVAL` seconds, by whichever worker process takes an advisory lock
+first, or with `python -m chowda.partitions` from a scheduled job. Old partitions can
+be detached from their table, and kept as plain tables to be archived or dropped.
+"""
+
+import re
+import threading
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from sqlalchemy import Connection, text
+
+from chowda.config import (
+    PARTITION_INTERVAL,
+    PARTITION_LOCK_TIMEOUT,
+    PARTITION_MONTHS_AHEAD,
+)
+from chowda.db import engine
+from chowda.log import log
+
+PARTITIONED_TABLES = ('metaflow_runs', 'mmifs')
+
+# Tables and columns that reference the ids of each partitioned table, and must not be
+# left referencing a detached partition. MMIF summaries are detached with their MMIFs.
+REFERENCES = {
+    'metaflow_runs': [('mmifs', 'metaflow_run_id')],
+    'mmifs': [
+        ('mediafilebatchlink', 'source_mmif_id'),
+        ('mmifbatchinputlink', 'mmif_id'),
+    ],
+}
+
+# Tables that keep the ids of each partitioned table unique across its partitions
+ID_TABLES = {'metaflow_runs': 'metaflow_run_ids', 'mmifs': 'mmif_ids'}
+
+PARTITION_NAME = re.compile(r'^(metaflow_runs|mmifs)_y\d{4}m\d{2}$')
+
+# Key of the advisory lock held while partitions are created, so only one process
+# runs partition DDL at a time
+PARTITION_LOCK = 0x63686F77
+
+
+def partition_name(table: str, month: date) -> str:
+    """The name of the partition of a table for a month"""
+    if table not in PARTITIONED_TABLES:
+        raise ValueError(f'{table} is not partitioned')
+    return f'{table}_y{month.year:04}m{month.month:02}'
+
+
+def quote(name: str) -> str:
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def set_lock_timeout(db: Connection):
+    """Give up waiting for table locks after `PARTITION_LOCK_TIMEOUT` seconds, so
+    partition DDL never holds queries up for long behind its lock requests"""
+    db.execute(
+        text("SELECT set_config('lock_timeout', :timeout, true)"),
+        {'timeout': f'{int(PARTITION_LOCK_TIMEOUT * 1000)}ms'},
+    )
+
+
+def create_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create the partitions of this month and the next `months_ahead` months, if
+    they do not exist, and return their names
+
+    Returns an empty list without creating anything while another process is creating
+    partitions.
+    """
+    names = []
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as db:
+            if not db.scalar(
+                text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': PARTITION_LOCK}
+            ):
+                return names
+            set_lock_timeout(db)
+            names += db.scalars(
+                text('SELECT create_monthly_partitions(:table, :months)'),
+                {'table': table, 'months': months_ahead},
+            )
+    return names
+
+
+def partitions(db: Connection, table: str) -> Dict[str, str]:
+    """The partitions of a table, with their bounds, by name"""
+    return dict(
+        db.execute(
+            text(
+                'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+                'FROM pg_inherits JOIN pg_class child ON child.oid = inhrelid '
+                'WHERE inhparent = CAST(:table AS regclass) ORDER BY child.relname'
+            ),
+            {'table': table},
+        ).all()
+    )
+
+
+def detach_partition(table: str, month: date) -> str:
+    """Detach the partition of a month from a table, and return its name
+
+    The detached partition keeps its rows as a plain table, which is no longer read
+    by queries of `table`, and its ids can be used again. The summaries of MMIFs in
+    a detached `mmifs` partition are deleted, and the latest MMIFs of their
+    MediaFiles are recomputed from the remaining MMIFs.
+
+    Raises:
+        ValueError: if other rows still reference rows of the partition.
+    """
+    name = partition_name(table, month)
+    assert PARTITION_NAME.match(name)
+    with engine.begin() as db:
+        set_lock_timeout(db)
+        for referencing, column in REFERENCES[table]:
+            if db.scalar(
+                text(
+                    f'SELECT EXISTS (SELECT FROM {quote(referencing)} JOIN '
+                    f'{quote(name)} detached ON detached.id = {quote(column)})'
+                )
+            ):
+                raise ValueError(f'{name} is still referenced from {referencing}')
+        db.execute(text(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}'))
+        db.execute(
+            text(
+                f'DELETE FROM {quote(ID_TABLES[table])} ids USING {quote(name)} '
+                'detached WHERE ids.id = detached.id'
+            )
+        )
+        if table == 'mmifs':
+            db.execute(
+                text(
+                    'DELETE FROM mmif_summaries USING '
+                    f'{quote(name)} detached WHERE mmif_id = detached.id'
+                )
+            )
+            db.execute(
+                text(
+                    'SELECT refresh_latest_mmif(media_file_id) FROM '
+                    f'(SELECT DISTINCT media_file_id FROM {quote(name)}) detached '
+                    'WHERE media_file_id IS NOT NULL'
+                )
+            )
+    return name
+
+
+class PartitionMaintainer:
+    """Creates upcoming monthly partitions in a background thread
+
+    Attributes:
+        interval: Seconds between checks for missing partitions
+        months_ahead: Number of months after this one to create partitions for
+    """
+
+    def __init__(self, interval: float, months_ahead: int):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='partition-maintainer', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                create_partitions(self.months_ahead)
+            except Exception:
+                log.exception('Error creating partitions')
+            self._stopped.wait(self.interval)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+@lru_cache
+def partition_maintainer() -> PartitionMaintainer:
+    """The process-wide partition maintainer"""
+    return PartitionMaintainer(PARTITION_INTERVAL, PARTITION_MONTHS_AHEAD)
+
+
+def start_partition_maintainer():
+    partition_maintainer().start()
+
+
+def close_partition_maintainer():
+    """Stop creating partitions before the process exits"""
+    if partition_maintainer.cache_info().currsize:
+        partition_maintainer().close()
+
+
+if __name__ == '__main__':
+    for name in create_partitions():
+        print(name)
@@ -0,0 +1,218 @@
+"""Progress
+
+Live MetaflowRun progress for batches, streamed to Batch pages as Server-Sent Events.
+
+Whenever the progress or status of a run is written, a delta with the changed columns
+is published to the progress broker. In each worker process, a `ProgressHub` fans
+deltas out to the streams subscribed to the run's batch. Subscribers have bounded
+queues: a slow client misses its oldest deltas rather than holding on to memory.
+
+The `LocalBroker` hands deltas straight to the hub of its own process, which is all a
+single worker needs. With `PROGRESS_BROKER=postgres`, deltas are sent with
+`pg_notify`, and every worker listens for them, so pages follow runs updated by any
+worker.
+"""
+
+import asyncio
+import json
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+import asyncpg
+from sqlalchemy import func, select
+
+from chowda.config import (
+    PROGRESS_BROKER,
+    PROGRESS_KEEPALIVE,
+    PROGRESS_QUEUE_SIZE,
+)
+from chowda.db import async_engine, engine
+from chowda.log import log
+
+# Postgres channel progress deltas are sent on
+PROGRESS_CHANNEL = 'batch_progress'
+
+Delta = Dict[str, Any]
+
+
+def progress_delta(run_id: str, batch_id: int, **columns: Any) -> Delta:
+    """A JSON serializable delta of the columns of a run"""
+    return {
+        'run_id': run_id,
+        'batch_id': batch_id,
+        **{
+            name: value.isoformat() if isinstance(value, datetime) else value
+            for name, value in columns.items()
+        },
+    }
+
+
+class ProgressHub:
+    """Fans progress deltas out to the subscribers of each batch in this process
+
+    Attributes:
+        queue_size: Number of deltas kept for each subscriber
+        counters: Number of deltas published, delivered and dropped
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: Dict[int, Dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+        self.counters = dict.fromkeys(('published', 'delivered', 'dropped'), 0)
+        self._lock = threading.Lock()
+
+    def subscribe(self, batch_id: int) -> asyncio.Queue:
+        """A queue of the deltas of a batch. Must be called from an event loop."""
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self.subscribers.setdefault(batch_id, {})[queue] = (
+                asyncio.get_running_loop()
+            )
+        return queue
+
+    def unsubscribe(self, batch_id: int, queue: asyncio.Queue):
+        with self._lock:
+            queues = self.subscribers.get(batch_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self.subscribers.pop(batch_id, None)
+
+    def publish(self, delta: Delta):
+        """Deliver a delta to the subscribers of its batch. Safe to call from any
+        thread."""
+        with self._lock:
+            self.counters['published'] += 1
+            queues = list(self.subscribers.get(delta['batch_id'], {}).items())
+        for queue, loop in queues:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, delta)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(delta['batch_id'], queue)
+
+    def _put(self, queue: asyncio.Queue, delta: Delta):
+        with self._lock:
+            if queue.full():
+                queue.get_nowait()
+                self.counters['dropped'] += 1
+            queue.put_nowait(delta)
+            self.counters['delivered'] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self.counters,
+                'subscribers': sum(len(queues) for queues in self.subscribers.values()),
+            }
+
+
+class LocalBroker:
+    """Publishes deltas to the hub of this process only"""
+
+    def __init__(self, hub: ProgressHub):
+        self.hub = hub
+
+    def publish(self, deltas: Iterable[Delta]):
+        for delta in deltas:
+            self.hub.publish(delta)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class PostgresBroker:
+    """Publishes deltas to the hubs of all processes, with Postgres LISTEN/NOTIFY"""
+
+    def __init__(self, hub: ProgressHub, channel: str = PROGRESS_CHANNEL):
+        self.hub = hub
+        self.channel = channel
+        self._connection: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    def publish(self, deltas: Iterable[Delta]):
+        with engine.begin() as connection:
+            for delta in deltas:
+                connection.execute(
+                    select(func.pg_notify(self.channel, json.dumps(delta)))
+                )
+
+    def _notified(self, connection, pid: int, channel: str, payload: str):
+        self.hub.publish(json.loads(payload))
+
+    async def start(self):
+        """Listen for deltas from all processes, on a dedicated connection"""
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                return
+            url = async_engine.url.set(drivername='postgresql')
+            self._connection = await asyncpg.connect(
+                url.render_as_string(hide_password=False)
+            )
+            await self._connection.add_listener(self.channel, self._notified)
+
+    async def close(self):
+        async with self._lock:
+            if self._connection is not None:
+                await self._connection.close()
+                self._connection = None
+
+
+@lru_cache
+def progress_hub() -> ProgressHub:
+    """The progress hub of this process"""
+    return ProgressHub(PROGRESS_QUEUE_SIZE)
+
+
+@lru_cache
+def progress_broker() -> LocalBroker | PostgresBroker:
+    """The process-wide progress broker, set by `PROGRESS_BROKER`"""
+    if PROGRESS_BROKER == 'postgres':
+        return PostgresBroker(progress_hub())
+    return LocalBroker(progress_hub())
+
+
+def publish_progress(deltas: Iterable[Delta]):
+    """Publish the deltas of runs in batches. Errors are logged, never raised, so
+    progress is always written."""
+    deltas = [delta for delta in deltas if delta['batch_id'] is not None]
+    if not deltas:
+        return
+    try:
+        progress_broker().publish(deltas)
+    except Exception:
+        log.exception(f'Error publishing progress of {len(deltas)} runs')
+
+
+async def close_progress_broker():
+    """Stop listening for deltas before the process exits"""
+    if progress_broker.cache_info().currsize:
+        await progress_broker().close()
+
+
+async def batch_events(
+    batch_id: int,
+    disconnected: Callable[[], Awaitable[bool]],
+    keepalive: float = PROGRESS_KEEPALIVE,
+) -> AsyncIterator[str]:
+    """Server-Sent Events with the deltas of a batch, until the client disconnects
+
+    A comment is sent every `keepalive` seconds without deltas, so proxies keep the
+    connection open and disconnects are noticed."""
+    hub = progress_hub()
+    queue = hub.subscribe(batch_id)
+    try:
+        yield f'retry: {int(keepalive * 1000)}\n\n'
+        while not await disconnected():
+            try:
+                delta = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield f'event: run\ndata: {json.dumps(delta)}\n\n'
+    finally:
+        hub.unsubscribe(batch_id, queue)
@@ -0,0 +1,168 @@
+"""Reconciler
+
+Looks up the status of Metaflow runs in the background, for Argo events that do not
+include it, so event handlers never wait on the Metaflow metadata service.
+
+Lookups run on a bounded thread pool. Each run is queued at most once at a time, and
+finished Runs, whose status can no longer change, are cached for
+`METAFLOW_RUN_CACHE_TTL` seconds, so a burst of events for the same run costs a
+single lookup. Events from the `end` step are rechecked a few times, in case Metaflow
+has not recorded the end of the run yet.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from time import monotonic
+from typing import Any, Dict, Optional, Tuple
+
+from metaflow import Run, namespace
+from sqlalchemy import update
+from sqlmodel import Session
+
+from chowda.config import EVENT_RECONCILE_WORKERS, METAFLOW_RUN_CACHE_TTL
+from chowda.db import engine
+from chowda.log import log
+from chowda.models import MetaflowRun
+from chowda.progress import progress_delta, publish_progress
+
+STATUS_KEYS = ('finished', 'finished_at', 'successful')
+
+# Number of times, and seconds between, rechecks of runs at their last step
+END_RECHECKS = 3
+END_RECHECK_DELAY = 10
+
+
+def payload_status(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The status of a run from an event payload, if the payload includes it"""
+    if 'finished' not in payload:
+        return None
+    status = {key: payload.get(key) for key in STATUS_KEYS}
+    status['finished'] = bool(status['finished'])
+    if isinstance(status['finished_at'], str):
+        status['finished_at'] = datetime.fromisoformat(status['finished_at'])
+    if not status['finished']:
+        status['finished_at'] = status['successful'] = None
+    return status
+
+
+class RunReconciler:
+    """Updates the status of MetaflowRuns from Metaflow in the background
+
+    Attributes:
+        ttl: Number of seconds Run objects are cached for
+        counters: Number of lookups, cache hits, skipped duplicates and runs finished
+    """
+
+    def __init__(self, workers: int, ttl: float):
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='run-reconciler'
+        )
+        self.queued = set()
+        self.runs: Dict[str, Tuple[float, Run]] = {}
+        self.counters = dict.fromkeys(
+            ('lookups', 'hits', 'skipped', 'finished', 'errors'), 0
+        )
+        self._lock = threading.Lock()
+
+    def count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'queued': len(self.queued)}
+
+    def submit(self, flow_name: str, run_id: str, rechecks: int = 0):
+        """Queue a status update for a run, unless one is already queued.
+
+        If the run has not finished, it is checked again up to `rechecks` times."""
+        pathspec = f'{flow_name}/{run_id}'
+        with self._lock:
+            if pathspec in self.queued:
+                self.counters['skipped'] += 1
+                return
+            self.queued.add(pathspec)
+        try:
+            self.executor.submit(self.reconcile, pathspec, run_id, rechecks)
+        except RuntimeError:
+            # Shutting down
+            with self._lock:
+                self.queued.discard(pathspec)
+
+    def get_run(self, pathspec: str) -> Run:
+        """A Run from the cache, or from the Metaflow metadata service"""
+        now = monotonic()
+        with self._lock:
+            # Drop expired Runs, so the cache stays small
+            self.runs = {
+                key: value for key, value in self.runs.items() if value[0] > now
+            }
+            cached = self.runs.get(pathspec)
+        if cached:
+            self.count('hits')
+            return cached[1]
+        self.count('lookups')
+        namespace(None)
+        run = Run(pathspec)
+        if run.finished:
+            with self._lock:
+                self.runs[pathspec] = (now + self.ttl, run)
+        return run
+
+    def reconcile(self, pathspec: str, run_id: str, rechecks: int = 0):
+        """Record the status of a run, if it has finished"""
+        with self._lock:
+            self.queued.discard(pathspec)
+        try:
+            run = self.get_run(pathspec)
+            if not run.finished:
+                if rechecks:
+                    flow_name = pathspec.split('/')[0]
+                    timer = threading.Timer(
+                        END_RECHECK_DELAY,
+                        self.submit,
+                        (flow_name, run_id, rechecks - 1),
+                    )
+                    timer.daemon = True
+                    timer.start()
+                return
+            write_status(
+                run_id,
+                finished=True,
+                finished_at=run.finished_at,
+                successful=run.successful,
+            )
+            self.count('finished')
+        except Exception:
+            self.count('errors')
+            log.exception(f'Error reconciling Metaflow run {pathspec}')
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def write_status(run_id: str, **status: Any):
+    with Session(engine) as db:
+        batch_id = db.scalar(
+            update(MetaflowRun)
+            .where(MetaflowRun.id == run_id)
+            .values(**status)
+            .returning(MetaflowRun.batch_id)
+        )
+        db.commit()
+    publish_progress([progress_delta(run_id, batch_id, **status)])
+
+
+@lru_cache
+def run_reconciler() -> RunReconciler:
+    """The process-wide run reconciler"""
+    return RunReconciler(EVENT_RECONCILE_WORKERS, METAFLOW_RUN_CACHE_TTL)
+
+
+def close_run_reconciler():
+    """Finish queued lookups before the process exits"""
+    if run_reconciler.cache_info().currsize:
+        run_reconciler().close()
@@ -1,5 +1,19 @@
+from .batches import batches
+from .collections import collections
 from .dashboard import dashboard
 from .events import events
+from .exports import exports
+from .metrics import metrics
+from .progress import progress
 from .sony_ci import sony_ci
 
-__all__ = ['dashboard', 'events', 'sony_ci']
+__all__ = [
+    'batches',
+    'collections',
+    'dashboard',
+    'events',
+    'exports',
+    'metrics',
+    'progress',
+    'sony_ci',
+]
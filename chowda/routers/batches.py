@@ -0,0 +1,108 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from chowda.auth.utils import permissions
+from chowda.db import get_async_session
+from chowda.models import Batch, MediaFileBatchLink
+from chowda.sets import SetExpression, create_batch_from_set
+from chowda.uploads import upload_media_files
+
+batches = APIRouter()
+
+
+class BatchSetRequest(BaseModel):
+    """Create a Batch from a set expression over Batches and Collections"""
+
+    name: str
+    description: str = ''
+    expression: SetExpression
+
+
+class BatchSetResponse(BaseModel):
+    id: int
+    size: int
+
+
+class GuidUploadResponse(BaseModel):
+    """Result of uploading a GUID list
+
+    Attributes:
+        id: Batch or Collection ID
+        added: Number of MediaFiles added
+        missing: The first GUIDs that do not have a MediaFile
+        missing_count: Number of GUIDs that do not have a MediaFile
+    """
+
+    id: int
+    added: int
+    missing: List[str] = []
+    missing_count: int = 0
+
+
+@batches.post(
+    '/set', tags=['batches'], dependencies=[Depends(permissions('create:batch'))]
+)
+async def batch_from_set(
+    batch_set: BatchSetRequest, db: AsyncSession = Depends(get_async_session)
+) -> BatchSetResponse:
+    """Create a new Batch from unions, intersections and differences of Batches and
+    Collections, optionally filtered by run status."""
+    batch, size = await db.run_sync(
+        create_batch_from_set,
+        batch_set.name,
+        batch_set.description,
+        batch_set.expression,
+    )
+    await db.commit()
+    return BatchSetResponse(id=batch.id, size=size)
+
+
+@batches.post(
+    '/upload', tags=['batches'], dependencies=[Depends(permissions('create:batch'))]
+)
+async def upload_batch(
+    request: Request,
+    name: str,
+    description: str = '',
+    strict: bool = True,
+    db: AsyncSession = Depends(get_async_session),
+) -> GuidUploadResponse:
+    """Create a new Batch from an uploaded GUID list.
+
+    GUIDs can be uploaded as the `file` field of a multipart form, or as the raw
+    request body, as whitespace separated text, CSV or NDJSON."""
+    batch = Batch(name=name, description=description)
+    db.add(batch)
+    await db.flush()
+    batch_id = batch.id
+    added, missing, missing_count = await upload_media_files(
+        request, db, MediaFileBatchLink, 'batch_id', batch_id, strict
+    )
+    return GuidUploadResponse(
+        id=batch_id, added=added, missing=missing, missing_count=missing_count
+    )
+
+
+@batches.post(
+    '/{batch_id}/media_files',
+    tags=['batches'],
+    dependencies=[Depends(permissions('create:batch'))],
+)
+async def upload_batch_media_files(
+    request: Request,
+    batch_id: int,
+    strict: bool = True,
+    db: AsyncSession = Depends(get_async_session),
+) -> GuidUploadResponse:
+    """Add an uploaded GUID list to an existing Batch."""
+    if not await db.get(Batch, batch_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, 'Batch not found')
+    added, missing, missing_count = await upload_media_files(
+        request, db, MediaFileBatchLink, 'batch_id', batch_id, strict
+    )
+    return GuidUploadResponse(
+        id=batch_id, added=added, missing=missing, missing_count=missing_count
+    )
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from chowda.auth.utils import permissions
+from chowda.db import get_async_session
+from chowda.models import Collection, MediaFileCollectionLink
+from chowda.routers.batches import GuidUploadResponse
+from chowda.uploads import upload_media_files
+
+collections = APIRouter()
+
+
+@collections.post(
+    '/upload',
+    tags=['collections'],
+    dependencies=[Depends(permissions('create:collection'))],
+)
+async def upload_collection(
+    request: Request,
+    name: str,
+    description: str = '',
+    strict: bool = True,
+    db: AsyncSession = Depends(get_async_session),
+) -> GuidUploadResponse:
+    """Create a new Collection from an uploaded GUID list.
+
+    GUIDs can be uploaded as the `file` field of a multipart form, or as the raw
+    request body, as whitespace separated text, CSV or NDJSON."""
+    collection = Collection(name=name, description=description)
+    db.add(collection)
+    await db.flush()
+    collection_id = collection.id
+    added, missing, missing_count = await upload_media_files(
+        request, db, MediaFileCollectionLink, 'collection_id', collection_id, strict
+    )
+    return GuidUploadResponse(
+        id=collection_id, added=added, missing=missing, missing_count=missing_count
+    )
+
+
+@collections.post(
+    '/{collection_id}/media_files',
+    tags=['collections'],
+    dependencies=[Depends(permissions('create:collection'))],
+)
+async def upload_collection_media_files(
+    request: Request,
+    collection_id: int,
+    strict: bool = True,
+    db: AsyncSession = Depends(get_async_session),
+) -> GuidUploadResponse:
+    """Add an uploaded GUID list to an existing Collection."""
+    if not await db.get(Collection, collection_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, 'Collection not found')
+    added, missing, missing_count = await upload_media_files(
+        request, db, MediaFileCollectionLink, 'collection_id', collection_id, strict
+    )
+    return GuidUploadResponse(
+        id=collection_id, added=added, missing=missing, missing_count=missing_count
+    )
@@ -1,18 +1,33 @@
 from json import JSONDecodeError, loads
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from metaflow import Run, namespace
-from sqlmodel import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import exists, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from chowda.auth.utils import permissions
-from chowda.db import engine
-from chowda.models import MetaflowRun
+from chowda.db import get_async_session
+from chowda.event_buffer import event_buffer
+from chowda.event_keys import (
+    delete_expired_event_keys,
+    event_key,
+    event_keys,
+    event_time,
+    store_keys,
+)
+from chowda.models import EventKey, MetaflowRun
+from chowda.progress import progress_delta, publish_progress
+from chowda.reconciler import END_RECHECKS, payload_status, run_reconciler
 
 events = APIRouter()
 
 
 @events.post('/', dependencies=[Depends(permissions('create:event'))])
-async def event(event: dict):
+async def event(
+    event: dict,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_session),
+):
     """Receive an event from Argo Events."""
     print('Chowda event received', event)
     body = event.get('body')
@@ -43,22 +58,80 @@ async def event(event: dict):
     if body['name'].startswith('metaflow.Pipeline'):
         print('Found event!', body['name'])
         payload = body['payload']
-        with Session(engine) as db:
-            row = db.get(MetaflowRun, payload['run_id'])
-            if not row:
-                raise HTTPException(
-                    status.HTTP_404_NOT_FOUND, 'MetaflowRun row not found!'
-                )
-            namespace(None)
-            run = Run(f"{payload['flow_name']}/{payload['run_id']}")
-            row.finished = run.finished
-            row.finished_at = run.finished_at
+        keys = event_keys()
+        key = event_key(body['name'], payload)
+        if keys.seen(key):
+            return 'Duplicate event'
+        event_at = event_time(payload)
+        run_status = payload_status(payload)
+        if run_status is None:
+            # Look up the status from Metaflow in the background
+            run_reconciler().submit(
+                payload['flow_name'],
+                payload['run_id'],
+                rechecks=END_RECHECKS if payload['step_name'] == 'end' else 0,
+            )
+        finished = bool(run_status and run_status['finished'])
+        buffer = event_buffer()
+        if buffer is None:
+            if keys.cleanup_due():
+                background_tasks.add_task(delete_expired_event_keys)
+        else:
+            # Progress is written in batches, but finished runs are written at once.
+            # Buffered events are not checked against stored keys: their progress is
+            # only written if no later event has been.
+            if not finished:
+                if not buffer.knows(payload['run_id']) and not await db.scalar(
+                    select(exists().where(MetaflowRun.id == payload['run_id']))
+                ):
+                    raise HTTPException(
+                        status.HTTP_404_NOT_FOUND, 'MetaflowRun row not found!'
+                    )
+                if buffer.add(
+                    payload['run_id'],
+                    event_at,
+                    key,
+                    current_step=payload['step_name'],
+                    current_task=payload['task_id'],
+                ):
+                    keys.add(key)
+                    return None
+            buffer.discard(payload['run_id'])
+        # Store the key first, to find events already processed by other workers
+        if not await db.scalar(store_keys([key]).returning(EventKey.key)):
+            await db.rollback()
+            keys.add(key, stored=True)
+            return 'Duplicate event'
+        row = await db.get(MetaflowRun, payload['run_id'])
+        if not row:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, 'MetaflowRun row not found!')
+        if run_status is not None:
+            row.finished = run_status['finished']
+            row.finished_at = run_status['finished_at']
             if row.finished:
-                row.successful = run.successful
+                row.successful = run_status['successful']
+        # Events can arrive out of order: only a later event updates the progress
+        if row.last_event_at is None or row.last_event_at <= event_at:
             row.current_step = payload['step_name']
             row.current_task = payload['task_id']
-            db.add(row)
-            db.commit()
-            print('Successfully updated MetaflowRun row!', row)
-            return None
+            row.last_event_at = event_at
+        db.add(row)
+        await db.commit()
+        keys.add(key)
+        await run_in_threadpool(
+            publish_progress,
+            [
+                progress_delta(
+                    row.id,
+                    row.batch_id,
+                    current_step=row.current_step,
+                    current_task=row.current_task,
+                    finished=row.finished,
+                    finished_at=row.finished_at,
+                    successful=row.successful,
+                )
+            ],
+        )
+        print('Successfully updated MetaflowRun row!', row)
+        return None
     return 'Event successfully processed, but did not match known event'
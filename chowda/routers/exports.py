@@ -0,0 +1,67 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.responses import Response
+
+from chowda.db import get_async_read_session
+from chowda.exports import export_response, is_expired
+from chowda.models import ExportJob, ExportStatus
+
+exports = APIRouter()
+
+
+class ExportJobStatus(BaseModel):
+    """Status and progress of a MMIF export job"""
+
+    id: int
+    status: ExportStatus
+    mmif_count: int
+    completed: int
+    size: Optional[int] = None
+    error: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    download_url: Optional[str] = None
+
+
+async def get_export_job(db: AsyncSession, job_id: int) -> ExportJob:
+    job = await db.get(ExportJob, job_id)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, 'Export job not found')
+    return job
+
+
+@exports.get('/{job_id}')
+async def export_status(
+    request: Request, job_id: int, db: AsyncSession = Depends(get_async_read_session)
+) -> ExportJobStatus:
+    """Get the status and progress of an export job."""
+    job = await get_export_job(db, job_id)
+    finished = job.status == ExportStatus.FINISHED and not is_expired(job)
+    return ExportJobStatus(
+        id=job.id,
+        status=ExportStatus.EXPIRED if is_expired(job) else job.status,
+        mmif_count=job.mmif_count,
+        completed=job.completed,
+        size=job.size,
+        error=job.error,
+        expires_at=job.expires_at,
+        download_url=(
+            str(request.url_for('download_export', job_id=job.id)) if finished else None
+        ),
+    )
+
+
+@exports.get('/{job_id}/download')
+async def download_export(
+    job_id: int, db: AsyncSession = Depends(get_async_read_session)
+) -> Response:
+    """Download the archive of a finished export job."""
+    job = await get_export_job(db, job_id)
+    if is_expired(job):
+        raise HTTPException(status.HTTP_410_GONE, 'Export has expired')
+    if job.status != ExportStatus.FINISHED:
+        raise HTTPException(status.HTTP_409_CONFLICT, 'Export is not finished')
+    return export_response(job)
@@ -0,0 +1,49 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends
+
+from chowda.auth.jwks import jwks
+from chowda.auth.tokens import access_token_cache
+from chowda.auth.utils import permissions
+from chowda.db import (
+    async_engine,
+    async_read_engine,
+    engine,
+    pool_stats,
+    read_engine,
+)
+from chowda.event_buffer import event_buffer
+from chowda.event_keys import event_keys
+from chowda.mmif_cache import mmif_cache
+from chowda.progress import progress_hub
+from chowda.reconciler import run_reconciler
+
+metrics = APIRouter()
+
+
+def db_pools() -> Dict[str, Any]:
+    """Stats of the database pools, including the read replica's if there is one"""
+    pools = {'sync': pool_stats(engine), 'async': pool_stats(async_engine)}
+    if read_engine is not engine:
+        pools['read_sync'] = pool_stats(read_engine)
+    if async_read_engine is not async_engine:
+        pools['read_async'] = pool_stats(async_read_engine)
+    return pools
+
+
+@metrics.get('/', tags=['metrics'], dependencies=[Depends(permissions('read:metrics'))])
+def get_metrics() -> Dict[str, Any]:
+    """Counters for this worker process"""
+    cache = mmif_cache()
+    buffer = event_buffer()
+    tokens = access_token_cache()
+    return {
+        'mmif_cache': cache.stats() if cache else None,
+        'event_buffer': buffer.stats() if buffer else None,
+        'run_reconciler': run_reconciler().stats(),
+        'event_keys': event_keys().stats(),
+        'progress': progress_hub().stats(),
+        'jwks': jwks().stats(),
+        'access_tokens': tokens.stats() if tokens else None,
+        'db_pool': db_pools(),
+    }
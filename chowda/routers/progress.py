@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from chowda.progress import batch_events, progress_broker
+
+progress = APIRouter()
+
+
+@progress.get('/batches/{batch_id}')
+async def batch_progress(request: Request, batch_id: int) -> StreamingResponse:
+    """Stream the progress of the MetaflowRuns in a batch as Server-Sent Events."""
+    await progress_broker().start()
+    return StreamingResponse(
+        batch_events(batch_id, request.is_disconnected),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
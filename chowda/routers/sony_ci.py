@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi_cache import FastAPICache
@@ -9,6 +9,7 @@ from metaflow import Flow
 from metaflow.exception import MetaflowNotFound
 from metaflow.integrations import ArgoEvent
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from chowda.auth.utils import permissions
 from chowda.config import MARIO_URL
@@ -25,8 +26,8 @@ async def lifespan():
     await sync_history()
 
 
-@cache(namespace='sonyci', expire=30)
-async def sync_history(n: int = 3) -> Dict[str, Any]:
+def ingest_runs(n: int) -> List[Dict[str, Any]]:
+    """The latest `n` IngestFlow runs, from the Metaflow metadata service"""
     try:
         return [
             {
@@ -42,6 +43,12 @@ async def sync_history(n: int = 3) -> Dict[str, Any]:
         return []
 
 
+@cache(namespace='sonyci', expire=30)
+async def sync_history(n: int = 3) -> Dict[str, Any]:
+    # Metaflow client calls block, so they are run outside of the event loop
+    return await run_in_threadpool(ingest_runs, n)
+
+
 class SyncResponse(BaseModel):
     started_at: datetime
 
@@ -51,7 +58,7 @@ class SyncResponse(BaseModel):
 )
 async def sony_ci_sync() -> SyncResponse:
     try:
-        ArgoEvent('sync').publish(ignore_errors=False)
+        await run_in_threadpool(ArgoEvent('sync').publish, ignore_errors=False)
         FastAPICache.clear(namespace='sonyci')
         return SyncResponse(started_at=datetime.utcnow())
     except Exception as error:
@@ -0,0 +1,159 @@
+"""S3
+
+Shared S3 client and concurrent fetching of MMIF objects
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from time import sleep
+from typing import Iterable, Iterator, Optional, Tuple
+
+from chowda.config import (
+    MMIF_S3_BUCKET_NAME,
+    MMIF_S3_CONCURRENCY,
+    MMIF_S3_RETRIES,
+)
+from chowda.log import log
+from chowda.mmif_cache import mmif_cache
+
+# Size of chunks read from S3 object bodies
+MMIF_CHUNK_SIZE = 1024 * 1024
+
+# S3 error codes that will not succeed on retry
+PERMANENT_ERRORS = {
+    '304',
+    'NotModified',
+    '404',
+    'NoSuchKey',
+    'NoSuchBucket',
+    '403',
+    'AccessDenied',
+}
+
+
+@lru_cache
+def s3_client():
+    """Return a process-wide S3 client.
+
+    boto3 clients are thread safe, and sharing one shares its connection pool, which is
+    sized to the number of concurrent requests."""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        's3',
+        config=Config(
+            max_pool_connections=MMIF_S3_CONCURRENCY,
+            retries={'max_attempts': MMIF_S3_RETRIES, 'mode': 'standard'},
+        ),
+    )
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Whether an S3 error should not be retried"""
+    from botocore.exceptions import ClientError
+
+    return (
+        isinstance(error, ClientError)
+        and error.response.get('Error', {}).get('Code') in PERMANENT_ERRORS
+    )
+
+
+def with_retries(fn, *args, retries: int = MMIF_S3_RETRIES, **kwargs):
+    """Call `fn`, retrying with exponential backoff on transient errors.
+
+    botocore retries failed API calls, but not errors while reading the object body,
+    so each object is retried as a whole."""
+    for attempt in range(retries):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as error:
+            if is_permanent_error(error) or attempt == retries - 1:
+                raise
+            log.warning(f'Retrying S3 request after error: {error!s}')
+            sleep(0.5 * 2**attempt)
+    return None
+
+
+def get_mmif_object(mmif_location: str, etag: Optional[str] = None) -> dict:
+    """Get a MMIF object from S3. If `etag` is given, the request is conditional, and
+    fails with a `304` error if the object has not changed."""
+    conditions = {'IfNoneMatch': etag} if etag else {}
+    return with_retries(
+        s3_client().get_object,
+        Bucket=MMIF_S3_BUCKET_NAME,
+        Key=mmif_location,
+        **conditions,
+    )
+
+
+def open_mmif(mmif_location: str) -> dict:
+    """Open a MMIF object, from the local cache if it is enabled, otherwise from S3.
+    The returned `Body` is streamed as it is read."""
+    cache = mmif_cache()
+    if cache:
+        return cache.open(mmif_location, get_mmif_object)
+    return get_mmif_object(mmif_location)
+
+
+def presign_mmif(mmif_location: str, expires: int) -> str:
+    """A presigned URL to get a MMIF object directly from S3, valid for `expires`
+    seconds. URLs are signed locally, without a request to S3."""
+    return s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': MMIF_S3_BUCKET_NAME, 'Key': mmif_location},
+        ExpiresIn=expires,
+    )
+
+
+def iter_mmif_objects(
+    mmif_locations: Iterable[str], prefetch: int = MMIF_S3_CONCURRENCY
+) -> Iterator[Tuple[str, dict | Exception]]:
+    """Open MMIF objects in order, while the next `prefetch` objects are opened in the
+    background.
+
+    Yields:
+        (mmif_location, object) pairs, or (mmif_location, error) if the object could
+        not be opened.
+    """
+    locations = iter(mmif_locations)
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque(
+            (location, pool.submit(open_mmif, location))
+            for location in islice(locations, prefetch)
+        )
+        while pending:
+            location, future = pending.popleft()
+            for next_location in islice(locations, 1):
+                pending.append((next_location, pool.submit(open_mmif, next_location)))
+            try:
+                yield location, future.result()
+            except Exception as error:
+                yield location, error
+
+
+def mmif_zip_entries(
+    objects: Iterable[Tuple[str, dict | Exception]],
+) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    """Map opened MMIF objects to zip entries. Objects that could not be opened are
+    listed in a final `download_errors.txt` entry instead."""
+    errors = {}
+    for mmif_location, mmif in objects:
+        if isinstance(mmif, Exception):
+            log.error(f'Error downloading {mmif_location}: {mmif!s}')
+            errors[mmif_location] = mmif
+            continue
+        yield mmif_location.split('/')[-1], mmif['Body'].iter_chunks(MMIF_CHUNK_SIZE)
+    if errors:
+        yield (
+            'download_errors.txt',
+            iter(
+                [
+                    '\n'.join(
+                        f'{location}: {error!s}' for location, error in errors.items()
+                    ).encode()
+                ]
+            ),
+        )
@@ -0,0 +1,218 @@
+"""Sessions
+
+Server-side sessions for the admin interface.
+
+Starlette's `SessionMiddleware` keeps the whole session (the Auth0 `userinfo`, flash
+and error messages) in a signed cookie, which is re-signed on every response and
+uploaded with every request. `ServerSessionMiddleware` stores sessions in a
+`SessionStore` instead, and the cookie only holds a random session id. Sessions are
+only written when they change, or when less than half of their lifetime remains.
+The session id is replaced when a user logs in, so an id issued before login cannot
+be used to reach the logged in session.
+
+`SESSION_BACKEND` selects the store:
+    - `postgres`: the `sessions` table, shared by all workers
+    - `memory`: a dict in the worker process, for tests and development
+    - `cookie`: Starlette's signed cookie sessions
+"""
+
+import json
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+from secrets import token_urlsafe
+from time import monotonic
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from chowda.config import SECRET, SESSION_BACKEND, SESSION_MAX_AGE
+from chowda.db import async_engine
+from chowda.models import WebSession
+
+SessionData = Dict[str, Any]
+
+# Minimum seconds between deletions of expired sessions
+CLEANUP_INTERVAL = 60 * 60
+
+
+def session_key(session_id: str) -> str:
+    """The key a session is stored under, so stored keys cannot be used as cookies"""
+    return sha256(session_id.encode()).hexdigest()
+
+
+class SessionStore(ABC):
+    """Loads and saves sessions by session id"""
+
+    @abstractmethod
+    async def load(self, session_id: str) -> Optional[Tuple[SessionData, datetime]]:
+        """The data and expiry of a session, unless it does not exist or expired"""
+
+    @abstractmethod
+    async def save(self, session_id: str, data: SessionData, expires_at: datetime):
+        pass
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions in a dict, for a single process"""
+
+    def __init__(self):
+        self.sessions: Dict[str, Tuple[str, datetime]] = {}
+        self._lock = threading.Lock()
+
+    async def load(self, session_id: str) -> Optional[Tuple[SessionData, datetime]]:
+        with self._lock:
+            stored = self.sessions.get(session_key(session_id))
+        if stored is None or stored[1] <= datetime.now(timezone.utc):
+            return None
+        return json.loads(stored[0]), stored[1]
+
+    async def save(self, session_id: str, data: SessionData, expires_at: datetime):
+        with self._lock:
+            self.sessions[session_key(session_id)] = (json.dumps(data), expires_at)
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            self.sessions.pop(session_key(session_id), None)
+
+
+class PostgresSessionStore(SessionStore):
+    """Sessions in the `sessions` table. Expired sessions are deleted at most once
+    every `CLEANUP_INTERVAL` seconds."""
+
+    def __init__(self):
+        self._last_cleanup = monotonic()
+
+    async def load(self, session_id: str) -> Optional[Tuple[SessionData, datetime]]:
+        async with async_engine.connect() as connection:
+            row = (
+                await connection.execute(
+                    select(WebSession.data, WebSession.expires_at)
+                    .where(WebSession.id == session_key(session_id))
+                    .where(WebSession.expires_at > datetime.now(timezone.utc))
+                )
+            ).first()
+        return tuple(row) if row else None
+
+    async def save(self, session_id: str, data: SessionData, expires_at: datetime):
+        statement = insert(WebSession).values(
+            id=session_key(session_id), data=data, expires_at=expires_at
+        )
+        async with async_engine.begin() as connection:
+            await connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=['id'],
+                    set_={'data': data, 'expires_at': expires_at},
+                )
+            )
+            if monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                self._last_cleanup = monotonic()
+                await connection.execute(
+                    delete(WebSession).where(
+                        WebSession.expires_at <= datetime.now(timezone.utc)
+                    )
+                )
+
+    async def delete(self, session_id: str):
+        async with async_engine.begin() as connection:
+            await connection.execute(
+                delete(WebSession).where(WebSession.id == session_key(session_id))
+            )
+
+
+class ServerSessionMiddleware:
+    """Provides `request.session` from a `SessionStore`, with the session id in a
+    cookie. Requests to `skip_paths` (e.g. static files) have no session."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: SessionStore,
+        session_cookie: str = 'session',
+        max_age: int = SESSION_MAX_AGE,
+        path: str = '/',
+        same_site: str = 'lax',
+        https_only: bool = False,
+        skip_paths: Sequence[str] = ('/static/',),
+    ):
+        self.app = app
+        self.store = store
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.cookie_attributes = f'path={path}; httponly; samesite={same_site}'
+        if https_only:
+            self.cookie_attributes += '; secure'
+        self.skip_paths = tuple(skip_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] not in ('http', 'websocket') or scope['path'].startswith(
+            self.skip_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        stored = await self.store.load(session_id) if session_id else None
+        if stored is None:
+            # Never reuse an unknown session id from the client
+            session_id = None
+        data, expires_at = stored or ({}, None)
+        scope['session'] = dict(data)
+        initial = json.dumps(data, sort_keys=True)
+
+        async def send_wrapper(message: Message):
+            nonlocal session_id
+            if message['type'] == 'http.response.start':
+                session = scope['session']
+                now = datetime.now(timezone.utc)
+                if session:
+                    changed = json.dumps(session, sort_keys=True) != initial
+                    stale = expires_at is None or (expires_at - now).total_seconds() < (
+                        self.max_age / 2
+                    )
+                    if changed or stale:
+                        if session_id and session.get('user') != data.get('user'):
+                            # Rotate the session id when the user changes at login
+                            await self.store.delete(session_id)
+                            session_id = None
+                        session_id = session_id or token_urlsafe(32)
+                        await self.store.save(
+                            session_id, session, now + timedelta(seconds=self.max_age)
+                        )
+                        self.set_cookie(message, session_id, self.max_age)
+                elif session_id:
+                    await self.store.delete(session_id)
+                    self.set_cookie(message, 'null', 0)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def set_cookie(self, message: Message, value: str, max_age: int):
+        headers = MutableHeaders(scope=message)
+        headers.append(
+            'Set-Cookie',
+            f'{self.session_cookie}={value}; Max-Age={max_age}; '
+            f'{self.cookie_attributes}',
+        )
+
+
+def session_middleware(backend: str = SESSION_BACKEND) -> Middleware:
+    """The session middleware for a `SESSION_BACKEND`"""
+    if backend == 'cookie':
+        return Middleware(SessionMiddleware, secret_key=SECRET, max_age=SESSION_MAX_AGE)
+    if backend == 'memory':
+        return Middleware(ServerSessionMiddleware, store=MemorySessionStore())
+    if backend == 'postgres':
+        return Middleware(ServerSessionMiddleware, store=PostgresSessionStore())
+    raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
@@ -0,0 +1,131 @@
+"""Sets
+
+Set algebra over Batches and Collections, compiled to a single SQL statement
+"""
+
+import enum
+from typing import List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+from sqlalchemy import and_, except_, exists, insert, intersect, literal, not_, union
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from chowda.models import (
+    Batch,
+    MediaFileBatchLink,
+    MediaFileCollectionLink,
+    MetaflowRun,
+)
+
+
+class RunStatus(enum.Enum):
+    """Filter the MediaFiles of a Batch by the status of their MetaflowRuns"""
+
+    STARTED = 'started'
+    UNSTARTED = 'unstarted'
+    FINISHED = 'finished'
+    SUCCESSFUL = 'successful'
+    FAILED = 'failed'
+
+
+class BatchSet(BaseModel):
+    """The MediaFiles in a Batch, optionally filtered by run status"""
+
+    batch: int
+    status: Optional[RunStatus] = None
+
+
+class CollectionSet(BaseModel):
+    """The MediaFiles in a Collection"""
+
+    collection: int
+
+
+class SetOperation(BaseModel):
+    """A set operation over one or more set expressions
+
+    Attributes:
+        op: `union`, `intersection` or `difference`
+        operands: Set expressions. A difference subtracts all following operands
+            from the first one.
+    """
+
+    op: Literal['union', 'intersection', 'difference']
+    operands: List['SetExpression'] = Field(min_length=1)
+
+
+SetExpression = Union[BatchSet, CollectionSet, SetOperation]
+SetOperation.model_rebuild()
+
+OPERATIONS = {'union': union, 'intersection': intersect, 'difference': except_}
+
+
+def run_status_clause(batch_id: int, status: RunStatus):
+    """Returns a WHERE clause filtering MediaFileBatchLink rows by run status"""
+    runs = and_(
+        MetaflowRun.batch_id == batch_id,
+        MetaflowRun.media_file_id == MediaFileBatchLink.media_file_id,
+    )
+    if status == RunStatus.STARTED:
+        return exists().where(runs)
+    if status == RunStatus.UNSTARTED:
+        return not_(exists().where(runs))
+    if status == RunStatus.FINISHED:
+        return exists().where(runs, MetaflowRun.finished)
+    if status == RunStatus.SUCCESSFUL:
+        return exists().where(runs, MetaflowRun.successful)
+    # FAILED: finished unsuccessfully, and never succeeded in this batch
+    return and_(
+        exists().where(runs, MetaflowRun.finished, not_(MetaflowRun.successful)),
+        not_(exists().where(runs, MetaflowRun.successful)),
+    )
+
+
+def media_file_guids(expression: SetExpression) -> Select:
+    """Compile a set expression into a SELECT of MediaFile GUIDs
+
+    The result is a single column named `guid`, and is evaluated entirely in the
+    database.
+    """
+    if isinstance(expression, BatchSet):
+        query = select(MediaFileBatchLink.media_file_id.label('guid')).where(
+            MediaFileBatchLink.batch_id == expression.batch
+        )
+        if expression.status:
+            query = query.where(run_status_clause(expression.batch, expression.status))
+        return query
+    if isinstance(expression, CollectionSet):
+        return select(MediaFileCollectionLink.media_file_id.label('guid')).where(
+            MediaFileCollectionLink.collection_id == expression.collection
+        )
+    operands = [media_file_guids(operand) for operand in expression.operands]
+    if len(operands) == 1:
+        return operands[0]
+    compound = OPERATIONS[expression.op](*operands).subquery()
+    return select(compound.c.guid)
+
+
+def create_batch_from_set(
+    db: Session, name: str, description: str, expression: SetExpression
+) -> tuple[Batch, int]:
+    """Create a new Batch from a set expression
+
+    The Batch's MediaFiles are inserted with a single INSERT ... SELECT statement,
+    so GUIDs never pass through Python. The caller is responsible for committing.
+
+    Returns:
+        The new Batch, and the number of MediaFiles added to it.
+    """
+    batch = Batch(name=name, description=description)
+    db.add(batch)
+    db.flush()
+
+    guids = media_file_guids(expression).subquery()
+    result = db.execute(
+        insert(MediaFileBatchLink).from_select(
+            ['media_file_id', 'batch_id'],
+            select(guids.c.guid, literal(batch.id)),
+        )
+    )
+    return batch, result.rowcount
@@ -0,0 +1,179 @@
+"""Summaries
+
+Summaries of MMIF contents, extracted when MMIFs are registered, so MMIFs can be
+queried without downloading them from S3. MMIFs are hashed at the same time, to link
+identical MMIFs to their shared contents.
+
+MMIFs are parsed with a streaming JSON parser, so memory use does not depend on the
+size of the MMIF.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+import ijson
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from chowda.config import MMIF_SUMMARY_WORKERS
+from chowda.contents import HashingReader, link_content
+from chowda.db import engine
+from chowda.log import log
+from chowda.models import MMIF, MMIFSummary
+from chowda.s3 import open_mmif
+
+# Size of chunks read by the parser
+PARSER_BUFFER_SIZE = 64 * 1024
+
+ANNOTATION = 'views.item.annotations.item'
+
+
+class CountingReader:
+    """Counts the bytes read from a file-like object"""
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.size += len(data)
+        return data
+
+
+def short_type(at_type: str) -> str:
+    """The name of a CLAMS vocabulary type, without its URL and version
+
+    e.g. http://mmif.clams.ai/vocabulary/TimeFrame/v5 -> TimeFrame
+    """
+    if '/vocabulary/' in at_type:
+        return at_type.split('/vocabulary/')[-1].split('/')[0]
+    return at_type
+
+
+def summarize(file: BinaryIO) -> Dict[str, Any]:
+    """Summarize a MMIF file, reading it in chunks.
+
+    Returns:
+        A dict of MMIFSummary values: the MMIF version, the apps of each view, the
+        number of views, error views, documents and annotations, the number of
+        annotations of each type, the duration of each document that has one, and
+        the size of the MMIF in bytes. Durations are in the units of the MMIF.
+    """
+    reader = CountingReader(file)
+    summary = {
+        'mmif_version': None,
+        'apps': [],
+        'view_count': 0,
+        'error_count': 0,
+        'document_count': 0,
+        'annotation_count': 0,
+    }
+    annotation_types = Counter()
+    durations = {}
+    document, annotation = None, {}
+    for prefix, event, value in ijson.parse(reader, buf_size=PARSER_BUFFER_SIZE):
+        if prefix == 'metadata.mmif':
+            summary['mmif_version'] = value
+        elif prefix == 'documents.item' and event == 'start_map':
+            summary['document_count'] += 1
+        elif prefix == 'documents.item.properties.id':
+            document = value
+        elif prefix == 'documents.item.properties.duration':
+            durations[document] = float(value)
+        elif prefix == 'views.item' and event == 'start_map':
+            summary['view_count'] += 1
+        elif prefix == 'views.item.metadata.app':
+            summary['apps'].append(value)
+        elif prefix == 'views.item.metadata.error' and event == 'start_map':
+            summary['error_count'] += 1
+        elif prefix == ANNOTATION and event == 'start_map':
+            annotation = {}
+        elif prefix == f'{ANNOTATION}.@type':
+            annotation['type'] = short_type(value)
+            annotation_types[annotation['type']] += 1
+            summary['annotation_count'] += 1
+        elif prefix in (
+            f'{ANNOTATION}.properties.document',
+            f'{ANNOTATION}.properties.duration',
+        ):
+            annotation[prefix.rsplit('.', 1)[-1]] = value
+        elif prefix == ANNOTATION and event == 'end_map':
+            # Apps record the duration of documents in an `Annotation`
+            if annotation.get('type') == 'Annotation' and 'duration' in annotation:
+                durations[annotation.get('document')] = float(annotation['duration'])
+    summary['annotation_types'] = dict(annotation_types)
+    summary['durations'] = durations
+    summary['size'] = reader.size
+    return summary
+
+
+def summarize_mmif(db: Session, mmif_id: int) -> Optional[MMIFSummary]:
+    """Summarize a MMIF from S3, and save the summary and the MMIF's content hash.
+    Commits the session."""
+    mmif = db.get(MMIF, mmif_id)
+    if not mmif or not mmif.mmif_location:
+        return None
+    body = open_mmif(mmif.mmif_location)['Body']
+    reader = HashingReader(body)
+    try:
+        values = summarize(reader)
+    finally:
+        body.close()
+    location = link_content(db, mmif, reader.hexdigest(), reader.size)
+    if location != mmif.mmif_location:
+        log.info(f'MMIF {mmif_id} is identical to {location}')
+    db.execute(
+        insert(MMIFSummary)
+        .values(mmif_id=mmif_id, **values)
+        .on_conflict_do_update(index_elements=['mmif_id'], set_=values)
+    )
+    db.commit()
+    return db.get(MMIFSummary, mmif_id, populate_existing=True)
+
+
+def summarize_mmifs(mmif_ids: Iterable[int]) -> Dict[int, Exception]:
+    """Summarize MMIFs, logging any errors.
+
+    Returns:
+        The errors by MMIF id.
+    """
+    errors = {}
+    with Session(engine) as db:
+        for mmif_id in mmif_ids:
+            try:
+                summarize_mmif(db, mmif_id)
+            except Exception as error:
+                db.rollback()
+                log.error(f'Error summarizing MMIF {mmif_id}: {error!s}')
+                errors[mmif_id] = error
+    return errors
+
+
+def unsummarized_mmif_ids(db: Session, limit: Optional[int] = None) -> list[int]:
+    """Ids of MMIFs that do not have a summary yet"""
+    return db.exec(
+        select(MMIF.id)
+        .outerjoin(MMIFSummary, MMIFSummary.mmif_id == MMIF.id)
+        .where(MMIFSummary.mmif_id.is_(None))
+        .order_by(MMIF.id)
+        .limit(limit)
+    ).all()
+
+
+@lru_cache
+def summary_executor() -> ThreadPoolExecutor:
+    """The process-wide executor that summarizes new MMIFs.
+
+    Its threads are joined when the interpreter exits, so MMIFs registered at the end
+    of a flow are still summarized."""
+    return ThreadPoolExecutor(
+        max_workers=MMIF_SUMMARY_WORKERS, thread_name_prefix='mmif-summary'
+    )
+
+
+def submit_summaries(mmif_ids: Iterable[int]):
+    """Summarize MMIFs in the background"""
+    summary_executor().submit(summarize_mmifs, sorted(mmif_ids))
@@ -0,0 +1,244 @@
+"""Uploads
+
+Incremental parsing of GUID lists uploaded as text, CSV or NDJSON, and batched linking
+of the parsed GUIDs to Batches and Collections
+"""
+
+import codecs
+import csv
+import enum
+import json
+from typing import AsyncIterator, Iterator, List, Type
+
+from fastapi import HTTPException, status
+from sqlalchemy import String, bindparam, exists, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+
+from chowda.config import GUID_CHUNK_SIZE
+from chowda.models import MediaFile
+from chowda.utils import missing_media_file_guids
+
+
+class GuidFormat(enum.Enum):
+    TEXT = 'text'
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+
+
+CONTENT_TYPES = {
+    'text/csv': GuidFormat.CSV,
+    'application/csv': GuidFormat.CSV,
+    'application/x-ndjson': GuidFormat.NDJSON,
+    'application/ndjson': GuidFormat.NDJSON,
+    'application/jsonl': GuidFormat.NDJSON,
+    'application/json-lines': GuidFormat.NDJSON,
+}
+
+# Maximum number of missing GUIDs to return in an upload response
+MAX_MISSING_GUIDS = 1000
+
+EXTENSIONS = {
+    'csv': GuidFormat.CSV,
+    'ndjson': GuidFormat.NDJSON,
+    'jsonl': GuidFormat.NDJSON,
+}
+
+
+def guid_format(content_type: str | None, filename: str | None = None) -> GuidFormat:
+    """Guess the format of a GUID list from its content type or file name.
+    Defaults to whitespace separated text."""
+    if content_type:
+        media_type = content_type.split(';')[0].strip().lower()
+        if media_type in CONTENT_TYPES:
+            return CONTENT_TYPES[media_type]
+    if filename and '.' in filename:
+        return EXTENSIONS.get(filename.rsplit('.', 1)[-1].lower(), GuidFormat.TEXT)
+    return GuidFormat.TEXT
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Yield decoded lines from a stream of byte chunks, without reading it all."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    remainder = ''
+    async for chunk in chunks:
+        lines = (remainder + decoder.decode(chunk)).split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    remainder += decoder.decode(b'', final=True)
+    if remainder:
+        yield remainder
+
+
+class CsvGuids:
+    """Extract GUIDs from CSV rows: the `guid` column if there is a header row with
+    one, otherwise the first column."""
+
+    def __init__(self):
+        self.column = None
+
+    def __call__(self, line: str) -> Iterator[str]:
+        for row in csv.reader([line]):
+            if not row:
+                continue
+            if self.column is None:
+                header = [cell.strip().lower() for cell in row]
+                self.column = header.index('guid') if 'guid' in header else 0
+                if 'guid' in header:
+                    continue
+            if len(row) > self.column and row[self.column].strip():
+                yield row[self.column].strip()
+
+
+def ndjson_guids(line: str) -> Iterator[str]:
+    """Extract a GUID from an NDJSON line: a JSON string, or an object with a `guid`"""
+    if not line.strip():
+        return
+    value = json.loads(line)
+    if isinstance(value, dict):
+        value = value.get('guid')
+    if value:
+        yield str(value).strip()
+
+
+def text_guids(line: str) -> Iterator[str]:
+    """Extract whitespace separated GUIDs from a line of text"""
+    yield from line.split()
+
+
+async def iter_guids(
+    chunks: AsyncIterator[bytes], format: GuidFormat
+) -> AsyncIterator[str]:
+    """Yield GUIDs from a stream of byte chunks in the given format"""
+    if format == GuidFormat.CSV:
+        parse = CsvGuids()
+    elif format == GuidFormat.NDJSON:
+        parse = ndjson_guids
+    else:
+        parse = text_guids
+    async for line in iter_lines(chunks):
+        for guid in parse(line):
+            yield guid
+
+
+async def iter_guid_chunks(
+    guids: AsyncIterator[str], chunk_size: int
+) -> AsyncIterator[List[str]]:
+    """Group a stream of GUIDs into lists of `chunk_size`"""
+    chunk = []
+    async for guid in guids:
+        chunk.append(guid)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def link_media_files(
+    db: Session,
+    link_model: Type[SQLModel],
+    parent_column: str,
+    parent_id: int,
+    guids: List[str],
+) -> tuple[int, List[str]]:
+    """Link a chunk of MediaFile GUIDs to a parent Batch or Collection.
+
+    Existing GUIDs are inserted into the link table with one INSERT ... SELECT, and
+    GUIDs that are already linked are skipped.
+
+    Returns:
+        The number of new link rows, and the GUIDs that have no MediaFile.
+    """
+    missing = missing_media_file_guids(db, guids)
+    candidates = (
+        func.unnest(bindparam('guids', guids, type_=ARRAY(String)))
+        .table_valued('guid')
+        .render_derived()
+    )
+    result = db.execute(
+        insert(link_model)
+        .from_select(
+            ['media_file_id', parent_column],
+            select(candidates.c.guid, bindparam('parent_id', parent_id))
+            .where(exists().where(MediaFile.guid == candidates.c.guid))
+            .distinct(),
+        )
+        .on_conflict_do_nothing()
+    )
+    return result.rowcount, missing
+
+
+async def upload_chunks(
+    file: UploadFile, size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """Yield chunks of an uploaded file"""
+    while chunk := await file.read(size):
+        yield chunk
+
+
+async def request_guids(request: Request) -> AsyncIterator[str]:
+    """Yield GUIDs from a request, either from the `file` field of a multipart upload,
+    or from the raw request body."""
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        file = form.get('file')
+        if not isinstance(file, UploadFile):
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                'Multipart uploads must include a `file` field',
+            )
+        chunks = upload_chunks(file)
+        format = guid_format(file.content_type, file.filename)
+    else:
+        chunks = request.stream()
+        format = guid_format(content_type)
+    async for guid in iter_guids(chunks, format):
+        yield guid
+
+
+async def upload_media_files(
+    request: Request,
+    db: AsyncSession,
+    link_model: Type[SQLModel],
+    parent_column: str,
+    parent_id: int,
+    strict: bool = True,
+) -> tuple[int, List[str], int]:
+    """Stream GUIDs from a request and link them to a Batch or Collection in chunks.
+
+    All chunks are linked in a single transaction. If `strict`, any missing GUIDs roll
+    back the whole upload with a 422 response.
+
+    Returns:
+        The number of MediaFiles linked, the first missing GUIDs, and the number of
+        missing GUIDs.
+    """
+    added, missing, missing_count = 0, [], 0
+    try:
+        async for chunk in iter_guid_chunks(request_guids(request), GUID_CHUNK_SIZE):
+            chunk_added, chunk_missing = await db.run_sync(
+                link_media_files, link_model, parent_column, parent_id, chunk
+            )
+            added += chunk_added
+            missing_count += len(chunk_missing)
+            missing += chunk_missing[: MAX_MISSING_GUIDS - len(missing)]
+    except (ValueError, csv.Error) as error:
+        await db.rollback()
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, f'Could not parse GUIDs: {error!s}'
+        ) from error
+
+    if missing_count and strict:
+        await db.rollback()
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            {'missing': missing, 'missing_count': missing_count},
+        )
+    await db.commit()
+    return added, missing, missing_count
@@ -1,15 +1,15 @@
-from tempfile import TemporaryDirectory
-from typing import Any, Dict, List, Set
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
 
 from psycopg2.extensions import QuotedString
 from pydantic import BaseModel
 from sqlalchemy.dialects.postgresql import insert
 from starlette.requests import Request
-from starlette.responses import FileResponse, StreamingResponse
+from starlette.responses import StreamingResponse
 
-# This should belong inside `download_mmif` function, but the download fails
-# unless the temporary directory is created outside of the function.
-tmp_dir = TemporaryDirectory()
+if TYPE_CHECKING:
+    from sqlmodel import Session
+
+    from chowda.models import MMIF, MediaFile
 
 
 def adapt_url(url):
@@ -53,13 +53,81 @@ def chunks_sequential(lst, n):
         yield lst[si : si + (d + 1 if i < r else d)]
 
 
-# def validate_media_files(view: ModelView, request: Request, data: Dict[str, Any]):
+def missing_media_file_guids(
+    db: 'Session', guids: List[str], chunk_size: int = 10000
+) -> List[str]:
+    """Return the GUIDs that do not have a corresponding MediaFile.
+
+    GUIDs are sent to the database as `unnest`ed arrays of `chunk_size`, and only the
+    missing ones come back, through an anti-join against `media_files`."""
+    from sqlalchemy import String, bindparam, exists, func, select
+    from sqlalchemy.dialects.postgresql import ARRAY
+
+    from chowda.models import MediaFile
+
+    missing = []
+    for chunk in chunks_of_size(guids, chunk_size):
+        candidates = (
+            func.unnest(bindparam('guids', chunk, type_=ARRAY(String)))
+            .table_valued('guid')
+            .render_derived()
+        )
+        missing += db.scalars(
+            select(candidates.c.guid).where(
+                ~exists().where(MediaFile.guid == candidates.c.guid)
+            )
+        ).all()
+    return missing
+
+
+def latest_mmifs(
+    db: 'Session', guids: List[str], chunk_size: int = 10000
+) -> Dict[str, 'MMIF']:
+    """Return the newest MMIF of each MediaFile GUID that has one, by GUID.
+
+    MMIFs are looked up in the trigger-maintained `latest_mmifs` table, with one
+    query per chunk of `chunk_size` GUIDs."""
+    from sqlalchemy import select
+
+    from chowda.models import MMIF, LatestMMIF
+
+    mmifs = {}
+    for chunk in chunks_of_size(guids, chunk_size):
+        mmifs.update(
+            (mmif.media_file_id, mmif)
+            for mmif in db.scalars(
+                select(MMIF)
+                .join(LatestMMIF, LatestMMIF.mmif_id == MMIF.id)
+                .where(LatestMMIF.media_file_id.in_(chunk))
+            )
+        )
+    return mmifs
+
+
+def media_file_reference(db: 'Session', guid: str) -> 'MediaFile':
+    """Return a MediaFile for an existing GUID, attached to `db` without loading it.
+
+    Relating the reference to a Batch or Collection only inserts the link row.
+    The GUID must already exist, e.g. checked with `missing_media_file_guids`."""
+    from sqlalchemy.orm import make_transient_to_detached
+    from sqlalchemy.orm.util import identity_key
+
+    from chowda.models import MediaFile
+
+    media_file = db.identity_map.get(identity_key(MediaFile, guid))
+    if media_file is None:
+        media_file = MediaFile(guid=guid)
+        make_transient_to_detached(media_file)
+        db.add(media_file)
+    return media_file
+
+
 def validate_media_file_guids(request: Request, data: Dict[str, Any]):
     """
-    1) Validates MediaFile GUIDs by fetching the MediaFile objects from the database,
-    2) Replaces the GUID strings with the found objects in the `data` dict
-    3) Adds the found objects to request.state.session which is the db session used by
-       Starlette-admin when saving.
+    1) Validates MediaFile GUIDs with a single anti-join query per chunk of GUIDs,
+    2) Replaces the GUID strings with MediaFile references in the `data` dict
+    3) Attaches the references to request.state.session which is the db session used
+       by Starlette-admin when saving.
 
     NOTE: Starlette-admin does not provide a clean way to trigger validation errors when
     related objects cannot be found because it does not provide an out-of-box feature
@@ -67,43 +135,25 @@ def validate_media_file_guids(request: Request, data: Dict[str, Any]):
     objects. But that's exactly what we need to do here: enter GUIDs as strings to
     relate to Batch and  Collection objects.
     """
-    from sqlmodel import Session, select
     from starlette_admin.exceptions import FormValidationError
 
-    from chowda.db import engine
-    from chowda.models import MediaFile
-
-    media_files = []
+    db = request.state.session
 
     # Clear the session to avoid conflicts with session instances used by the API
-    request.state.session.expire_all()
-
-    with Session(engine) as db:
-        # Get all MediaFiles objects for the GUIDs in data['media_files']
-        media_files = db.exec(
-            select(MediaFile).where(MediaFile.guid.in_(data['media_files']))
-        ).all()
-
-        # Any value in data['media_files'] that does not have a corresponding MediaFile
-        # object is invalid, so add it to the errors
-        valid_guids = [media_file.guid for media_file in media_files]
-        invalid_guids = [
-            guid for guid in data['media_files'] if guid not in valid_guids
-        ]
+    db.expire_all()
 
-        if len(invalid_guids):
-            raise FormValidationError({'media_files': invalid_guids})
+    # Drop duplicate GUIDs, preserving order
+    guids = list(dict.fromkeys(data['media_files']))
 
-    # Replace GUID strings with MediaFile objects in `data` dict so they will get added
-    # the parent object.
-    data['media_files'] = media_files
+    # Any GUID that does not have a corresponding MediaFile is invalid
+    invalid_guids = missing_media_file_guids(db, guids)
+    if len(invalid_guids):
+        raise FormValidationError({'media_files': invalid_guids})
 
-    # Add MediaFile objects to the DB session Starlette admin uses for persistence.
-    # This is a bit of a hack to play nice with starlette-admin, but without it, an
-    # error is thrown if starlette-admin tries to add a validated MediaFile object
-    # to a parent object when that MediaFile is already there.
-    for media_file in data['media_files']:
-        request.state.session.add(media_file)
+    # Replace GUID strings with MediaFile references in `data` dict so they will get
+    # added to the parent object. References are attached to the DB session Starlette
+    # admin uses for persistence, without loading every MediaFile from the database.
+    data['media_files'] = [media_file_reference(db, guid) for guid in guids]
 
 
 def get_duplicates(values: List[Any]) -> Set[Any]:
@@ -156,64 +206,64 @@ def yes() -> str:
     return choice(YES)
 
 
-def download_mmif(pks: list[str]) -> StreamingResponse | FileResponse:
-    """Download MMIF files from S3 and return a zip archive of them."""
-    import zipfile
+def download_mmif(
+    pks: list[str], format: str = 'zip', batch_ids: Optional[list[int]] = None
+) -> StreamingResponse:
+    """Stream MMIF files from S3, as a zip archive if there is more than one.
 
-    import boto3
-    from sqlmodel import Session, select
+    MMIFs are selected by id, or as the output MMIFs of `batch_ids`.
 
-    from chowda.config import MMIF_S3_BUCKET_NAME
+    MMIFs are read from S3 and sent in chunks as they arrive, so memory use does not
+    grow with the size of the download. MMIFs with identical contents are sent once.
+
+    If `format` is `json`, `csv` or `aria2`, a manifest of presigned S3 URLs is sent
+    instead, for clients to download the MMIFs directly from S3."""
+    if format != 'zip':
+        from chowda.manifests import ManifestFormat, mmif_manifest
+
+        return mmif_manifest(pks, ManifestFormat(format), batch_ids=batch_ids)
+
+    from datetime import datetime
+    from itertools import chain
+
+    from sqlmodel import Session
+
+    from chowda.contents import distinct_mmif_locations
     from chowda.db import engine
-    from chowda.models import MMIF
+    from chowda.exceptions import DownloadException
+    from chowda.s3 import MMIF_CHUNK_SIZE, iter_mmif_objects, mmif_zip_entries
+    from chowda.zipstream import zip_stream
 
-    s3 = boto3.client('s3')
-    downloaded_mmif_files = []
-    download_errors = {}
     with Session(engine) as db:
-        mmifs = db.exec(select(MMIF).where(MMIF.id.in_(pks)))
-
-        for mmif in mmifs:
-            mmif_tmp_location = f'{tmp_dir.name}/{mmif.mmif_location.split("/")[-1]}'
-            try:
-                s3.download_file(
-                    MMIF_S3_BUCKET_NAME, mmif.mmif_location, mmif_tmp_location
-                )
-                downloaded_mmif_files.append(mmif_tmp_location)
-            except Exception as ex:
-                # TODO: log errors and notify user of them
-                download_errors[mmif.mmif_location] = ex
-    if download_errors:
-        from chowda.exceptions import DownloadException
-
-        raise DownloadException(download_errors)
-    if len(pks) == 1:
-        # If only one batch was downloaded, return the file directly
-        return FileResponse(
-            downloaded_mmif_files[0],
+        mmif_locations = distinct_mmif_locations(db, pks, batch_ids)
+
+    objects = iter_mmif_objects(mmif_locations)
+    # Open the first MMIF before responding, so errors can still be reported
+    first = next(objects, None)
+    if first and isinstance(first[1], Exception):
+        raise DownloadException({first[0]: first[1]})
+
+    if len(mmif_locations) == 1 and first:
+        # If there is only one MMIF to send, stream the file directly
+        mmif_location, mmif = first
+        return StreamingResponse(
+            mmif['Body'].iter_chunks(MMIF_CHUNK_SIZE),
+            headers={
+                'Content-Disposition': (
+                    f'attachment; filename="{mmif_location.split("/")[-1]}"'
+                ),
+                'Content-Length': str(mmif['ContentLength']),
+            },
             media_type='application/octet-stream',
-            filename=downloaded_mmif_files[0].split('/')[-1],
         )
 
-    # Create zip archive
-    import io
-    from datetime import datetime
-
     current_datetime = datetime.now().strftime('%Y-%m-%d_%H%M%S')
     # TODO: include batch count, or names in the download file name?
     zip_filename = f'chowda_mmif_download.{current_datetime}.zip'
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w') as zip:
-        for downloaded_mmif_file in downloaded_mmif_files:
-            filename = downloaded_mmif_file.split('/')[-1]
-            zip.write(downloaded_mmif_file, arcname=filename)
-
-    # Reset buffer to beginning of stream
-    zip_buffer.seek(0)
 
     # Send download response
     return StreamingResponse(
-        zip_buffer,
+        zip_stream(mmif_zip_entries(chain([first], objects) if first else [])),
         headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'},
         media_type='application/zip',
     )
@@ -3,7 +3,9 @@ from typing import Any, ClassVar, Dict, List, Set
 
 from metaflow.integrations import ArgoEvent
 from multipart.exceptions import MultipartParseError
+from sqlalchemy import String, cast, func, or_
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 from starlette.datastructures import FormData
 from starlette.requests import Request
 from starlette.responses import Response
@@ -16,7 +18,9 @@ from starlette_admin.fields import BaseField, HasMany, HasOne
 
 from chowda.auth.utils import get_oauth_user
 from chowda.db import engine
+from chowda.exports import submit_export
 from chowda.fields import (
+    BatchExportJobField,
     BatchMetaflowRunDisplayField,
     BatchPercentCompleted,
     BatchPercentSuccessful,
@@ -31,12 +35,46 @@ from chowda.fields import (
     SonyCiAssetThumbnail,
     SuccessfulField,
 )
-from chowda.models import MMIF, Batch, Collection, MediaFile
+from chowda.models import (
+    MMIF,
+    Batch,
+    Collection,
+    MediaFile,
+    MediaFileBatchLink,
+    MMIFSummary,
+)
 from chowda.routers.sony_ci import sync_history
-from chowda.utils import download_mmif, get_duplicates, validate_media_file_guids, yes
+from chowda.sets import (
+    BatchSet,
+    CollectionSet,
+    RunStatus,
+    SetOperation,
+    create_batch_from_set,
+)
+from chowda.summaries import summarize_mmifs
+from chowda.utils import (
+    download_mmif,
+    get_duplicates,
+    latest_mmifs,
+    validate_media_file_guids,
+    yes,
+)
 from templates import filters  # noqa: F401
 
 
+DOWNLOAD_MMIF_FORM = """
+<form>
+    <label for="format">Download as</label>
+    <select class="form-select" id="format" name="format">
+        <option value="zip" selected>MMIF files</option>
+        <option value="json">JSON manifest of S3 links</option>
+        <option value="csv">CSV manifest of S3 links</option>
+        <option value="aria2">aria2 input file of S3 links</option>
+    </select>
+</form>
+"""
+
+
 class ChowdaModelView(ModelView):
     """Base settings for all views"""
 
@@ -110,9 +148,16 @@ class AdminModelView(ClammerModelView):
 class CollectionView(ClammerModelView):
     exclude_fields_from_list: ClassVar[list[Any]] = [Collection.media_files]
     exclude_fields_from_detail: ClassVar[list[Any]] = [Collection.id]
-    exclude_actions_from_detail: ClassVar[list[Any]] = ['create_multiple_batches']
+    exclude_actions_from_detail: ClassVar[list[Any]] = [
+        'create_multiple_batches',
+        'intersect_collections',
+    ]
 
-    actions: ClassVar[list[Any]] = ['create_batch', 'create_multiple_batches']
+    actions: ClassVar[list[Any]] = [
+        'create_batch',
+        'create_multiple_batches',
+        'intersect_collections',
+    ]
     row_actions: ClassVar[list[Any]] = ['view', 'edit', 'create_batch']
     fields: ClassVar[list[Any]] = [
         'name',
@@ -153,13 +198,15 @@ class CollectionView(ClammerModelView):
                 ).all()
                 names = [collection.name for collection in collections]
                 ids = [str(collection.id) for collection in collections]
-                new_batch = Batch(
+                create_batch_from_set(
+                    db,
                     name=f'Batch from {", ".join(names)}',
                     description=f'Batch from {", ".join(ids)}',
+                    expression=SetOperation(
+                        op='union',
+                        operands=[CollectionSet(collection=pk) for pk in pks],
+                    ),
                 )
-                for collection in collections:
-                    new_batch.media_files += collection.media_files
-                db.add(new_batch)
                 db.commit()
 
         except Exception as error:
@@ -198,6 +245,35 @@ class CollectionView(ClammerModelView):
         # Display Success message
         return f'Created Batches from {", ".join(names)}'
 
+    @action(
+        name='intersect_collections',
+        text='Intersect',
+        confirmation='Create a Batch of the Media Files common to these Collections?',
+        icon_class='fa-solid fa-object-group',
+        submit_btn_text=yes(),
+    )
+    async def intersect_collections(self, request: Request, pks: List[Any]) -> str:
+        """Create a new batch from the intersection of the collections"""
+        try:
+            with Session(engine) as db:
+                _, size = create_batch_from_set(
+                    db,
+                    name=f'Intersection of {len(pks)} Collections',
+                    description='Intersection of Collections '
+                    f'{", ".join(map(str, pks))}',
+                    expression=SetOperation(
+                        op='intersection',
+                        operands=[CollectionSet(collection=pk) for pk in pks],
+                    ),
+                )
+                db.commit()
+
+        except Exception as error:
+            raise ActionFailed(f'{error!s}') from error
+
+        # Display Success message
+        return f'Created Batch of {size} Media Files'
+
 
 class BatchView(ClammerModelView):
     label: ClassVar[str] = 'Batches'
@@ -205,7 +281,10 @@ class BatchView(ClammerModelView):
     exclude_fields_from_edit: ClassVar[list[Any]] = [Batch.id]
     exclude_fields_from_list: ClassVar[list[Any]] = [Batch.media_files]
     exclude_fields_from_detail: ClassVar[list[Any]] = [Batch.id]
-    exclude_actions_from_detail: ClassVar[list[Any]] = ['combine_batches']
+    exclude_actions_from_detail: ClassVar[list[Any]] = [
+        'combine_batches',
+        'intersect_batches',
+    ]
 
     fields_default_sort: ClassVar[BaseField] = [(Batch.id, True)]
 
@@ -213,7 +292,10 @@ class BatchView(ClammerModelView):
         'start_batches',
         'duplicate_batches',
         'combine_batches',
+        'intersect_batches',
+        'subtract_batches',
         'download_mmif',
+        'export_mmif',
     ]
     row_actions: ClassVar[list[Any]] = [
         'view',
@@ -221,6 +303,7 @@ class BatchView(ClammerModelView):
         'duplicate_batch',
         'start_batch',
         'download_mmif',
+        'export_mmif',
     ]
 
     fields: ClassVar[list[Any]] = [
@@ -237,6 +320,7 @@ class BatchView(ClammerModelView):
         MediaFilesGuidsField('media_files', exclude_from_detail=True),
         BatchMetaflowRunDisplayField(),
         'output_mmifs',
+        BatchExportJobField(),
     ]
 
     async def validate(self, request: Request, data: Dict[str, Any]):
@@ -248,9 +332,9 @@ class BatchView(ClammerModelView):
             return user.is_clammer
         if name == 'duplicate_batches':
             return user.is_clammer or user.is_admin
-        if name == 'combine_batches':
+        if name in ('combine_batches', 'intersect_batches', 'subtract_batches'):
             return user.is_clammer or user.is_admin
-        if name == 'download_mmif':
+        if name in ('download_mmif', 'export_mmif'):
             return user.is_clammer or user.is_admin
         return await super().is_action_allowed(request, name)
 
@@ -309,22 +393,26 @@ class BatchView(ClammerModelView):
                         for mmif in batch.input_mmifs
                     }
                     mmif_guids = set(mmifs.keys())
-                    for media_file in batch.media_files:
+                    guids = db.exec(
+                        select(MediaFileBatchLink.media_file_id).where(
+                            MediaFileBatchLink.batch_id == batch_id
+                        )
+                    ).all()
+                    latest = {} if new_mmif else latest_mmifs(db, guids)
+                    for guid in guids:
                         payload = {
                             'batch_id': batch_id,
-                            'guid': media_file.guid,
+                            'guid': guid,
                             'pipeline': pipeline,
                         }
                         if new_mmif:
                             payload['mmif_location'] = ''
-                        elif media_file.guid in mmif_guids:
+                        elif guid in mmif_guids:
                             # Prefer the Batch's MMIF if specified
-                            payload['mmif_location'] = mmifs[media_file.guid]
-                        elif media_file.mmifs:
-                            # If there is an MMIF in the MediaFile's MMIFs
-                            payload['mmif_location'] = media_file.mmifs[
-                                -1
-                            ].mmif_location
+                            payload['mmif_location'] = mmifs[guid]
+                        elif guid in latest:
+                            # Otherwise, the MediaFile's latest MMIF
+                            payload['mmif_location'] = latest[guid].mmif_location
                         ArgoEvent('pipeline', payload=payload).publish(
                             ignore_errors=False
                         )
@@ -389,24 +477,115 @@ class BatchView(ClammerModelView):
         """Merge multiple batches into a new batch"""
         try:
             with Session(engine) as db:
-                batches = db.exec(select(Batch).where(Batch.id.in_(pks))).all()
                 # TODO: What are the best defaults for a newly combined Batch?
-                new_batch = Batch(
-                    name=f'Combination of {len(batches)} Batches',
-                    description=f'Combination of {len(batches)} Batches',
+                create_batch_from_set(
+                    db,
+                    name=f'Combination of {len(pks)} Batches',
+                    description=f'Combination of {len(pks)} Batches',
+                    expression=SetOperation(
+                        op='union', operands=[BatchSet(batch=pk) for pk in pks]
+                    ),
                 )
+                db.commit()
+
+        except Exception as error:
+            raise ActionFailed(f'{error!s}') from error
 
-                for batch in batches:
-                    new_batch.media_files += batch.media_files
+        # Display Success message
+        return f'Combined {len(pks)} Batch(es)'
 
-                db.add(new_batch)
+    @action(
+        name='intersect_batches',
+        text='Intersect',
+        confirmation='Create a new Batch of the Media Files common to these Batches?',
+        icon_class='fa-solid fa-object-group',
+        submit_btn_text=yes(),
+        submit_btn_class='btn-outline-primary',
+    )
+    async def intersect_batches(self, request: Request, pks: List[Any]) -> str:
+        """Create a new batch from the intersection of the selected batches"""
+        try:
+            with Session(engine) as db:
+                _, size = create_batch_from_set(
+                    db,
+                    name=f'Intersection of {len(pks)} Batches',
+                    description=f'Intersection of Batches {", ".join(map(str, pks))}',
+                    expression=SetOperation(
+                        op='intersection',
+                        operands=[BatchSet(batch=pk) for pk in pks],
+                    ),
+                )
                 db.commit()
 
         except Exception as error:
             raise ActionFailed(f'{error!s}') from error
 
         # Display Success message
-        return f'Combined {len(pks)} Batch(es)'
+        return f'Created Batch of {size} Media Files'
+
+    @action(
+        name='subtract_batches',
+        text='Subtract',
+        confirmation='Create a new Batch of these Batches minus other Batches?',
+        icon_class='fa-solid fa-object-ungroup',
+        submit_btn_text=yes(),
+        submit_btn_class='btn-outline-primary',
+        form="""
+        <form>
+            <div class="mt-3">
+                <input type="text" class="form-control" name="subtract_batch_ids"
+                    placeholder="Batch IDs to subtract, e.g. 1, 2, 3">
+                <select class="form-select mt-2" name="status">
+                    <option value="">Any Media File in those Batches</option>
+                    <option value="started">Only started</option>
+                    <option value="finished">Only finished</option>
+                    <option value="successful">Only successful</option>
+                    <option value="failed">Only failed</option>
+                </select>
+            </div>
+        </form>
+        """,
+    )
+    async def subtract_batches(self, request: Request, pks: List[Any]) -> str:
+        """Create a new batch of the selected batches, minus the Media Files of other
+        batches, optionally only those with a given run status"""
+        try:
+            data: FormData = await request.form()
+            subtract_ids = data.get('subtract_batch_ids', '').replace(',', ' ').split()
+            if not subtract_ids:
+                raise ActionFailed('No Batch IDs to subtract')
+            status = RunStatus(data['status']) if data.get('status') else None
+            ids = ', '.join(map(str, pks))
+            with Session(engine) as db:
+                _, size = create_batch_from_set(
+                    db,
+                    name=f'Batches {ids} minus Batches {", ".join(subtract_ids)}',
+                    description=(
+                        f'Batches {ids} minus '
+                        f'{status.value + " " if status else ""}Media Files in '
+                        f'Batches {", ".join(subtract_ids)}'
+                    ),
+                    expression=SetOperation(
+                        op='difference',
+                        operands=[
+                            SetOperation(
+                                op='union',
+                                operands=[BatchSet(batch=pk) for pk in pks],
+                            ),
+                            *[
+                                BatchSet(batch=int(batch_id), status=status)
+                                for batch_id in subtract_ids
+                            ],
+                        ],
+                    ),
+                )
+                db.commit()
+
+        except Exception as error:
+            raise ActionFailed(f'{error!s}') from error
+
+        # Display Success message
+        return f'Created Batch of {size} Media Files'
 
     @row_action(
         name='download_mmif',
@@ -415,6 +594,7 @@ class BatchView(ClammerModelView):
         icon_class='fa fa-download',
         submit_btn_text=yes() + ' Gimme the MMIF!',
         submit_btn_class='btn-outline-primary',
+        form=DOWNLOAD_MMIF_FORM,
         custom_response=True,
         action_btn_class='btn-ghost',
     )
@@ -425,6 +605,7 @@ class BatchView(ClammerModelView):
         icon_class='fa fa-download',
         submit_btn_text=yes() + ' Gimme ALL the MMIF!',
         submit_btn_class='btn-outline-primary',
+        form=DOWNLOAD_MMIF_FORM,
         custom_response=True,
     )
     async def download_mmif(
@@ -432,13 +613,11 @@ class BatchView(ClammerModelView):
     ) -> str:
         if not isinstance(pks, list):
             pks = [pks]
-
-        with Session(engine) as db:
-            # Get all of the MMIF S3 locations from the database.
-            batches = db.exec(select(Batch).where(Batch.id.in_(pks))).all()
-            all_mmif_pks = [mmif.id for batch in batches for mmif in batch.output_mmifs]
+        data: FormData = await request.form()
         try:
-            return download_mmif(all_mmif_pks)
+            return download_mmif(
+                [], data.get('format', 'zip'), batch_ids=[int(pk) for pk in pks]
+            )
         except Exception as error:
             # TODO: pop 'error' out of session and display with javascript
             # dangrerAlert() when admin/batch/list renders.
@@ -452,6 +631,43 @@ class BatchView(ClammerModelView):
                 status_code=status.HTTP_303_SEE_OTHER,
             )
 
+    @row_action(
+        name='export_mmif',
+        text='Export MMIF',
+        confirmation='Build a zip archive of all MMIF for this Batch in the '
+        'background?',
+        icon_class='fa fa-file-zipper',
+        submit_btn_text=yes(),
+        submit_btn_class='btn-outline-primary',
+        action_btn_class='btn-ghost',
+    )
+    @action(
+        name='export_mmif',
+        text='Export MMIF',
+        confirmation='Build one zip archive of all MMIF for these Batches in the '
+        'background?',
+        icon_class='fa fa-file-zipper',
+        submit_btn_text=yes(),
+        submit_btn_class='btn-outline-primary',
+    )
+    async def export_mmif(
+        self, request: Request, pks: list[int | str] | int | str
+    ) -> str:
+        """Start a background export of the output MMIFs of Batches. Progress is shown
+        on the Batch page, and exports of the same MMIFs are reused."""
+        if not isinstance(pks, list):
+            pks = [pks]
+        with Session(engine) as db:
+            mmif_ids = db.exec(
+                select(MMIF.id).where(MMIF.batch_output_id.in_(pks))
+            ).all()
+            if not mmif_ids:
+                raise ActionFailed('No MMIF to export')
+            job = submit_export(
+                db, mmif_ids, batch_id=int(pks[0]) if len(pks) == 1 else None
+            )
+            return f'Export {job.id} of {job.mmif_count} MMIF is {job.status.value}'
+
 
 class MediaFileView(ClammerModelView):
     pk_attr: str = 'guid'
@@ -612,12 +828,15 @@ class MMIFView(ChowdaModelView):
         HasOne('batch_output', identity='batch', label='Generated from Batch'),
         'metaflow_run',
         'mmif_location',
+        'content_hash',
+        HasOne('summary', identity='mmif-summary', label='Summary'),
         'created_at',
     ]
     actions: ClassVar[List[str]] = [
         'add_to_new_batch',
         'add_to_existing_batch',
         'download_mmif',
+        'summarize_mmifs',
     ]
 
     @row_action(
@@ -768,6 +987,7 @@ class MMIFView(ChowdaModelView):
         icon_class='fa fa-download',
         submit_btn_text=yes(),
         submit_btn_class='btn-outline-primary',
+        form=DOWNLOAD_MMIF_FORM,
         custom_response=True,
     )
     @row_action(
@@ -777,6 +997,7 @@ class MMIFView(ChowdaModelView):
         icon_class='fa fa-download',
         submit_btn_text=yes(),
         submit_btn_class='btn-outline-primary',
+        form=DOWNLOAD_MMIF_FORM,
         custom_response=True,
     )
     async def download_mmif(
@@ -784,4 +1005,63 @@ class MMIFView(ChowdaModelView):
     ) -> str:
         if not isinstance(pks, list):
             pks = [pks]
-        return download_mmif(pks)
+        data: FormData = await request.form()
+        return download_mmif(pks, data.get('format', 'zip'))
+
+    @action(
+        name='summarize_mmifs',
+        text='Summarize',
+        confirmation='Read these MMIFs from S3 and update their summaries?',
+        icon_class='fa fa-list-check',
+        submit_btn_text=yes(),
+        submit_btn_class='btn-outline-primary',
+    )
+    async def summarize_mmifs(
+        self, request: Request, pks: list[int | str] | int | str
+    ) -> str:
+        """Summarize MMIFs registered before summaries, or summarize them again"""
+        if not isinstance(pks, list):
+            pks = [pks]
+        errors = await run_in_threadpool(summarize_mmifs, [int(pk) for pk in pks])
+        if errors:
+            raise ActionFailed(f'Could not summarize MMIFs: {sorted(errors)}')
+        return f'Summarized {len(pks)} MMIFs'
+
+
+class MMIFSummaryView(ChowdaModelView):
+    """MMIF contents, searchable by app and annotation type"""
+
+    label: ClassVar[str] = 'MMIF Summaries'
+    pk_attr: str = 'mmif_id'
+    fields: ClassVar[List[Any]] = [
+        HasOne('mmif', identity='mmif', label='MMIF'),
+        'mmif_version',
+        'apps',
+        'view_count',
+        'error_count',
+        'document_count',
+        'annotation_count',
+        'annotation_types',
+        'durations',
+        'size',
+        'created_at',
+    ]
+    fields_default_sort: ClassVar[BaseField] = [(MMIFSummary.mmif_id, True)]
+    row_actions: ClassVar[List[str]] = ['view']
+
+    def can_create(self, request: Request) -> bool:
+        """Summaries are extracted from MMIFs, not created from the UI."""
+        return False
+
+    def can_edit(self, request: Request) -> bool:
+        return False
+
+    def can_delete(self, request: Request) -> bool:
+        return False
+
+    def get_search_query(self, request: Request, term: str) -> Any:
+        """Search app names and annotation types"""
+        return or_(
+            func.array_to_string(MMIFSummary.apps, ' ').ilike(f'%{term}%'),
+            cast(MMIFSummary.annotation_types, String).ilike(f'%{term}%'),
+        )
@@ -0,0 +1,71 @@
+"""Zip Stream
+
+Generate zip archives as a stream of chunks, without holding the archive in memory
+"""
+
+import io
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator, Tuple
+
+
+class ZipSink(io.RawIOBase):
+    """An unseekable file object that collects what zipfile writes to it, so it can be
+    sent as soon as it is written.
+
+    zipfile detects that the sink is unseekable, and writes data descriptors after each
+    entry instead of seeking back to fill in sizes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def unique_name(name: str, names: set) -> str:
+    """Return `name`, or `name` with a numbered suffix if it is already in `names`"""
+    stem, dot, extension = name.rpartition('.')
+    if not dot:
+        stem, extension = name, ''
+    unique, n = name, 1
+    while unique in names:
+        unique = f'{stem}-{n}{dot}{extension}'
+        n += 1
+    names.add(unique)
+    return unique
+
+
+def zip_stream(
+    entries: Iterable[Tuple[str, Iterable[bytes]]],
+    compression: int = zipfile.ZIP_DEFLATED,
+) -> Iterator[bytes]:
+    """Yield a zip archive of `entries` in chunks, as the entries are read.
+
+    Entries are (name, chunks) pairs. Each entry is written with zip64 extensions,
+    since its size is not known in advance, so archives can exceed 4GB.
+    """
+    sink = ZipSink()
+    names = set()
+    now = datetime.now().timetuple()[:6]
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for name, chunks in entries:
+            info = zipfile.ZipInfo(unique_name(name, names), date_time=now)
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if data := sink.drain():
+                        yield data
+            if data := sink.drain():
+                yield data
+    yield sink.drain()
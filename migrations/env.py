@@ -1,8 +1,10 @@
+import re
 from logging.config import fileConfig
 
 from chowda import models  # noqa: F401
 from sqlmodel import SQLModel
 from chowda.config import DB_URL
+from chowda.partitions import PARTITIONED_TABLES
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
@@ -26,6 +28,15 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 target_metadata = SQLModel.metadata
 
+# Monthly and default partitions are created by the database, not the models
+TABLES = '|'.join(PARTITIONED_TABLES)
+PARTITION = re.compile(rf'^({TABLES})_(default|y\d{{4}}m\d{{2}})$')
+
+
+def include_name(name, type_, parent_names) -> bool:
+    return not (type_ == 'table' and PARTITION.match(name))
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")  # noqa: ERA001
@@ -70,7 +81,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_name=include_name,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
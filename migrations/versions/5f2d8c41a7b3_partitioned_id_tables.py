@@ -0,0 +1,148 @@
+"""partitioned id tables
+
+Revision ID: 5f2d8c41a7b3
+Revises: ed4079e5c58f
+Create Date: 2026-10-19 20:12:05.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2d8c41a7b3'
+down_revision = 'ed4079e5c58f'
+branch_labels = None
+depends_on = None
+
+
+# Keep the ids of metaflow_runs and mmifs unique with the primary keys of id tables,
+# instead of EXISTS checks that concurrent transactions can both pass, and lock
+# referenced rows FOR KEY SHARE, so they cannot be deleted before the reference commits
+REGISTERED_IDS = """
+CREATE OR REPLACE FUNCTION register_id() RETURNS trigger AS $$
+DECLARE
+    registered INT;
+BEGIN
+    -- TG_ARGV: partitioned table, id table
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        EXECUTE 'DELETE FROM ' || quote_ident(TG_ARGV[1]) || ' WHERE id = $1'
+            USING OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- Waits for concurrent inserts of the same id, like a unique index
+        EXECUTE 'INSERT INTO ' || quote_ident(TG_ARGV[1])
+            || ' (id) VALUES ($1) ON CONFLICT DO NOTHING' USING NEW.id;
+        GET DIAGNOSTICS registered = ROW_COUNT;
+        IF registered = 0 THEN
+            RAISE EXCEPTION USING ERRCODE = 'unique_violation',
+                MESSAGE = 'duplicate id in ' || TG_ARGV[0] || ': ' || NEW.id;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_reference() RETURNS trigger AS $$
+DECLARE
+    found BOOLEAN;
+BEGIN
+    -- TG_ARGV: referencing column, referenced table
+    EXECUTE 'SELECT ($1).' || quote_ident(TG_ARGV[0]) || ' IS NULL'
+        INTO found USING NEW;
+    IF NOT found THEN
+        EXECUTE 'SELECT true FROM ' || quote_ident(TG_ARGV[1])
+            || ' WHERE id = ($1).' || quote_ident(TG_ARGV[0]) || ' FOR KEY SHARE'
+            INTO found USING NEW;
+    END IF;
+    IF found IS NULL THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_TABLE_NAME || '.' || TG_ARGV[0]
+                || ' references a missing row of ' || TG_ARGV[1];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER metaflow_runs_unique_id ON metaflow_runs;
+DROP TRIGGER mmifs_unique_id ON mmifs;
+DROP FUNCTION check_unique_id();
+
+CREATE TRIGGER metaflow_runs_register_id
+AFTER INSERT OR DELETE OR UPDATE OF id ON metaflow_runs
+FOR EACH ROW EXECUTE FUNCTION register_id('metaflow_runs', 'metaflow_run_ids');
+
+CREATE TRIGGER mmifs_register_id AFTER INSERT OR DELETE OR UPDATE OF id ON mmifs
+FOR EACH ROW EXECUTE FUNCTION register_id('mmifs', 'mmif_ids');
+"""
+
+CHECKED_IDS = """
+CREATE OR REPLACE FUNCTION check_unique_id() RETURNS trigger AS $$
+DECLARE
+    duplicate BOOLEAN;
+BEGIN
+    -- TG_ARGV: partitioned table
+    EXECUTE 'SELECT EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[0])
+        || ' WHERE id = ($1).id)' INTO duplicate USING NEW;
+    IF duplicate THEN
+        RAISE EXCEPTION USING ERRCODE = 'unique_violation',
+            MESSAGE = 'duplicate id in ' || TG_ARGV[0] || ': ' || NEW.id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_reference() RETURNS trigger AS $$
+DECLARE
+    found BOOLEAN;
+BEGIN
+    -- TG_ARGV: referencing column, referenced table
+    EXECUTE 'SELECT ($1).' || quote_ident(TG_ARGV[0]) || ' IS NULL OR EXISTS ('
+        || 'SELECT FROM ' || quote_ident(TG_ARGV[1])
+        || ' WHERE id = ($1).' || quote_ident(TG_ARGV[0]) || ')'
+        INTO found USING NEW;
+    IF NOT found THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_TABLE_NAME || '.' || TG_ARGV[0]
+                || ' references a missing row of ' || TG_ARGV[1];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER metaflow_runs_register_id ON metaflow_runs;
+DROP TRIGGER mmifs_register_id ON mmifs;
+DROP FUNCTION register_id();
+
+CREATE TRIGGER metaflow_runs_unique_id BEFORE INSERT ON metaflow_runs
+FOR EACH ROW EXECUTE FUNCTION check_unique_id('metaflow_runs');
+
+CREATE TRIGGER mmifs_unique_id BEFORE INSERT ON mmifs
+FOR EACH ROW EXECUTE FUNCTION check_unique_id('mmifs');
+"""
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('metaflow_run_ids',
+    sa.Column('id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('mmif_ids',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # ### end Alembic commands ###
+    op.execute('LOCK TABLE metaflow_runs, mmifs IN SHARE ROW EXCLUSIVE MODE')
+    op.execute('INSERT INTO metaflow_run_ids (id) SELECT id FROM metaflow_runs')
+    op.execute('INSERT INTO mmif_ids (id) SELECT id FROM mmifs')
+    op.execute(REGISTERED_IDS)
+
+
+def downgrade() -> None:
+    op.execute(CHECKED_IDS)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('mmif_ids')
+    op.drop_table('metaflow_run_ids')
+    # ### end Alembic commands ###
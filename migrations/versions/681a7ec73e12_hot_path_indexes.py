@@ -0,0 +1,40 @@
+"""hot path indexes
+
+Revision ID: 681a7ec73e12
+Revises: 9f940ba2f9f3
+Create Date: 2026-10-19 18:08:58.955797
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '681a7ec73e12'
+down_revision = '9f940ba2f9f3'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_metaflow_runs_batch_id_media_file_id_created_at', 'metaflow_runs', ['batch_id', 'media_file_id', 'created_at']),
+    ('ix_mmifs_batch_output_id', 'mmifs', ['batch_output_id']),
+    ('ix_mmifs_metaflow_run_id', 'mmifs', ['metaflow_run_id']),
+    ('ix_sonyci_assets_type', 'sonyci_assets', ['type']),
+]
+
+
+def upgrade() -> None:
+    # Build the indexes without locking the tables against writes. CREATE INDEX
+    # CONCURRENTLY cannot run inside a transaction, and leaves an invalid index behind
+    # if it fails, so any invalid index is dropped before it is rebuilt.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,357 @@
+"""partitioned metaflow runs and mmifs
+
+Revision ID: b3e1f07c5a92
+Revises: 681a7ec73e12
+Create Date: 2026-10-19 19:12:40.518392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e1f07c5a92'
+down_revision = '681a7ec73e12'
+branch_labels = None
+depends_on = None
+
+# Functions that create monthly partitions, moving rows of the month out of the
+# DEFAULT partition
+MONTHLY_PARTITIONS = """
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent TEXT, month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    lower_bound TIMESTAMPTZ := date_trunc('month', month::TIMESTAMP) AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMPTZ := (
+        date_trunc('month', month::TIMESTAMP) + INTERVAL '1 month'
+    ) AT TIME ZONE 'UTC';
+    partition TEXT := parent || to_char(month, '"_y"YYYY"m"MM');
+    default_partition TEXT := parent || '_default';
+    misplaced BOOLEAN;
+BEGIN
+    IF to_regclass(partition) IS NOT NULL THEN
+        RETURN partition;
+    END IF;
+    EXECUTE 'SELECT EXISTS (SELECT FROM ' || quote_ident(default_partition)
+        || ' WHERE created_at >= $1 AND created_at < $2)'
+        INTO misplaced USING lower_bound, upper_bound;
+    IF misplaced THEN
+        -- References are checked when the moved rows are back, at commit
+        SET CONSTRAINTS ALL DEFERRED;
+        EXECUTE 'CREATE TEMPORARY TABLE misplaced_rows (LIKE '
+            || quote_ident(parent) || ')';
+        EXECUTE 'WITH moved AS (DELETE FROM ' || quote_ident(default_partition)
+            || ' WHERE created_at >= $1 AND created_at < $2 RETURNING *)'
+            || ' INSERT INTO misplaced_rows SELECT * FROM moved'
+            USING lower_bound, upper_bound;
+    END IF;
+    EXECUTE 'CREATE TABLE ' || quote_ident(partition)
+        || ' PARTITION OF ' || quote_ident(parent) || ' FOR VALUES FROM ('
+        || quote_literal(lower_bound) || ') TO (' || quote_literal(upper_bound) || ')';
+    IF misplaced THEN
+        EXECUTE 'INSERT INTO ' || quote_ident(parent)
+            || ' SELECT * FROM misplaced_rows';
+        DROP TABLE misplaced_rows;
+    END IF;
+    RETURN partition;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_monthly_partitions(parent TEXT, months_ahead INT)
+RETURNS SETOF TEXT AS $$
+    SELECT create_monthly_partition(
+        parent, (date_trunc('month', now() AT TIME ZONE 'UTC') + month)::DATE
+    )
+    FROM generate_series(0, months_ahead) n, make_interval(months => n) month;
+$$ LANGUAGE sql;
+"""
+
+# Triggers that enforce unique ids, and references to metaflow_runs and mmifs, in
+# place of the primary and foreign keys partitioned tables cannot have
+PARTITIONED_REFERENCES = """
+CREATE OR REPLACE FUNCTION check_unique_id() RETURNS trigger AS $$
+DECLARE
+    duplicate BOOLEAN;
+BEGIN
+    -- TG_ARGV: partitioned table
+    EXECUTE 'SELECT EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[0])
+        || ' WHERE id = ($1).id)' INTO duplicate USING NEW;
+    IF duplicate THEN
+        RAISE EXCEPTION USING ERRCODE = 'unique_violation',
+            MESSAGE = 'duplicate id in ' || TG_ARGV[0] || ': ' || NEW.id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_reference() RETURNS trigger AS $$
+DECLARE
+    found BOOLEAN;
+BEGIN
+    -- TG_ARGV: referencing column, referenced table
+    EXECUTE 'SELECT ($1).' || quote_ident(TG_ARGV[0]) || ' IS NULL OR EXISTS ('
+        || 'SELECT FROM ' || quote_ident(TG_ARGV[1])
+        || ' WHERE id = ($1).' || quote_ident(TG_ARGV[0]) || ')'
+        INTO found USING NEW;
+    IF NOT found THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_TABLE_NAME || '.' || TG_ARGV[0]
+                || ' references a missing row of ' || TG_ARGV[1];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION restrict_references() RETURNS trigger AS $$
+DECLARE
+    referenced BOOLEAN;
+BEGIN
+    -- TG_ARGV: referenced table, referencing table, referencing column
+    EXECUTE 'SELECT NOT EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[0])
+        || ' WHERE id = ($1).id) AND EXISTS (SELECT FROM ' || quote_ident(TG_ARGV[1])
+        || ' WHERE ' || quote_ident(TG_ARGV[2]) || ' = ($1).id)'
+        INTO referenced USING OLD;
+    IF referenced THEN
+        RAISE EXCEPTION USING ERRCODE = 'foreign_key_violation',
+            MESSAGE = TG_ARGV[0] || ' ' || OLD.id || ' is still referenced from '
+                || TG_ARGV[1] || '.' || TG_ARGV[2];
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER metaflow_runs_unique_id BEFORE INSERT ON metaflow_runs
+FOR EACH ROW EXECUTE FUNCTION check_unique_id('metaflow_runs');
+
+CREATE TRIGGER mmifs_unique_id BEFORE INSERT ON mmifs
+FOR EACH ROW EXECUTE FUNCTION check_unique_id('mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_metaflow_run_id
+AFTER INSERT OR UPDATE OF metaflow_run_id ON mmifs
+FOR EACH ROW EXECUTE FUNCTION check_reference('metaflow_run_id', 'metaflow_runs');
+
+CREATE CONSTRAINT TRIGGER metaflow_runs_mmifs_metaflow_run_id
+AFTER DELETE OR UPDATE OF id ON metaflow_runs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'metaflow_runs', 'mmifs', 'metaflow_run_id'
+);
+
+CREATE CONSTRAINT TRIGGER mediafilebatchlink_source_mmif_id
+AFTER INSERT OR UPDATE OF source_mmif_id ON mediafilebatchlink
+FOR EACH ROW EXECUTE FUNCTION check_reference('source_mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mediafilebatchlink_source_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mediafilebatchlink', 'source_mmif_id'
+);
+
+CREATE CONSTRAINT TRIGGER mmifbatchinputlink_mmif_id
+AFTER INSERT OR UPDATE OF mmif_id ON mmifbatchinputlink
+FOR EACH ROW EXECUTE FUNCTION check_reference('mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mmifbatchinputlink_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mmifbatchinputlink', 'mmif_id'
+);
+
+CREATE CONSTRAINT TRIGGER mmif_summaries_mmif_id
+AFTER INSERT OR UPDATE OF mmif_id ON mmif_summaries
+FOR EACH ROW EXECUTE FUNCTION check_reference('mmif_id', 'mmifs');
+
+CREATE CONSTRAINT TRIGGER mmifs_mmif_summaries_mmif_id
+AFTER DELETE OR UPDATE OF id ON mmifs DEFERRABLE
+FOR EACH ROW EXECUTE FUNCTION restrict_references(
+    'mmifs', 'mmif_summaries', 'mmif_id'
+);
+"""
+
+DROP_PARTITIONED_REFERENCES = """
+DROP TRIGGER IF EXISTS mmif_summaries_mmif_id ON mmif_summaries;
+DROP TRIGGER IF EXISTS mmifbatchinputlink_mmif_id ON mmifbatchinputlink;
+DROP TRIGGER IF EXISTS mediafilebatchlink_source_mmif_id ON mediafilebatchlink;
+"""
+
+DROP_PARTITIONED_REFERENCE_FUNCTIONS = """
+DROP FUNCTION IF EXISTS check_unique_id();
+DROP FUNCTION IF EXISTS check_reference();
+DROP FUNCTION IF EXISTS restrict_references();
+"""
+
+LATEST_MMIFS_TRIGGER = """
+CREATE TRIGGER mmifs_latest_mmif
+AFTER INSERT OR DELETE OR UPDATE OF media_file_id, created_at ON mmifs
+FOR EACH ROW EXECUTE FUNCTION update_latest_mmifs();
+"""
+
+# Months ahead of this one to create partitions for
+MONTHS_AHEAD = 3
+
+# Rows without a creation time are dated at the epoch, so they stay older than the
+# rest, and are stored in the DEFAULT partition
+EPOCH = "'1970-01-01 00:00:00+00'"
+
+METAFLOW_RUNS_COLUMNS = 'id, pathspec, batch_id, media_file_id, finished, finished_at, successful, current_step, current_task, last_event_at'
+MMIFS_COLUMNS = 'id, media_file_id, metaflow_run_id, batch_output_id, mmif_location, content_hash'
+
+# Foreign keys to metaflow_runs and mmifs, which are enforced by triggers once the
+# tables are partitioned
+FOREIGN_KEYS = [
+    ('latest_mmifs_mmif_id_fkey', 'latest_mmifs', 'mmifs', ['mmif_id'], 'CASCADE'),
+    ('mediafilebatchlink_source_mmif_id_fkey', 'mediafilebatchlink', 'mmifs', ['source_mmif_id'], None),
+    ('mmif_summaries_mmif_id_fkey', 'mmif_summaries', 'mmifs', ['mmif_id'], None),
+    ('mmifbatchinputlink_mmif_id_fkey', 'mmifbatchinputlink', 'mmifs', ['mmif_id'], None),
+    ('mmifs_metaflow_run_id_fkey', 'mmifs', 'metaflow_runs', ['metaflow_run_id'], None),
+]
+
+
+def copy_partitioned(table: str, columns: str) -> None:
+    """Create the partitions of every month with rows in the old table, and the
+    months ahead, and copy the rows into the new partitioned table"""
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    op.execute(
+        f"SELECT create_monthly_partition('{table}', month) FROM ("
+        f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::DATE AS month "
+        f"FROM {table}_unpartitioned WHERE created_at IS NOT NULL) months"
+    )
+    op.execute(f"SELECT create_monthly_partitions('{table}', {MONTHS_AHEAD})")
+    op.execute(
+        f"INSERT INTO {table} ({columns}, created_at) "
+        f"SELECT {columns}, COALESCE(created_at, {EPOCH}) FROM {table}_unpartitioned"
+    )
+
+
+def upgrade() -> None:
+    for name, table, referred, columns, ondelete in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+    op.execute('DROP TRIGGER mmifs_latest_mmif ON mmifs')
+
+    # Keep the old tables, and the mmifs id sequence, until the rows are copied
+    op.rename_table('metaflow_runs', 'metaflow_runs_unpartitioned')
+    op.rename_table('mmifs', 'mmifs_unpartitioned')
+    op.execute('ALTER INDEX metaflow_runs_pkey RENAME TO metaflow_runs_unpartitioned_pkey')
+    op.execute('ALTER INDEX mmifs_pkey RENAME TO mmifs_unpartitioned_pkey')
+    op.execute('ALTER SEQUENCE mmifs_id_seq OWNED BY NONE')
+    for index in ['ix_metaflow_runs_batch_id', 'ix_metaflow_runs_batch_id_media_file_id_created_at', 'ix_metaflow_runs_id', 'ix_metaflow_runs_media_file_id']:
+        op.drop_index(index, table_name='metaflow_runs_unpartitioned')
+    for index in ['ix_mmifs_batch_output_id', 'ix_mmifs_content_hash', 'ix_mmifs_id', 'ix_mmifs_media_file_id', 'ix_mmifs_metaflow_run_id']:
+        op.drop_index(index, table_name='mmifs_unpartitioned')
+
+    op.create_table('metaflow_runs',
+    sa.Column('id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('pathspec', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('batch_id', sa.Integer(), nullable=True),
+    sa.Column('media_file_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished', sa.Boolean(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('successful', sa.Boolean(), nullable=True),
+    sa.Column('current_step', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('current_task', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('last_event_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['batch_id'], ['batches.id'], ),
+    sa.ForeignKeyConstraint(['media_file_id'], ['media_files.guid'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index(op.f('ix_metaflow_runs_batch_id'), 'metaflow_runs', ['batch_id'], unique=False)
+    op.create_index('ix_metaflow_runs_batch_id_media_file_id_created_at', 'metaflow_runs', ['batch_id', 'media_file_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_metaflow_runs_id'), 'metaflow_runs', ['id'], unique=False)
+    op.create_index(op.f('ix_metaflow_runs_media_file_id'), 'metaflow_runs', ['media_file_id'], unique=False)
+    op.create_table('mmifs',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('mmifs_id_seq')"), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('media_file_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('metaflow_run_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('batch_output_id', sa.Integer(), nullable=True),
+    sa.Column('mmif_location', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.ForeignKeyConstraint(['batch_output_id'], ['batches.id'], ),
+    sa.ForeignKeyConstraint(['content_hash'], ['mmif_contents.sha256'], ),
+    sa.ForeignKeyConstraint(['media_file_id'], ['media_files.guid'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index(op.f('ix_mmifs_batch_output_id'), 'mmifs', ['batch_output_id'], unique=False)
+    op.create_index(op.f('ix_mmifs_content_hash'), 'mmifs', ['content_hash'], unique=False)
+    op.create_index(op.f('ix_mmifs_id'), 'mmifs', ['id'], unique=False)
+    op.create_index(op.f('ix_mmifs_media_file_id'), 'mmifs', ['media_file_id'], unique=False)
+    op.create_index(op.f('ix_mmifs_metaflow_run_id'), 'mmifs', ['metaflow_run_id'], unique=False)
+    op.execute('ALTER SEQUENCE mmifs_id_seq OWNED BY mmifs.id')
+
+    op.execute(MONTHLY_PARTITIONS)
+    copy_partitioned('metaflow_runs', METAFLOW_RUNS_COLUMNS)
+    copy_partitioned('mmifs', MMIFS_COLUMNS)
+    op.drop_table('mmifs_unpartitioned')
+    op.drop_table('metaflow_runs_unpartitioned')
+
+    # latest_mmifs already holds the latest of the copied MMIFs, with the same ids
+    op.execute(LATEST_MMIFS_TRIGGER)
+    op.execute(PARTITIONED_REFERENCES)
+
+
+def downgrade() -> None:
+    op.execute(DROP_PARTITIONED_REFERENCES)
+    op.rename_table('metaflow_runs', 'metaflow_runs_partitioned')
+    op.rename_table('mmifs', 'mmifs_partitioned')
+    op.execute('ALTER SEQUENCE mmifs_id_seq OWNED BY NONE')
+    for index in ['ix_metaflow_runs_batch_id', 'ix_metaflow_runs_batch_id_media_file_id_created_at', 'ix_metaflow_runs_id', 'ix_metaflow_runs_media_file_id']:
+        op.drop_index(index, table_name='metaflow_runs_partitioned')
+    for index in ['ix_mmifs_batch_output_id', 'ix_mmifs_content_hash', 'ix_mmifs_id', 'ix_mmifs_media_file_id', 'ix_mmifs_metaflow_run_id']:
+        op.drop_index(index, table_name='mmifs_partitioned')
+    op.execute('ALTER TABLE metaflow_runs_partitioned RENAME CONSTRAINT metaflow_runs_pkey TO metaflow_runs_partitioned_pkey')
+    op.execute('ALTER TABLE mmifs_partitioned RENAME CONSTRAINT mmifs_pkey TO mmifs_partitioned_pkey')
+
+    op.create_table('metaflow_runs',
+    sa.Column('id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('pathspec', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('batch_id', sa.Integer(), nullable=True),
+    sa.Column('media_file_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('finished', sa.Boolean(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('successful', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('current_step', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('current_task', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('last_event_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['batch_id'], ['batches.id'], ),
+    sa.ForeignKeyConstraint(['media_file_id'], ['media_files.guid'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_metaflow_runs_batch_id'), 'metaflow_runs', ['batch_id'], unique=False)
+    op.create_index('ix_metaflow_runs_batch_id_media_file_id_created_at', 'metaflow_runs', ['batch_id', 'media_file_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_metaflow_runs_id'), 'metaflow_runs', ['id'], unique=False)
+    op.create_index(op.f('ix_metaflow_runs_media_file_id'), 'metaflow_runs', ['media_file_id'], unique=False)
+    op.create_table('mmifs',
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('mmifs_id_seq')"), nullable=False),
+    sa.Column('media_file_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('metaflow_run_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('batch_output_id', sa.Integer(), nullable=True),
+    sa.Column('mmif_location', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.ForeignKeyConstraint(['batch_output_id'], ['batches.id'], ),
+    sa.ForeignKeyConstraint(['content_hash'], ['mmif_contents.sha256'], ),
+    sa.ForeignKeyConstraint(['media_file_id'], ['media_files.guid'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_mmifs_batch_output_id'), 'mmifs', ['batch_output_id'], unique=False)
+    op.create_index(op.f('ix_mmifs_content_hash'), 'mmifs', ['content_hash'], unique=False)
+    op.create_index(op.f('ix_mmifs_id'), 'mmifs', ['id'], unique=False)
+    op.create_index(op.f('ix_mmifs_media_file_id'), 'mmifs', ['media_file_id'], unique=False)
+    op.create_index(op.f('ix_mmifs_metaflow_run_id'), 'mmifs', ['metaflow_run_id'], unique=False)
+    op.execute('ALTER SEQUENCE mmifs_id_seq OWNED BY mmifs.id')
+
+    op.execute(f'INSERT INTO metaflow_runs ({METAFLOW_RUNS_COLUMNS}, created_at) SELECT {METAFLOW_RUNS_COLUMNS}, created_at FROM metaflow_runs_partitioned')
+    op.execute(f'INSERT INTO mmifs ({MMIFS_COLUMNS}, created_at) SELECT {MMIFS_COLUMNS}, created_at FROM mmifs_partitioned')
+    op.drop_table('mmifs_partitioned')
+    op.drop_table('metaflow_runs_partitioned')
+    op.execute(DROP_PARTITIONED_REFERENCE_FUNCTIONS)
+    op.execute('DROP FUNCTION IF EXISTS create_monthly_partitions(TEXT, INT)')
+    op.execute('DROP FUNCTION IF EXISTS create_monthly_partition(TEXT, DATE)')
+
+    op.execute(LATEST_MMIFS_TRIGGER)
+    for name, table, referred, columns, ondelete in reversed(FOREIGN_KEYS):
+        op.create_foreign_key(name, table, referred, columns, ['id'], ondelete=ondelete)
@@ -0,0 +1,73 @@
+"""Benchmark API requests with and without the verified access-token cache.
+
+Sends `pipeline` events, which do not touch the database, to `/api/event/` with an
+RS256 signed token, as Argo does, and times `verified_access_token` on its own.
+
+Usage:
+    python -m tests.benchmark_access_tokens [requests]
+"""
+
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from json import dumps
+from time import perf_counter, time
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.testclient import TestClient
+
+from chowda.auth import tokens
+from chowda.auth.utils import jwt_signing_key, verified_access_token
+from chowda.config import AUTH0_API_AUDIENCE
+from tests.conftest import app
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def requests_per_second(client: TestClient, token: str, requests: int) -> float:
+    headers = {'Authorization': f'Bearer {token}'}
+    event = {'body': dumps({'name': 'pipeline'})}
+    # The events router prints every event
+    with redirect_stdout(StringIO()):
+        start = perf_counter()
+        for _ in range(requests):
+            response = client.post('/api/event/', json=event, headers=headers)
+            assert response.status_code == 200, response.text
+        return requests / (perf_counter() - start)
+
+
+def verifications_per_second(token: str, requests: int) -> float:
+    start = perf_counter()
+    for _ in range(requests):
+        verified_access_token(None, token, private_key.public_key())
+    return requests / (perf_counter() - start)
+
+
+def main(requests: int = 2000):
+    app.dependency_overrides[jwt_signing_key] = lambda: private_key.public_key()
+    token = jwt.encode(
+        {
+            'sub': 'argo',
+            'aud': AUTH0_API_AUDIENCE,
+            'permissions': ['create:event'],
+            'exp': time() + 3600,
+        },
+        private_key,
+        algorithm='RS256',
+    )
+    with TestClient(app) as client:
+        for size in (0, 10_000):
+            tokens.ACCESS_TOKEN_CACHE_SIZE = size
+            tokens.access_token_cache.cache_clear()
+            requests_per_second(client, token, 100)
+            rate = requests_per_second(client, token, requests)
+            verifications = verifications_per_second(token, requests)
+            print(
+                f'cache size {size:>6}: {rate:,.0f} requests/s, '
+                f'{verifications:,.0f} verifications/s'
+            )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,53 @@
+"""Benchmark zip downloads of MMIFs, fetched one at a time and concurrently.
+
+Streams a zip of MMIFs from a moto S3 bucket through `iter_mmif_objects`,
+`open_mmif` and `zip_stream`, as `download_mmif` does, without the local MMIF cache.
+moto answers in-process, so each `GetObject` request is delayed by `latency_ms` to
+stand in for the round trip to S3.
+
+Usage:
+    python -m tests.benchmark_mmif_downloads [mmifs] [latency_ms] [size_kb]
+"""
+
+import sys
+from os import environ
+from time import perf_counter, sleep
+
+from moto import mock_aws
+
+from chowda import s3
+from chowda.config import MMIF_S3_BUCKET_NAME, MMIF_S3_CONCURRENCY
+from chowda.zipstream import zip_stream
+
+
+def mmifs_per_second(locations: list, prefetch: int) -> float:
+    start = perf_counter()
+    objects = s3.iter_mmif_objects(locations, prefetch=prefetch)
+    for _chunk in zip_stream(s3.mmif_zip_entries(objects)):
+        pass
+    return len(locations) / (perf_counter() - start)
+
+
+def main(mmifs: int = 200, latency_ms: int = 50, size_kb: int = 100):
+    environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    s3.mmif_cache = lambda: None
+    with mock_aws():
+        s3.s3_client.cache_clear()
+        client = s3.s3_client()
+        client.create_bucket(Bucket=MMIF_S3_BUCKET_NAME)
+        body = b'0' * size_kb * 1024
+        locations = [f'benchmark/{n}/cpb-aacip-{n}.mmif' for n in range(mmifs)]
+        for location in locations:
+            client.put_object(Bucket=MMIF_S3_BUCKET_NAME, Key=location, Body=body)
+        client.meta.events.register(
+            'before-sign.s3.GetObject', lambda **kwargs: sleep(latency_ms / 1000)
+        )
+        for prefetch in (1, MMIF_S3_CONCURRENCY):
+            mmifs_per_second(locations[:10], prefetch)
+            rate = mmifs_per_second(locations, prefetch)
+            print(f'concurrency {prefetch:>3}: {rate:,.0f} MMIFs/s')
+    s3.s3_client.cache_clear()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
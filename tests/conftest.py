@@ -4,20 +4,28 @@ from os import environ, path
 from typing import List, Optional, Type
 
 import jwt
+import pytest_asyncio
 from fastapi import APIRouter
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
+from moto import mock_aws
 from pytest import fixture
+from pytest_mock import MockerFixture
 from starlette.requests import Request
 
 # Set CHOWDA_ENV env var to 'test' always. This serves as a flag for anywhere else in
 # the application where we need to detect whether we are running tests or not.
 environ['CHOWDA_ENV'] = 'test'
+# MMIFs created in tests do not exist in S3, so do not summarize them in the background
+environ['MMIF_SUMMARIES'] = 'false'
+# Keep sessions in memory, instead of the sessions table
+environ['SESSION_BACKEND'] = 'memory'
 
 from chowda.app import app  # noqa: E402
 from chowda.auth.utils import jwt_signing_key  # noqa: E402
-from chowda.config import AUTH0_API_AUDIENCE  # noqa: E402
-from chowda.db import init_db  # noqa: E402
+from chowda.config import AUTH0_API_AUDIENCE, MMIF_S3_BUCKET_NAME  # noqa: E402
+from chowda.db import async_engine, init_db  # noqa: E402
+from chowda.s3 import s3_client  # noqa: E402
 
 # Set CI_CONFIG to use ./test/ci.test.toml *only* if it's not already set. We need to be
 # able to set the CI_CONFIG to point to a real SonyCi account and workspace when we are
@@ -68,6 +76,14 @@ def async_client(request):
     return AsyncClient(app=app, base_url='http://test')
 
 
+@pytest_asyncio.fixture(autouse=True)
+async def dispose_async_engine():
+    """Close async connections after each test, since each test has its own event
+    loop, and asyncpg connections cannot be shared between loops."""
+    yield
+    await async_engine.dispose()
+
+
 @fixture
 def client(request):
     return TestClient(app)
@@ -138,3 +154,27 @@ async def set_session_data(request: Request):
 
 
 app.mount('/test', test_router)
+
+
+@fixture
+def s3(mocker: MockerFixture):
+    """A mocked S3 bucket for MMIFs, read without the local MMIF cache"""
+    environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    mocker.patch('chowda.s3.mmif_cache', return_value=None)
+    with mock_aws():
+        s3_client.cache_clear()
+        client = s3_client()
+        client.create_bucket(Bucket=MMIF_S3_BUCKET_NAME)
+        yield client
+    s3_client.cache_clear()
+
+
+@fixture
+def mmif_locations(s3) -> List[str]:
+    """MMIF objects in the mocked S3 bucket"""
+    locations = [f'batch/{n}/cpb-aacip-{n}.mmif' for n in range(20)]
+    for location in locations:
+        s3.put_object(
+            Bucket=MMIF_S3_BUCKET_NAME, Key=location, Body=f'{{"id": "{location}"}}'
+        )
+    return locations
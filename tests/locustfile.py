@@ -1,4 +1,7 @@
+from json import dumps
+from os import environ
 from random import choice, randint
+from uuid import uuid4
 
 from factories import (
     BatchFactory,
@@ -8,7 +11,7 @@ from factories import (
     PipelineFactory,
     UserFactory,
 )
-from locust import HttpUser, task
+from locust import HttpUser, between, task
 
 models = {
     'user': UserFactory,
@@ -79,3 +82,32 @@ class AdminUser(HttpUser):
     def run_factories(self):
         model = random_model()
         self.create_from_factory(model, models[model])
+
+
+class ArgoEventUser(HttpUser):
+    """A storm of Argo status events for a few runs.
+
+    Requires a bearer token with the `create:event` permission in CHOWDA_API_TOKEN,
+    and existing MetaflowRun ids in CHOWDA_RUN_IDS, separated by commas."""
+
+    wait_time = between(0, 0.1)
+
+    def on_start(self):
+        self.run_ids = environ.get('CHOWDA_RUN_IDS', '').split(',')
+        self.client.headers['Authorization'] = f'Bearer {environ["CHOWDA_API_TOKEN"]}'
+
+    @task
+    def post_event(self):
+        payload = {
+            'flow_name': 'Pipeline',
+            'run_id': choice(self.run_ids),
+            'step_name': choice(['start', 'process', 'end']),
+            'task_id': uuid4().hex,
+            'finished': False,
+        }
+        self.client.post(
+            '/api/event/',
+            json={
+                'body': dumps({'name': 'metaflow.Pipeline.step', 'payload': payload})
+            },
+        )
@@ -0,0 +1,227 @@
+from typing import Type
+
+import pytest
+from httpx import AsyncClient
+from sqlmodel import Session
+
+from chowda.db import engine
+from chowda.models import Batch, MetaflowRun
+from chowda.routers.batches import BatchSetResponse, GuidUploadResponse
+from tests.factories import (
+    BatchFactory,
+    CollectionFactory,
+    MediaFileFactory,
+    factory_session,
+)
+
+
+@pytest.fixture
+def media_files():
+    return MediaFileFactory.create_batch(4)
+
+
+async def post_set(ac: AsyncClient, token: str, expression: dict):
+    return await ac.post(
+        '/api/batches/set',
+        json={'name': 'Set Batch', 'expression': expression},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+
+def guids_in_batch(batch_id: int) -> set:
+    with Session(engine) as db:
+        return {media_file.guid for media_file in db.get(Batch, batch_id).media_files}
+
+
+@pytest.mark.asyncio
+async def test_batch_set_operations(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    a = BatchFactory.create(media_files=media_files[:3])
+    b = BatchFactory.create(media_files=media_files[1:])
+    collection = CollectionFactory.create()
+    collection.media_files = media_files[:2]
+    factory_session.commit()
+    token = fake_access_token(permissions=['create:batch'])
+    guids = [media_file.guid for media_file in media_files]
+
+    async with async_client as ac:
+        union = await post_set(
+            ac,
+            token,
+            {'op': 'union', 'operands': [{'batch': a.id}, {'batch': b.id}]},
+        )
+        intersection = await post_set(
+            ac,
+            token,
+            {
+                'op': 'intersection',
+                'operands': [{'batch': a.id}, {'collection': collection.id}],
+            },
+        )
+        difference = await post_set(
+            ac,
+            token,
+            {'op': 'difference', 'operands': [{'batch': a.id}, {'batch': b.id}]},
+        )
+
+    assert union.status_code == 200
+    assert BatchSetResponse(**union.json()).size == 4
+    assert guids_in_batch(union.json()['id']) == set(guids)
+    assert guids_in_batch(intersection.json()['id']) == set(guids[:2])
+    assert guids_in_batch(difference.json()['id']) == {guids[0]}
+
+
+@pytest.mark.asyncio
+async def test_batch_set_status_filter(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    batch = BatchFactory.create(media_files=media_files)
+    for n, successful in enumerate((True, False)):
+        factory_session.add(
+            MetaflowRun(
+                id=f'set-test-{batch.id}-{n}',
+                pathspec=f'Pipeline/set-test-{batch.id}-{n}',
+                batch_id=batch.id,
+                media_file_id=media_files[n].guid,
+                finished=True,
+                successful=successful,
+            )
+        )
+    factory_session.commit()
+    token = fake_access_token(permissions=['create:batch'])
+
+    async with async_client as ac:
+        response = await post_set(
+            ac,
+            token,
+            {
+                'op': 'difference',
+                'operands': [
+                    {'batch': batch.id},
+                    {'batch': batch.id, 'status': 'successful'},
+                ],
+            },
+        )
+
+    assert response.status_code == 200
+    assert guids_in_batch(response.json()['id']) == {
+        media_file.guid for media_file in media_files[1:]
+    }
+
+
+@pytest.mark.asyncio
+async def test_batch_set_no_permission(
+    async_client: AsyncClient, fake_access_token: Type[callable]
+):
+    async with async_client as ac:
+        response = await post_set(
+            ac, fake_access_token(permissions=['wrong']), {'batch': 1}
+        )
+
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_upload_batch_raw_body(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    guids = [media_file.guid for media_file in media_files]
+    async with async_client as ac:
+        response = await ac.post(
+            '/api/batches/upload',
+            params={'name': 'Uploaded Batch'},
+            content='\n'.join(guids).encode(),
+            headers={
+                'Authorization': f'Bearer {fake_access_token(["create:batch"])}',
+                'Content-Type': 'text/plain',
+            },
+        )
+
+    assert response.status_code == 200
+    upload = GuidUploadResponse(**response.json())
+    assert upload.added == 4
+    assert guids_in_batch(upload.id) == set(guids)
+
+
+@pytest.mark.asyncio
+async def test_upload_batch_csv_file(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    guids = [media_file.guid for media_file in media_files]
+    csv = 'title,guid\n' + '\n'.join(f'"Title, {n}",{g}' for n, g in enumerate(guids))
+    async with async_client as ac:
+        response = await ac.post(
+            '/api/batches/upload',
+            params={'name': 'Uploaded CSV Batch'},
+            files={'file': ('guids.csv', csv.encode(), 'text/csv')},
+            headers={'Authorization': f'Bearer {fake_access_token(["create:batch"])}'},
+        )
+
+    assert response.status_code == 200
+    assert guids_in_batch(response.json()['id']) == set(guids)
+
+
+@pytest.mark.asyncio
+async def test_upload_batch_media_files_ndjson(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    batch = BatchFactory.create(media_files=media_files[:1])
+    factory_session.commit()
+    guids = [media_file.guid for media_file in media_files]
+    ndjson = '\n'.join(
+        [f'"{guids[0]}"', *[f'{{"guid": "{guid}"}}' for guid in guids[1:]]]
+    )
+    async with async_client as ac:
+        response = await ac.post(
+            f'/api/batches/{batch.id}/media_files',
+            content=ndjson.encode(),
+            headers={
+                'Authorization': f'Bearer {fake_access_token(["create:batch"])}',
+                'Content-Type': 'application/x-ndjson',
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.json()['added'] == 3
+    assert guids_in_batch(batch.id) == set(guids)
+
+
+@pytest.mark.asyncio
+async def test_upload_batch_missing_guids(
+    media_files: list,
+    async_client: AsyncClient,
+    fake_access_token: Type[callable],
+):
+    batch = BatchFactory.create()
+    factory_session.commit()
+    guids = [media_file.guid for media_file in media_files]
+    body = '\n'.join([*guids, 'cpb-aacip-missing']).encode()
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:batch"])}'}
+    async with async_client as ac:
+        strict = await ac.post(
+            f'/api/batches/{batch.id}/media_files', content=body, headers=headers
+        )
+        assert guids_in_batch(batch.id) == set()
+        lenient = await ac.post(
+            f'/api/batches/{batch.id}/media_files',
+            params={'strict': False},
+            content=body,
+            headers=headers,
+        )
+
+    assert strict.status_code == 422
+    assert strict.json()['detail']['missing'] == ['cpb-aacip-missing']
+    assert lenient.status_code == 200
+    assert lenient.json()['missing_count'] == 1
+    assert guids_in_batch(batch.id) == set(guids)
@@ -1,9 +1,23 @@
+import asyncio
 import json
+import time
+from datetime import datetime, timezone
 from json import dumps
+from uuid import uuid4
 
 import pytest
 from fastapi import status
 from httpx import AsyncClient
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from chowda.db import engine
+from chowda.event_buffer import EventBuffer
+from chowda.event_keys import EventKeys
+from chowda.models import EventKey, MetaflowRun
+from chowda.progress import LocalBroker, ProgressHub, progress_delta
+from chowda.reconciler import RunReconciler
+from tests.factories import BatchFactory, factory_session
 
 
 @pytest.fixture
@@ -102,3 +116,339 @@ async def test_events_without_permission(
         )
 
     assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.fixture
+def metaflow_run() -> MetaflowRun:
+    run = MetaflowRun(
+        id=f'argo-{uuid4().hex}', pathspec='Pipeline/run', batch_id=BatchFactory().id
+    )
+    factory_session.add(run)
+    factory_session.commit()
+    return run
+
+
+@pytest.fixture
+def buffer(mocker: MockerFixture) -> EventBuffer:
+    # Only flushed explicitly by the tests
+    buffer = EventBuffer(interval=3600, max_size=1000)
+    mocker.patch('chowda.routers.events.event_buffer', return_value=buffer)
+    yield buffer
+    buffer.close()
+
+
+@pytest.fixture
+def reconciler(mocker: MockerFixture) -> RunReconciler:
+    reconciler = RunReconciler(workers=1, ttl=60)
+    mocker.patch('chowda.routers.events.run_reconciler', return_value=reconciler)
+    yield reconciler
+    reconciler.close()
+
+
+@pytest.fixture
+def keys(mocker: MockerFixture) -> EventKeys:
+    keys = EventKeys(max_size=1000, cleanup_interval=3600)
+    mocker.patch('chowda.routers.events.event_keys', return_value=keys)
+    return keys
+
+
+def pipeline_event(run_id: str, step: str, task: str, **status) -> dict:
+    payload = {
+        'flow_name': 'Pipeline',
+        'run_id': run_id,
+        'step_name': step,
+        'task_id': task,
+        **status,
+    }
+    return {'body': dumps({'name': 'metaflow.Pipeline.step', 'payload': payload})}
+
+
+def get_run(run_id: str) -> MetaflowRun:
+    with Session(engine) as db:
+        return db.get(MetaflowRun, run_id)
+
+
+@pytest.mark.asyncio
+async def test_events_are_buffered(
+    metaflow_run: MetaflowRun,
+    buffer: EventBuffer,
+    async_client: AsyncClient,
+    fake_access_token: str,
+):
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+    async with async_client as ac:
+        for step, task in [('start', '1'), ('process', '2'), ('process', '3')]:
+            response = await ac.post(
+                '/api/event/',
+                json=pipeline_event(metaflow_run.id, step, task, finished=False),
+                headers=headers,
+            )
+            assert response.status_code == 200
+
+        assert get_run(metaflow_run.id).current_task is None
+        # Three events for the same run are written in one update
+        assert buffer.flush() == 1
+        assert get_run(metaflow_run.id).current_task == '3'
+
+        await ac.post(
+            '/api/event/',
+            json=pipeline_event(metaflow_run.id, 'process', '4', finished=False),
+            headers=headers,
+        )
+        # Terminal events are written immediately, and replace buffered progress
+        response = await ac.post(
+            '/api/event/',
+            json=pipeline_event(
+                metaflow_run.id,
+                'end',
+                '5',
+                finished=True,
+                finished_at=datetime.now(timezone.utc).isoformat(),
+                successful=True,
+            ),
+            headers=headers,
+        )
+
+    assert response.status_code == 200
+    assert buffer.flush() == 0
+    row = get_run(metaflow_run.id)
+    assert row.finished and row.successful
+    assert row.current_step == 'end'
+    assert buffer.stats()['events'] == 4
+
+
+def test_buffered_progress_does_not_overwrite_finished_runs(
+    metaflow_run: MetaflowRun, buffer: EventBuffer
+):
+    buffer.add(
+        metaflow_run.id,
+        datetime.now(timezone.utc),
+        current_step='process',
+        current_task='2',
+    )
+    with Session(engine) as db:
+        db.get(MetaflowRun, metaflow_run.id).finished = True
+        db.commit()
+
+    assert buffer.flush() == 0
+    assert get_run(metaflow_run.id).current_step is None
+
+
+@pytest.mark.asyncio
+async def test_event_status_is_reconciled(
+    metaflow_run: MetaflowRun,
+    buffer: EventBuffer,
+    reconciler: RunReconciler,
+    async_client: AsyncClient,
+    fake_access_token: str,
+    mocker: MockerFixture,
+):
+    Run = mocker.patch('chowda.reconciler.Run')
+    Run.return_value.finished = True
+    Run.return_value.finished_at = datetime.now(timezone.utc)
+    Run.return_value.successful = False
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+    async with async_client as ac:
+        # Events without a status are answered without waiting for Metaflow
+        for task in ('4', '5'):
+            response = await ac.post(
+                '/api/event/',
+                json=pipeline_event(metaflow_run.id, 'end', task),
+                headers=headers,
+            )
+            assert response.status_code == 200
+    reconciler.executor.shutdown(wait=True)
+
+    row = get_run(metaflow_run.id)
+    assert row.finished
+    assert row.successful is False
+    # The finished Run is cached
+    Run.assert_called_once_with(f'Pipeline/{metaflow_run.id}')
+
+
+@pytest.mark.asyncio
+async def test_duplicate_events_are_ignored(
+    metaflow_run: MetaflowRun,
+    buffer: EventBuffer,
+    keys: EventKeys,
+    async_client: AsyncClient,
+    fake_access_token: str,
+    mocker: MockerFixture,
+):
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+    event = pipeline_event(metaflow_run.id, 'process', '2', finished=False)
+    async with async_client as ac:
+        responses = [
+            await ac.post('/api/event/', json=event, headers=headers) for _ in range(3)
+        ]
+        assert [response.json() for response in responses] == [
+            None,
+            'Duplicate event',
+            'Duplicate event',
+        ]
+        assert buffer.stats()['events'] == 1
+        assert buffer.flush() == 1
+
+        end = pipeline_event(
+            metaflow_run.id,
+            'end',
+            '3',
+            finished=True,
+            finished_at=datetime.now(timezone.utc).isoformat(),
+            successful=True,
+        )
+        response = await ac.post('/api/event/', json=end, headers=headers)
+        assert response.json() is None
+
+        # Keys are stored with the events, for other workers and restarts
+        other = EventKeys(max_size=1000, cleanup_interval=3600)
+        mocker.patch('chowda.routers.events.event_keys', return_value=other)
+        response = await ac.post('/api/event/', json=end, headers=headers)
+
+    assert response.json() == 'Duplicate event'
+    assert keys.stats() == {'memory_hits': 2, 'db_hits': 0, 'new': 2, 'size': 2}
+    assert other.stats() == {'memory_hits': 0, 'db_hits': 1, 'new': 0, 'size': 1}
+    assert buffer.stats()['events'] == 1
+
+
+@pytest.mark.asyncio
+async def test_events_of_unknown_runs_are_not_found(
+    buffer: EventBuffer,
+    keys: EventKeys,
+    async_client: AsyncClient,
+    fake_access_token: str,
+):
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+    async with async_client as ac:
+        response = await ac.post(
+            '/api/event/',
+            json=pipeline_event('unknown-run', 'process', '2', finished=False),
+            headers=headers,
+        )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert buffer.stats()['events'] == 0
+
+
+@pytest.mark.asyncio
+async def test_older_events_do_not_overwrite_progress(
+    metaflow_run: MetaflowRun,
+    buffer: EventBuffer,
+    keys: EventKeys,
+    async_client: AsyncClient,
+    fake_access_token: str,
+):
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+
+    async def post(step: str, task: str, timestamp: int, **status):
+        return await ac.post(
+            '/api/event/',
+            json=pipeline_event(
+                metaflow_run.id, step, task, timestamp=timestamp, **status
+            ),
+            headers=headers,
+        )
+
+    async with async_client as ac:
+        await post('process', '3', 1_700_000_300, finished=False)
+        await post('start', '1', 1_700_000_100, finished=False)
+        # Coalesced in the buffer
+        assert buffer.flush() == 1
+        assert get_run(metaflow_run.id).current_task == '3'
+
+        # Arriving after newer progress was written
+        await post('process', '2', 1_700_000_200, finished=False)
+        assert buffer.flush() == 0
+        assert get_run(metaflow_run.id).current_task == '3'
+
+        # A late terminal event finishes the run, without rewinding its progress
+        await post(
+            'end',
+            '4',
+            1_700_000_250,
+            finished=True,
+            finished_at=datetime.now(timezone.utc).isoformat(),
+            successful=True,
+        )
+
+    row = get_run(metaflow_run.id)
+    assert row.finished
+    assert row.current_task == '3'
+    assert row.last_event_at == datetime.fromtimestamp(1_700_000_300, timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_progress_is_published(
+    metaflow_run: MetaflowRun,
+    buffer: EventBuffer,
+    keys: EventKeys,
+    async_client: AsyncClient,
+    fake_access_token: str,
+    mocker: MockerFixture,
+):
+    hub = ProgressHub(queue_size=10)
+    mocker.patch('chowda.progress.progress_broker', return_value=LocalBroker(hub))
+    queue = hub.subscribe(metaflow_run.batch_id)
+    headers = {'Authorization': f'Bearer {fake_access_token(["create:event"])}'}
+    finished_at = datetime.now(timezone.utc)
+    async with async_client as ac:
+        await ac.post(
+            '/api/event/',
+            json=pipeline_event(metaflow_run.id, 'process', '2', finished=False),
+            headers=headers,
+        )
+        buffer.flush()
+        await ac.post(
+            '/api/event/',
+            json=pipeline_event(
+                metaflow_run.id,
+                'end',
+                '3',
+                finished=True,
+                finished_at=finished_at.isoformat(),
+                successful=True,
+            ),
+            headers=headers,
+        )
+    await asyncio.sleep(0)
+
+    assert queue.get_nowait() == progress_delta(
+        metaflow_run.id, metaflow_run.batch_id, current_step='process', current_task='2'
+    )
+    assert queue.get_nowait() == progress_delta(
+        metaflow_run.id,
+        metaflow_run.batch_id,
+        current_step='end',
+        current_task='3',
+        finished=True,
+        finished_at=finished_at,
+        successful=True,
+    )
+
+
+def test_expired_keys_are_deleted_by_the_flush_thread(
+    metaflow_run: MetaflowRun, mocker: MockerFixture
+):
+    mocker.patch(
+        'chowda.event_buffer.event_keys',
+        return_value=EventKeys(max_size=1000, cleanup_interval=0),
+    )
+    expired = f'expired-{uuid4().hex}'
+    with Session(engine) as db:
+        db.add(
+            EventKey(key=expired, created_at=datetime(2000, 1, 1, tzinfo=timezone.utc))
+        )
+        db.commit()
+
+    buffer = EventBuffer(interval=0.01, max_size=1000)
+    buffer.add(metaflow_run.id, datetime.now(timezone.utc), current_step='start')
+    try:
+        for _ in range(200):
+            with Session(engine) as db:
+                if db.get(EventKey, expired) is None:
+                    break
+            time.sleep(0.01)
+        else:
+            pytest.fail('Expired key was not deleted')
+    finally:
+        buffer.close()
@@ -0,0 +1,74 @@
+from time import time
+
+import jwt
+import pytest
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from chowda.auth.tokens import AccessTokenCache
+from chowda.auth.utils import OAuthAccessToken
+from chowda.config import AUTH0_API_AUDIENCE
+from tests.conftest import fake_signing_key
+
+
+def access_token(exp: float, permissions=('read:metrics',)) -> str:
+    return jwt.encode(
+        {
+            'sub': 'fake-api-subject',
+            'aud': AUTH0_API_AUDIENCE,
+            'permissions': list(permissions),
+            'exp': exp,
+        },
+        fake_signing_key(),
+    )
+
+
+def test_access_tokens_expire():
+    cache = AccessTokenCache(max_size=2)
+    verified = OAuthAccessToken(sub='test')
+    cache.add('current', verified, time() + 60)
+    cache.add('expired', verified, time() - 1)
+    cache.add('no exp', verified, None)
+
+    assert cache.get('current') is verified
+    assert cache.get('expired') is None
+    assert cache.get('no exp') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'expired': 1, 'size': 1}
+
+
+def test_access_token_cache_is_bounded():
+    cache = AccessTokenCache(max_size=2)
+    verified = OAuthAccessToken(sub='test')
+    for token in ('first', 'second'):
+        cache.add(token, verified, time() + 60)
+    cache.get('first')
+    cache.add('third', verified, time() + 60)
+
+    # The least recently used token is dropped
+    assert cache.get('second') is None
+    assert cache.get('first') is cache.get('third') is verified
+
+
+@pytest.mark.asyncio
+async def test_verified_access_tokens_are_cached(
+    async_client: AsyncClient, mocker: MockerFixture
+):
+    cache = AccessTokenCache(max_size=10)
+    mocker.patch('chowda.auth.tokens.access_token_cache', return_value=cache)
+    decode = mocker.spy(jwt, 'decode')
+    token = access_token(time() + 60)
+    async with async_client as ac:
+        for _ in range(3):
+            response = await ac.get(
+                '/api/metrics/', headers={'Authorization': f'Bearer {token}'}
+            )
+            assert response.status_code == 200
+        # Cached permissions are still checked
+        response = await ac.get(
+            '/api/metrics/',
+            headers={'Authorization': f'Bearer {access_token(time() + 60, ())}'},
+        )
+        assert response.status_code == 403
+
+    assert decode.call_count == 2
+    assert cache.stats()['hits'] == 2
@@ -1,4 +1,11 @@
 from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from chowda.auth import utils
+from chowda.config import AUTH0_API_AUDIENCE
+from chowda.models import MetaflowRun
+
+from .factories import BatchFactory, MediaFileFactory, factory_session
 
 
 def test_get_admin_home(client: TestClient):
@@ -14,3 +21,40 @@ def test_get_admin_redirect(client: TestClient):
     assert (
         '/admin/login?next=' in response.headers['location']
     ), 'Home page did not redirect to /admin/'
+
+
+def test_oauth_user_is_parsed_once_per_request(
+    client: TestClient, mocker: MockerFixture
+):
+    client.post(
+        '/test/session',
+        json={'user': {'name': 'test user', f'{AUTH0_API_AUDIENCE}/roles': ['admin']}},
+    )
+    OAuthUser = mocker.patch('chowda.auth.utils.OAuthUser', wraps=utils.OAuthUser)
+
+    batch = BatchFactory()
+    for page in ('/admin/batch/list', f'/admin/api/batch?pks={batch.id}'):
+        response = client.get(page)
+        assert response.status_code == 200
+    assert OAuthUser.call_count == 2
+
+
+def test_batch_detail_follows_the_progress_of_its_batch(client: TestClient):
+    client.post(
+        '/test/session',
+        json={'user': {'name': 'test user', f'{AUTH0_API_AUDIENCE}/roles': ['admin']}},
+    )
+    batch = BatchFactory()
+    run = MetaflowRun(
+        id=f'run-{batch.id}',
+        pathspec=f'Pipeline/run-{batch.id}',
+        batch_id=batch.id,
+        media_file_id=MediaFileFactory().guid,
+    )
+    factory_session.add(run)
+    factory_session.commit()
+
+    response = client.get(f'/admin/batch/detail/{batch.id}')
+    assert response.status_code == 200
+    assert f'data-progress-url="/progress/batches/{batch.id}"' in response.text
+    assert f'data-run-id="{run.id}"' in response.text
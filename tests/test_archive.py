@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta, timezone
+
+from pytest import importorskip
+from sqlmodel import Session, select
+
+from chowda import archive as archive_module
+from chowda.archive import archive, archive_batch
+from chowda.db import engine
+from chowda.models import (
+    MMIF,
+    ArchivedMetaflowRun,
+    ArchivedMMIF,
+    MetaflowRun,
+    MMIFBatchInputLink,
+    MMIFSummary,
+)
+from tests.factories import BatchFactory, MediaFileFactory, factory_session
+
+
+def days_ago(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+def add_run(db: Session, id: str, batch_id: int, guid: str, days: int) -> MMIF:
+    """Add a run of a MediaFile in a batch, with its MMIF"""
+    run = MetaflowRun(
+        id=id,
+        pathspec=f'Pipeline/{id}',
+        batch_id=batch_id,
+        media_file_id=guid,
+        created_at=days_ago(days),
+    )
+    mmif = MMIF(
+        media_file_id=guid,
+        metaflow_run_id=id,
+        batch_output_id=batch_id,
+        created_at=days_ago(days),
+    )
+    db.add_all([run, mmif])
+    return mmif
+
+
+def test_archive():
+    batch_id = BatchFactory().id
+    guid, recent_guid = MediaFileFactory().guid, MediaFileFactory().guid
+    input_batch_id = BatchFactory().id
+    factory_session.close()
+
+    with Session(engine) as db:
+        # Superseded runs are archived with their MMIFs
+        add_run(db, f'superseded-{guid}', batch_id, guid, days=60)
+        add_run(db, f'latest-{guid}', batch_id, guid, days=50)
+        # unless their MMIF is used as a batch input
+        input_mmif = add_run(db, f'input-{guid}', batch_id, guid, days=70)
+        # or they are not old enough
+        add_run(db, f'superseded-{recent_guid}', batch_id, recent_guid, days=2)
+        add_run(db, f'latest-{recent_guid}', batch_id, recent_guid, days=1)
+        # MMIFs without a run are archived, unless they are the latest of their
+        # MediaFile
+        standalone = MMIF(media_file_id=guid, created_at=days_ago(80))
+        latest = MMIF(media_file_id=guid, created_at=days_ago(40))
+        db.add_all([standalone, latest])
+        db.flush()
+        db.add(MMIFBatchInputLink(mmif_id=input_mmif.id, batch_id=input_batch_id))
+        db.add(MMIFSummary(mmif_id=standalone.id))
+        db.commit()
+        standalone_id, latest_id = standalone.id, latest.id
+
+    # One run and one MMIF per transaction
+    totals = archive(after_days=30, batch_size=1, parquet_location=None)
+    assert totals['runs'] >= 1
+    assert totals['mmifs'] >= 2
+
+    with Session(engine) as db:
+        assert db.exec(
+            select(ArchivedMetaflowRun.id).where(
+                ArchivedMetaflowRun.media_file_id.in_([guid, recent_guid])
+            )
+        ).all() == [f'superseded-{guid}']
+        assert set(
+            db.exec(
+                select(ArchivedMMIF.metaflow_run_id).where(
+                    ArchivedMMIF.media_file_id == guid
+                )
+            )
+        ) == {f'superseded-{guid}', None}
+        assert db.get(ArchivedMMIF, standalone_id).archived_at is not None
+        assert db.get(MMIFSummary, standalone_id) is None
+
+        assert set(
+            db.exec(
+                select(MetaflowRun.id).where(
+                    MetaflowRun.media_file_id.in_([guid, recent_guid])
+                )
+            )
+        ) == {
+            f'latest-{guid}',
+            f'input-{guid}',
+            f'superseded-{recent_guid}',
+            f'latest-{recent_guid}',
+        }
+        assert db.get(MMIF, latest_id) is not None
+        assert db.get(MMIF, standalone_id) is None
+
+    # Nothing is left to archive
+    assert archive(after_days=30, batch_size=1, parquet_location=None) == {
+        'runs': 0,
+        'mmifs': 0,
+    }
+
+
+def test_archive_to_parquet(tmp_path):
+    parquet = importorskip('pyarrow.parquet')
+    guid = MediaFileFactory().guid
+    factory_session.close()
+    with Session(engine) as db:
+        mmif = MMIF(media_file_id=guid, created_at=days_ago(80))
+        db.add_all([mmif, MMIF(media_file_id=guid)])
+        db.commit()
+        mmif_id = mmif.id
+
+    archive(after_days=30, parquet_location=str(tmp_path))
+    [path] = (tmp_path / 'archived_mmifs').iterdir()
+    assert mmif_id in parquet.read_table(path).column('id').to_pylist()
+
+
+def test_runs_with_locked_mmifs_are_kept():
+    batch_id = BatchFactory().id
+    guid = MediaFileFactory().guid
+    factory_session.close()
+    with Session(engine) as db:
+        mmif = add_run(db, f'superseded-{guid}', batch_id, guid, days=60)
+        add_run(db, f'latest-{guid}', batch_id, guid, days=50)
+        db.commit()
+        mmif_id = mmif.id
+
+    with Session(engine) as other:
+        other.exec(select(MMIF).where(MMIF.id == mmif_id).with_for_update()).one()
+        archive_batch(days_ago(30), batch_size=1000)
+        with Session(engine) as db:
+            assert db.get(MetaflowRun, f'superseded-{guid}') is not None
+
+    archive_batch(days_ago(30), batch_size=1000)
+    with Session(engine) as db:
+        assert db.get(MetaflowRun, f'superseded-{guid}') is None
+        assert db.get(ArchivedMMIF, mmif_id) is not None
+
+
+def test_failed_batches_are_skipped(monkeypatch):
+    batch_id = BatchFactory().id
+    guid = MediaFileFactory().guid
+    factory_session.close()
+    with Session(engine) as db:
+        add_run(db, f'superseded-{guid}', batch_id, guid, days=60)
+        add_run(db, f'latest-{guid}', batch_id, guid, days=50)
+        db.commit()
+
+    move = archive_module.move
+
+    def failing_move(db, model, archive, ids):
+        if f'superseded-{guid}' in ids:
+            raise RuntimeError('Failed to move')
+        return move(db, model, archive, ids)
+
+    monkeypatch.setattr(archive_module, 'move', failing_move)
+    archive(after_days=30, batch_size=1, parquet_location=None)
+
+    # The failed run and its MMIF were rolled back, and the job finished
+    with Session(engine) as db:
+        assert db.get(MetaflowRun, f'superseded-{guid}') is not None
+        assert db.exec(
+            select(MMIF).where(MMIF.metaflow_run_id == f'superseded-{guid}')
+        ).one()
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from chowda.config import DB_URL
+from chowda.db import pool_options, pool_stats, timed_pool
+
+
+def test_pool_profiles():
+    assert issubclass(pool_options(QueuePool, 'null')['poolclass'], NullPool)
+    options = pool_options(QueuePool, 'queue')
+    assert issubclass(options['poolclass'], QueuePool)
+    assert {'pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'} < set(options)
+    with pytest.raises(ValueError):
+        pool_options(QueuePool, 'unknown')
+
+
+def test_pool_stats():
+    engine = create_engine(
+        DB_URL,
+        poolclass=timed_pool(QueuePool),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        assert pool_stats(engine)['checked_out'] == 1
+        with pytest.raises(TimeoutError):
+            engine.connect()
+
+    stats = pool_stats(engine)
+    assert stats['checkouts'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['max_wait_ms'] >= 100
+    assert stats['checked_out'] == 0
+    assert stats['checked_in'] == 1
+    engine.dispose()
+
+
+def test_null_pool_stats():
+    engine = create_engine(DB_URL, **pool_options(QueuePool, 'null'))
+    for _ in range(2):
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+    stats = pool_stats(engine)
+    assert stats['pool'] == 'TimedNullPool'
+    assert stats['checkouts'] == 2
+    assert 'checked_out' not in stats
@@ -0,0 +1,164 @@
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta, timezone
+from time import monotonic, sleep
+from typing import List
+
+import pytest
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from chowda.config import AUTH0_API_AUDIENCE, MMIF_S3_BUCKET_NAME
+from chowda.db import engine
+from chowda.exports import ExportExpirer, submit_export
+from chowda.models import MMIF, ExportJob, ExportStatus
+from tests.factories import BatchFactory, MediaFileFactory, factory_session
+
+
+class ImmediateExecutor:
+    """Runs submitted export jobs immediately, and counts them"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        fn(*args)
+
+
+@pytest.fixture
+def executor(mocker: MockerFixture, tmp_path) -> ImmediateExecutor:
+    executor = ImmediateExecutor()
+    mocker.patch('chowda.exports.export_executor', return_value=executor)
+    mocker.patch('chowda.exports.EXPORT_LOCATION', str(tmp_path))
+    return executor
+
+
+@pytest.fixture
+def batch_mmifs(mmif_locations: List[str]) -> List[MMIF]:
+    batch = BatchFactory.create()
+    media_file = MediaFileFactory.create()
+    mmifs = [
+        MMIF(
+            media_file_id=media_file.guid,
+            batch_output_id=batch.id,
+            mmif_location=location,
+        )
+        for location in mmif_locations[:3]
+    ]
+    factory_session.add_all(mmifs)
+    factory_session.commit()
+    return mmifs
+
+
+def get_job(job_id: int) -> ExportJob:
+    with Session(engine) as db:
+        return db.get(ExportJob, job_id)
+
+
+@pytest.mark.asyncio
+async def test_export_mmif_action(
+    batch_mmifs: List[MMIF], executor: ImmediateExecutor, async_client: AsyncClient
+):
+    batch_id = batch_mmifs[0].batch_output_id
+    async with async_client as ac:
+        await ac.post(
+            '/test/session',
+            json={'user': {'name': 'test', f'{AUTH0_API_AUDIENCE}/roles': ['clammer']}},
+        )
+        responses = [
+            await ac.get(
+                '/admin/api/batch/action',
+                params={'pks': [batch_id], 'name': 'export_mmif'},
+            )
+            for _ in range(2)
+        ]
+        job_id = int(responses[0].json()['msg'].split()[1])
+        export_status = await ac.get(f'/exports/{job_id}')
+        download = await ac.get(f'/exports/{job_id}/download')
+        detail = await ac.get(f'/admin/batch/detail/{batch_id}')
+
+    assert [response.status_code for response in responses] == [200, 200]
+    # The second request reuses the first export
+    assert executor.submitted == 1
+    assert export_status.json()['status'] == 'finished'
+    assert export_status.json()['completed'] == 3
+    assert download.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(download.content)) as archive:
+        assert archive.namelist() == [
+            mmif.mmif_location.split('/')[-1] for mmif in batch_mmifs
+        ]
+    assert f'/exports/{job_id}/download' in detail.text
+
+
+def test_expired_export_is_rebuilt(
+    batch_mmifs: List[MMIF], executor: ImmediateExecutor
+):
+    mmif_ids = [mmif.id for mmif in batch_mmifs]
+    with Session(engine) as db:
+        job = submit_export(db, mmif_ids)
+        location = job.location
+        job.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.commit()
+        job = submit_export(db, mmif_ids)
+
+    assert executor.submitted == 2
+    assert job.status == ExportStatus.FINISHED
+    assert get_job(job.id).location == location
+
+
+def test_expired_exports_are_deleted_in_the_background(
+    batch_mmifs: List[MMIF], executor: ImmediateExecutor
+):
+    with Session(engine) as db:
+        job = submit_export(db, [mmif.id for mmif in batch_mmifs])
+        job_id, location = job.id, job.location
+        job.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        db.commit()
+    assert os.path.exists(location)
+
+    # No new export is submitted
+    expirer = ExportExpirer(interval=0.1)
+    expirer.start()
+    try:
+        deadline = monotonic() + 5
+        while get_job(job_id).status != ExportStatus.EXPIRED and monotonic() < deadline:
+            sleep(0.1)
+    finally:
+        expirer.close()
+
+    job = get_job(job_id)
+    assert job.status == ExportStatus.EXPIRED
+    assert job.location is None
+    assert not os.path.exists(location)
+
+
+def test_export_to_s3(
+    batch_mmifs: List[MMIF], executor: ImmediateExecutor, s3, mocker: MockerFixture
+):
+    mocker.patch(
+        'chowda.exports.EXPORT_LOCATION', f's3://{MMIF_S3_BUCKET_NAME}/exports'
+    )
+    with Session(engine) as db:
+        job = submit_export(db, [mmif.id for mmif in batch_mmifs])
+
+    assert job.location.startswith(f's3://{MMIF_S3_BUCKET_NAME}/exports/')
+    archive = s3.get_object(
+        Bucket=MMIF_S3_BUCKET_NAME, Key=job.location.split('/', 3)[-1]
+    )
+    with zipfile.ZipFile(io.BytesIO(archive['Body'].read())) as zip:
+        assert len(zip.namelist()) == 3
+
+
+def test_failed_export(
+    batch_mmifs: List[MMIF], executor: ImmediateExecutor, mocker: MockerFixture
+):
+    mocker.patch('chowda.exports.zip_stream', side_effect=OSError('Disk full'))
+    with Session(engine) as db:
+        job = submit_export(db, [batch_mmifs[0].id])
+
+    job = get_job(job.id)
+    assert job.status == ExportStatus.FAILED
+    assert job.error == 'Disk full'
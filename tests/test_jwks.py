@@ -0,0 +1,116 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import sleep
+from typing import Iterator
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+from chowda.auth.jwks import JWKSCache
+from chowda.auth.utils import jwt_signing_key
+
+
+def rsa_jwk(kid: str) -> dict:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    return {**jwk, 'kid': kid, 'use': 'sig', 'alg': 'RS256'}
+
+
+class JWKSServer:
+    """Serves a JWKS file, and counts how many times it was fetched"""
+
+    def __init__(self, directory: Path):
+        self.path = directory / 'jwks.json'
+        self.requests = 0
+        self.delay = 0
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=str(directory), **kwargs)
+
+            def do_GET(self):
+                server.requests += 1
+                sleep(server.delay)
+                super().do_GET()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/jwks.json'
+
+    def publish(self, *kids: str):
+        self.path.write_text(json.dumps({'keys': [rsa_jwk(kid) for kid in kids]}))
+
+
+@pytest.fixture
+def jwks_server(tmp_path: Path) -> Iterator[JWKSServer]:
+    server = JWKSServer(tmp_path)
+    server.publish('first')
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.httpd.shutdown()
+
+
+def test_signing_keys_are_cached(jwks_server: JWKSServer):
+    cache = JWKSCache(jwks_server.url, ttl=60, min_refresh=0, timeout=5)
+
+    for _ in range(10):
+        assert cache.signing_key('first').key_id == 'first'
+    assert jwks_server.requests == 1
+    assert cache.stats() == {
+        'hits': 9,
+        'misses': 1,
+        'fetches': 1,
+        'errors': 0,
+        'keys': 1,
+    }
+
+
+def test_unknown_keys_refresh_once(jwks_server: JWKSServer):
+    cache = JWKSCache(jwks_server.url, ttl=60, min_refresh=0, timeout=5)
+    cache.signing_key('first')
+
+    # Rotated keys are fetched once, for all concurrent requests
+    jwks_server.publish('first', 'second')
+    jwks_server.delay = 0.2
+    with ThreadPoolExecutor(8) as pool:
+        keys = list(pool.map(cache.signing_key, ['second'] * 8))
+    assert {key.key_id for key in keys} == {'second'}
+    assert jwks_server.requests == 2
+
+    # Unknown keys are not fetched again until `min_refresh` has passed
+    cache.min_refresh = 60
+    with pytest.raises(jwt.PyJWKClientError):
+        cache.signing_key('unknown')
+    assert jwks_server.requests == 2
+
+
+def test_stale_keys_are_refreshed_in_the_background(jwks_server: JWKSServer):
+    cache = JWKSCache(jwks_server.url, ttl=0, min_refresh=60, timeout=5)
+    cache.signing_key('first')
+
+    jwks_server.publish('second')
+    jwks_server.delay = 0.2
+    # The stale key is still served while the key set is refreshed
+    assert cache.signing_key('first').key_id == 'first'
+    # Waits for the refresh already running
+    assert cache.signing_key('second').key_id == 'second'
+    assert jwks_server.requests == 2
+
+
+def test_jwt_signing_key_errors(jwks_server: JWKSServer, mocker):
+    cache = JWKSCache(jwks_server.url, ttl=60, min_refresh=0, timeout=5)
+    mocker.patch('chowda.auth.jwks.jwks', return_value=cache)
+    token = jwt.encode({'sub': 'test'}, 'secret', headers={'kid': 'unknown'})
+
+    with pytest.raises(HTTPException) as error:
+        jwt_signing_key(token)
+    assert error.value.status_code == 401
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlmodel import Session, delete, update
+
+from chowda.db import engine
+from chowda.models import MMIF
+from chowda.utils import latest_mmifs
+from tests.factories import MediaFileFactory
+
+
+def add_mmifs(db: Session, guid: str, *days: int) -> List[MMIF]:
+    """Add MMIFs for a MediaFile, created `days` after a fixed date"""
+    mmifs = [
+        MMIF(
+            media_file_id=guid,
+            mmif_location=f's3://bucket/{guid}/{day}.mmif',
+            created_at=datetime(2024, 1, 1) + timedelta(days=day),
+        )
+        for day in days
+    ]
+    db.add_all(mmifs)
+    db.commit()
+    return mmifs
+
+
+def latest_location(db: Session, guid: str) -> Optional[str]:
+    mmif = latest_mmifs(db, [guid]).get(guid)
+    return mmif.mmif_location if mmif else None
+
+
+def test_latest_mmifs():
+    media_files = MediaFileFactory.create_batch(3)
+    guids = [media_file.guid for media_file in media_files]
+    with Session(engine) as db:
+        add_mmifs(db, guids[0], 1, 3, 2)
+        add_mmifs(db, guids[1], 5)
+
+        assert {
+            guid: mmif.mmif_location for guid, mmif in latest_mmifs(db, guids).items()
+        } == {
+            guids[0]: f's3://bucket/{guids[0]}/3.mmif',
+            guids[1]: f's3://bucket/{guids[1]}/5.mmif',
+        }
+
+
+def test_latest_mmif_is_maintained():
+    guid, other = (media_file.guid for media_file in MediaFileFactory.create_batch(2))
+    with Session(engine) as db:
+        first, second = add_mmifs(db, guid, 2, 1)
+        assert latest_location(db, guid) == first.mmif_location
+
+        # An older MMIF does not replace the latest one
+        add_mmifs(db, guid, 0)
+        assert latest_location(db, guid) == first.mmif_location
+
+        db.exec(delete(MMIF).where(MMIF.id == first.id))
+        db.commit()
+        assert latest_location(db, guid) == second.mmif_location
+
+        db.exec(update(MMIF).where(MMIF.id == second.id).values(media_file_id=other))
+        db.commit()
+        assert latest_location(db, guid) == f's3://bucket/{guid}/0.mmif'
+        assert latest_location(db, other) == second.mmif_location
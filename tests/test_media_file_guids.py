@@ -0,0 +1,90 @@
+import pytest
+from httpx import AsyncClient
+from sqlmodel import Session, select
+
+from chowda.config import AUTH0_API_AUDIENCE
+from chowda.db import engine
+from chowda.models import Batch
+from chowda.utils import missing_media_file_guids
+
+from .factories import BatchFactory, MediaFileFactory, factory_session
+
+
+async def login(ac: AsyncClient):
+    await ac.post(
+        '/test/session',
+        json={
+            'user': {
+                'name': 'test user',
+                f'{AUTH0_API_AUDIENCE}/roles': ['clammer'],
+            }
+        },
+    )
+
+
+def test_missing_media_file_guids():
+    guids = [media_file.guid for media_file in MediaFileFactory.create_batch(3)]
+    with Session(engine) as db:
+        assert missing_media_file_guids(db, guids) == []
+        assert missing_media_file_guids(
+            db, [*guids, 'cpb-aacip-missing'], chunk_size=2
+        ) == ['cpb-aacip-missing']
+
+
+@pytest.mark.asyncio
+async def test_create_batch_with_guids(async_client: AsyncClient):
+    guids = [media_file.guid for media_file in MediaFileFactory.create_batch(3)]
+    async with async_client as ac:
+        await login(ac)
+        response = await ac.post(
+            '/admin/batch/create',
+            data={
+                'name': 'GUIDs Batch',
+                'description': 'Created from GUIDs',
+                'media_files': '\n'.join([*guids, guids[0]]),
+            },
+        )
+    assert response.status_code == 303
+    with Session(engine) as db:
+        batch = db.exec(
+            select(Batch).where(Batch.name == 'GUIDs Batch').order_by(Batch.id.desc())
+        ).first()
+        assert {media_file.guid for media_file in batch.media_files} == set(guids)
+
+
+@pytest.mark.asyncio
+async def test_edit_batch_with_guids(async_client: AsyncClient):
+    media_files = MediaFileFactory.create_batch(3)
+    batch = BatchFactory.create(media_files=media_files[:2])
+    factory_session.commit()
+    guids = [media_file.guid for media_file in media_files[1:]]
+    async with async_client as ac:
+        await login(ac)
+        response = await ac.post(
+            f'/admin/batch/edit/{batch.id}',
+            data={
+                'name': batch.name,
+                'description': batch.description,
+                'media_files': '\n'.join(guids),
+            },
+        )
+    assert response.status_code == 303
+    with Session(engine) as db:
+        batch = db.get(Batch, batch.id)
+        assert {media_file.guid for media_file in batch.media_files} == set(guids)
+
+
+@pytest.mark.asyncio
+async def test_create_batch_with_invalid_guids(async_client: AsyncClient):
+    async with async_client as ac:
+        await login(ac)
+        response = await ac.post(
+            '/admin/batch/create',
+            data={
+                'name': 'Invalid GUIDs Batch',
+                'description': 'Created from invalid GUIDs',
+                'media_files': 'cpb-aacip-invalid',
+            },
+        )
+    assert response.status_code == 422
+    assert 'cpb-aacip-invalid' in response.text
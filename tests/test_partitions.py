@@ -0,0 +1,277 @@
+import threading
+from datetime import date, datetime, timezone
+from typing import Callable, List, Tuple
+
+from pytest import raises
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from chowda.db import engine
+from chowda.models import MMIF, MetaflowRun, MMIFId, MMIFSummary
+from chowda.partitions import (
+    create_partitions,
+    detach_partition,
+    partition_name,
+    partitions,
+)
+from chowda.utils import latest_mmifs
+from tests.factories import MediaFileFactory, factory_session
+
+
+def new_guid() -> str:
+    """The guid of a new MediaFile
+
+    Closes the factory session, so it does not hold locks on the tables that partition
+    maintenance alters.
+    """
+    guid = MediaFileFactory().guid
+    factory_session.close()
+    return guid
+
+
+def stored_in(db: Session, mmif: MMIF) -> str:
+    """The partition a MMIF is stored in"""
+    return db.scalar(
+        text('SELECT tableoid::regclass::text FROM mmifs WHERE id = :id'),
+        {'id': mmif.id},
+    )
+
+
+def drop_partition(table: str, month: date):
+    name = detach_partition(table, month)
+    with engine.begin() as db:
+        db.execute(text(f'DROP TABLE {name}'))
+
+
+def test_monthly_partitions():
+    today = datetime.now(timezone.utc).date()
+    assert set(create_partitions(months_ahead=1)) >= {
+        partition_name('metaflow_runs', today),
+        partition_name('mmifs', today),
+    }
+    with engine.connect() as db:
+        bounds = partitions(db, 'mmifs')
+    assert bounds['mmifs_default'] == 'DEFAULT'
+    assert bounds[partition_name('mmifs', today)].startswith(
+        f"FOR VALUES FROM ('{today:%Y-%m}-01"
+    )
+
+    guid = new_guid()
+    with Session(engine) as db:
+        run = MetaflowRun(id=f'run-{guid}', pathspec='Pipeline/1', media_file_id=guid)
+        mmif = MMIF(media_file_id=guid, metaflow_run_id=run.id)
+        db.add_all([run, mmif])
+        db.commit()
+        assert stored_in(db, mmif) == partition_name('mmifs', today)
+
+        # Rows are still loaded by id alone
+        run_id, mmif_id = run.id, mmif.id
+        db.expunge_all()
+        assert db.get(MetaflowRun, run_id).mmif.id == mmif_id
+        assert db.get(MMIF, mmif_id).metaflow_run.id == run_id
+
+
+def test_partition_names_are_checked():
+    with raises(ValueError):
+        partition_name('mmifs; DROP TABLE batches', date(2001, 1, 1))
+
+
+def test_rows_are_moved_out_of_the_default_partition():
+    month = date(2002, 2, 1)
+    guid = new_guid()
+    with Session(engine) as db:
+        run = MetaflowRun(
+            id=f'run-{guid}',
+            pathspec='Pipeline/1',
+            media_file_id=guid,
+            created_at=datetime(2002, 2, 14),
+        )
+        mmif = MMIF(
+            media_file_id=guid, metaflow_run_id=run.id, created_at=datetime(2002, 2, 14)
+        )
+        db.add_all([run, mmif])
+        db.commit()
+        assert stored_in(db, mmif) == 'mmifs_default'
+        run_id, mmif_id = run.id, mmif.id
+
+    with engine.begin() as db:
+        for table in ('metaflow_runs', 'mmifs'):
+            db.execute(
+                text('SELECT create_monthly_partition(:table, :month)'),
+                {'table': table, 'month': month},
+            )
+    with Session(engine) as db:
+        try:
+            mmif = db.get(MMIF, mmif_id)
+            assert stored_in(db, mmif) == partition_name('mmifs', month)
+            assert latest_mmifs(db, [guid])[guid].id == mmif_id
+            assert mmif.metaflow_run.id == run_id
+        finally:
+            db.close()
+            with engine.begin() as connection:
+                connection.execute(
+                    text('DELETE FROM mmifs WHERE id = :id'), {'id': mmif_id}
+                )
+            drop_partition('mmifs', month)
+            drop_partition('metaflow_runs', month)
+
+
+def test_ids_are_unique_across_partitions():
+    guid = new_guid()
+    with Session(engine) as db:
+        db.add(MetaflowRun(id=f'run-{guid}', pathspec='Pipeline/1'))
+        db.commit()
+        db.add(
+            MetaflowRun(
+                id=f'run-{guid}', pathspec='Pipeline/2', created_at=datetime(1999, 1, 1)
+            )
+        )
+        with raises(IntegrityError, match='duplicate id'):
+            db.commit()
+
+
+def test_references_are_enforced():
+    guid = new_guid()
+    with Session(engine) as db:
+        db.add(MMIF(media_file_id=guid, metaflow_run_id='missing-run'))
+        with raises(IntegrityError, match='references a missing row'):
+            db.commit()
+        db.rollback()
+
+        db.add(MMIFSummary(mmif_id=-1))
+        with raises(IntegrityError, match='references a missing row'):
+            db.commit()
+        db.rollback()
+
+        run = MetaflowRun(id=f'run-{guid}', pathspec='Pipeline/1')
+        mmif = MMIF(media_file_id=guid, metaflow_run_id=run.id)
+        db.add_all([run, mmif])
+        db.commit()
+        with raises(IntegrityError, match='still referenced'):
+            db.execute(text('DELETE FROM metaflow_runs WHERE id = :id'), {'id': run.id})
+            db.commit()
+
+
+def run_concurrently(
+    fn: Callable[[], None],
+) -> Tuple[threading.Thread, List[Exception]]:
+    """Start `fn` in another thread, and check that it is waiting for a lock.
+
+    Returns the thread, and the list its errors are added to."""
+    errors = []
+
+    def run():
+        try:
+            fn()
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive()
+    return thread, errors
+
+
+def test_concurrent_inserts_of_the_same_id():
+    run_id = f'run-{new_guid()}'
+
+    def insert():
+        with Session(engine) as db:
+            db.add(
+                MetaflowRun(
+                    id=run_id, pathspec='Pipeline/2', created_at=datetime(1999, 1, 1)
+                )
+            )
+            db.commit()
+
+    with Session(engine) as db:
+        db.add(MetaflowRun(id=run_id, pathspec='Pipeline/1'))
+        db.flush()
+        # The second insert waits for this transaction, and sees its row
+        thread, errors = run_concurrently(insert)
+        db.commit()
+
+    thread.join(10)
+    assert len(errors) == 1
+    assert isinstance(errors[0], IntegrityError)
+    assert 'duplicate id' in str(errors[0])
+
+
+def test_referenced_rows_are_locked():
+    guid = new_guid()
+    run_id = f'run-{guid}'
+    with Session(engine) as db:
+        db.add(MetaflowRun(id=run_id, pathspec='Pipeline/1'))
+        db.commit()
+
+    def delete_run():
+        with engine.begin() as connection:
+            connection.execute(
+                text('DELETE FROM metaflow_runs WHERE id = :id'), {'id': run_id}
+            )
+
+    with Session(engine) as db:
+        db.add(MMIF(media_file_id=guid, metaflow_run_id=run_id))
+        db.flush()
+        # The run cannot be deleted until the new reference is committed
+        thread, errors = run_concurrently(delete_run)
+        db.commit()
+
+    thread.join(10)
+    assert len(errors) == 1
+    assert 'still referenced' in str(errors[0])
+
+
+def test_deleted_mmifs_are_removed_from_latest_mmifs():
+    guid = new_guid()
+    with Session(engine) as db:
+        older = MMIF(media_file_id=guid, created_at=datetime(2000, 1, 1))
+        latest = MMIF(media_file_id=guid)
+        db.add_all([older, latest])
+        db.commit()
+        assert latest_mmifs(db, [guid])[guid].id == latest.id
+
+        db.delete(latest)
+        db.commit()
+        assert latest_mmifs(db, [guid])[guid].id == older.id
+        db.delete(older)
+        db.commit()
+        assert guid not in latest_mmifs(db, [guid])
+
+
+def test_detach_partition():
+    month = date(2001, 1, 1)
+    guid = new_guid()
+    with engine.begin() as db:
+        db.execute(
+            text('SELECT create_monthly_partition(:table, :month)'),
+            {'table': 'mmifs', 'month': month},
+        )
+    with Session(engine) as db:
+        older = MMIF(media_file_id=guid, created_at=datetime(2000, 12, 1))
+        latest = MMIF(media_file_id=guid, created_at=datetime(2001, 1, 15))
+        db.add_all([older, latest])
+        db.commit()
+        older_id, latest_id = older.id, latest.id
+        db.add(MMIFSummary(mmif_id=latest_id))
+        db.commit()
+        assert latest_mmifs(db, [guid])[guid].id == latest_id
+        db.close()
+
+        # Detached MMIFs are no longer read, and the latest MMIF is recomputed
+        assert detach_partition('mmifs', month) == 'mmifs_y2001m01'
+        try:
+            assert db.exec(select(MMIF.id).where(MMIF.media_file_id == guid)).all() == [
+                older_id
+            ]
+            assert latest_mmifs(db, [guid])[guid].id == older_id
+            assert db.get(MMIFSummary, latest_id) is None
+            # and its ids are no longer registered
+            assert db.get(MMIFId, latest_id) is None
+            assert db.scalar(text('SELECT count(*) FROM mmifs_y2001m01')) == 1
+        finally:
+            db.close()
+            with engine.begin() as connection:
+                connection.execute(text('DROP TABLE mmifs_y2001m01'))
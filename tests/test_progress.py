@@ -0,0 +1,70 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from chowda.progress import ProgressHub, batch_events, progress_delta
+
+
+@pytest.mark.asyncio
+async def test_progress_is_delivered_to_batch_subscribers():
+    hub = ProgressHub(queue_size=2)
+    first, second, other = hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)
+
+    # Published from a writer thread
+    thread = threading.Thread(
+        target=hub.publish, args=(progress_delta('run', 1, current_step='start'),)
+    )
+    thread.start()
+    thread.join()
+    await asyncio.sleep(0)
+
+    for queue in (first, second):
+        assert queue.get_nowait() == {
+            'run_id': 'run',
+            'batch_id': 1,
+            'current_step': 'start',
+        }
+    assert other.empty()
+
+    # Slow subscribers lose their oldest deltas
+    for task in '123':
+        hub.publish(progress_delta('run', 2, current_task=task))
+    await asyncio.sleep(0)
+    assert [other.get_nowait()['current_task'] for _ in range(2)] == ['2', '3']
+
+    hub.unsubscribe(1, first)
+    hub.unsubscribe(1, second)
+    assert hub.stats() == {
+        'published': 4,
+        'delivered': 5,
+        'dropped': 1,
+        'subscribers': 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_batch_events(mocker):
+    hub = ProgressHub(queue_size=10)
+    mocker.patch('chowda.progress.progress_hub', return_value=hub)
+    disconnected = mocker.AsyncMock(return_value=False)
+    events = batch_events(1, disconnected, keepalive=0.01)
+
+    assert await events.__anext__() == 'retry: 10\n\n'
+    assert await events.__anext__() == ': keepalive\n\n'
+
+    hub.publish(progress_delta('run', 1, finished=True))
+    event = await events.__anext__()
+    assert event.startswith('event: run\ndata: ')
+    assert json.loads(event.splitlines()[1][len('data: ') :]) == {
+        'run_id': 'run',
+        'batch_id': 1,
+        'finished': True,
+    }
+
+    # Subscribers are removed when the client disconnects
+    disconnected.return_value = True
+    with pytest.raises(StopAsyncIteration):
+        await events.__anext__()
+    assert hub.stats()['subscribers'] == 0
@@ -0,0 +1,202 @@
+"""Query plans
+
+Runs the app's hot queries under EXPLAIN against a seeded database, and fails if any
+of them scans a whole large table. Add a query here when it runs on a request or an
+Argo event, and an index when it fails.
+
+The tables are seeded in their own `query_plans` schema, so other tests never see the
+seeded rows. Test workers share the schema while any of them is using it, and the
+last one to finish drops it.
+"""
+
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pytest
+from sqlalchemy import Connection, Engine, create_engine, event, text
+from sqlmodel import Session, SQLModel, select
+
+from chowda.db import engine
+from chowda.models import MMIF, MediaType, MetaflowRun, SonyCiAsset
+from chowda.sets import BatchSet, RunStatus, media_file_guids
+from chowda.utils import latest_mmifs
+
+# Schema the large tables are seeded in
+SCHEMA = 'query_plans'
+
+# Advisory lock keys: held exclusively while the schema is seeded or dropped, and
+# shared by every worker using the schema
+SEED_LOCK = 0x71706C31
+USE_LOCK = 0x71706C32
+
+# Rows seeded in each large table
+SEED_ROWS = 100_000
+
+# Batches the seeded runs and MMIFs are spread across
+SEED_BATCHES = 50
+
+# Tables that must never be scanned sequentially by a hot query
+LARGE_TABLES = {
+    'latest_mmifs',
+    'media_files',
+    'mediafilebatchlink',
+    'metaflow_runs',
+    'mmifs',
+    'sonyci_assets',
+}
+
+SEED_BATCHES_SQL = """
+INSERT INTO batches (name, description)
+SELECT 'Query plans ' || b, 'Seeded for query plans' FROM generate_series(1, :batches) b
+RETURNING id
+"""
+
+SEED = """
+INSERT INTO media_files (guid)
+SELECT 'query-plan-' || i FROM generate_series(1, :rows) i;
+
+-- The first batch has a page of MediaFiles, and the others share the rest
+INSERT INTO mediafilebatchlink (media_file_id, batch_id)
+SELECT 'query-plan-' || i,
+    CASE WHEN i <= 20 THEN :first_batch ELSE :first_batch + 1 + i % (:batches - 1) END
+FROM generate_series(1, :rows) i;
+
+INSERT INTO metaflow_runs (id, pathspec, batch_id, media_file_id, created_at, finished,
+    successful)
+SELECT 'query-plan-run-' || i, 'Pipeline/query-plan-run-' || i,
+    :first_batch + i % :batches, 'query-plan-' || i,
+    now() - i * interval '1 minute', true, i % 3 > 0
+FROM generate_series(1, :rows) i;
+
+INSERT INTO mmifs (created_at, media_file_id, metaflow_run_id, batch_output_id,
+    mmif_location)
+SELECT now() - i * interval '1 minute', 'query-plan-' || i, 'query-plan-run-' || i,
+    :first_batch + i % :batches, 's3://query-plans/' || i || '.mmif'
+FROM generate_series(1, :rows) i;
+
+-- One asset in a hundred is audio
+INSERT INTO sonyci_assets (id, name, size, type, media_file_id)
+SELECT 'query-plan-asset-' || i, 'query-plan-' || i || '.mp4', i,
+    CASE WHEN i % 100 = 0 THEN 'Audio' ELSE 'Video' END::mediatype, 'query-plan-' || i
+FROM generate_series(1, :rows) i;
+"""
+
+
+def seed(db: Connection) -> List[int]:
+    """Create and seed the tables of the schema, unless another worker already has,
+    and return the seeded batch ids"""
+    db.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SEED_LOCK})
+    db.execute(text(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}'))
+    SQLModel.metadata.create_all(db)
+    batch_ids = db.scalars(
+        text("SELECT id FROM batches WHERE name LIKE 'Query plans %' ORDER BY id")
+    ).all()
+    if len(batch_ids) >= SEED_BATCHES:
+        return batch_ids
+    batch_ids = sorted(db.scalars(text(SEED_BATCHES_SQL), {'batches': SEED_BATCHES}))
+    for statement in filter(str.strip, SEED.split(';')):
+        db.execute(
+            text(statement),
+            {
+                'batches': SEED_BATCHES,
+                'rows': SEED_ROWS,
+                'first_batch': batch_ids[0],
+            },
+        )
+    return batch_ids
+
+
+@pytest.fixture(scope='module')
+def plans_engine() -> Iterator[Engine]:
+    """An engine that reads and writes the tables of the query plans schema"""
+    plans_engine = create_engine(
+        engine.url, connect_args={'options': f'-csearch_path={SCHEMA}'}
+    )
+    yield plans_engine
+    plans_engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def seeded(plans_engine: Engine) -> Iterator[SimpleNamespace]:
+    """Seed the large tables, and return the seeded batch ids. Drops the schema
+    afterwards, unless another worker is still using it."""
+    with plans_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as user:
+        user.execute(text('SELECT pg_advisory_lock_shared(:key)'), {'key': USE_LOCK})
+        with plans_engine.begin() as db:
+            batch_ids = seed(db)
+        user.execute(text(f'VACUUM ANALYZE {", ".join(sorted(LARGE_TABLES))}'))
+        yield SimpleNamespace(batch_ids=batch_ids)
+        user.execute(text('SELECT pg_advisory_unlock_shared(:key)'), {'key': USE_LOCK})
+
+    with plans_engine.begin() as db:
+        db.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SEED_LOCK})
+        if db.scalar(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': USE_LOCK}):
+            db.execute(text(f'DROP SCHEMA {SCHEMA} CASCADE'))
+
+
+@contextmanager
+def recorded_queries(connection: Connection) -> Iterator[List[Tuple[str, Any]]]:
+    """Records the SELECT statements executed on `connection`, with their parameters"""
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            queries.append((statement, parameters))
+
+    event.listen(connection, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(connection, 'before_cursor_execute', record)
+
+
+def seq_scans(connection: Connection, statement: str, parameters: Any) -> List[str]:
+    """The large tables scanned sequentially in the plan of a statement"""
+    [plan] = connection.exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {statement}', parameters
+    ).scalar()
+    nodes, scanned = [plan['Plan']], []
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan' and node['Relation Name'] in LARGE_TABLES:
+            scanned.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return scanned
+
+
+HOT_QUERIES: Dict[str, Callable[[Session, SimpleNamespace], Any]] = {
+    'latest MMIFs': lambda db, seeded: latest_mmifs(
+        db, [f'query-plan-{i}' for i in range(1, 21)]
+    ),
+    'MMIF of a run': lambda db, seeded: db.exec(
+        select(MMIF).where(MMIF.metaflow_run_id == 'query-plan-run-1')
+    ).all(),
+    'output MMIFs of a batch': lambda db, seeded: db.exec(
+        select(MMIF).where(MMIF.batch_output_id == seeded.batch_ids[1])
+    ).all(),
+    'runs of a MediaFile in a batch': lambda db, seeded: db.exec(
+        select(MetaflowRun)
+        .where(MetaflowRun.batch_id == seeded.batch_ids[1])
+        .where(MetaflowRun.media_file_id == 'query-plan-1')
+        .order_by(MetaflowRun.created_at.desc())
+    ).all(),
+    'MediaFiles of a batch by run status': lambda db, seeded: db.exec(
+        media_file_guids(BatchSet(batch=seeded.batch_ids[0], status=RunStatus.FAILED))
+    ).all(),
+    'Sony Ci assets by type': lambda db, seeded: db.exec(
+        select(SonyCiAsset).where(SonyCiAsset.type == MediaType.Audio)
+    ).all(),
+}
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_queries_use_indexes(
+    plans_engine: Engine, seeded: SimpleNamespace, name: str
+):
+    with plans_engine.connect() as connection:
+        with recorded_queries(connection) as queries:
+            HOT_QUERIES[name](Session(connection), seeded)
+        assert queries
+        for statement, parameters in queries:
+            assert seq_scans(connection, statement, parameters) == [], statement
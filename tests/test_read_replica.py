@@ -0,0 +1,122 @@
+from typing import Iterator
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, create_engine, make_url, text
+from sqlalchemy.pool import QueuePool
+from sqlmodel import Session, SQLModel, select
+from starlette.requests import Request
+
+from chowda.config import AUTH0_API_AUDIENCE, DB_URL
+from chowda.db import RoutingSession, engine, pool_options, reads_primary
+from chowda.models import Collection
+
+
+@pytest.fixture(scope='module')
+def replica() -> Iterator[Engine]:
+    """A second database, standing in for a read replica that has not caught up"""
+    name = f'{make_url(DB_URL).database}_replica'
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as db:
+        if not db.scalar(
+            text('SELECT 1 FROM pg_database WHERE datname = :name'), {'name': name}
+        ):
+            db.execute(text(f'CREATE DATABASE {name}'))
+    replica = create_engine(make_url(DB_URL).set(database=name))
+    SQLModel.metadata.create_all(replica)
+    yield replica
+    replica.dispose()
+
+
+def add_collection() -> str:
+    name = f'collection-{uuid4().hex}'
+    with Session(engine) as db:
+        db.add(Collection(name=name, description='Only on the primary'))
+        db.commit()
+    return name
+
+
+def find_collection(db: Session, name: str):
+    return db.exec(select(Collection).where(Collection.name == name)).first()
+
+
+def test_routing_session(replica: Engine):
+    name = add_collection()
+    with RoutingSession(primary_engine=engine, replica_engine=replica) as db:
+        assert find_collection(db, name) is None
+
+        # Once the session writes, it reads its own writes from the primary
+        db.add(Collection(name=f'{name}-copy', description='Written to the primary'))
+        db.flush()
+        assert find_collection(db, f'{name}-copy') is not None
+        assert find_collection(db, name) is not None
+        db.rollback()
+
+    with RoutingSession(
+        primary=True, primary_engine=engine, replica_engine=replica
+    ) as db:
+        assert find_collection(db, name) is not None
+
+
+def request(method: str, path: str, session: dict) -> Request:
+    return Request(
+        {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'headers': [],
+            'session': session,
+        }
+    )
+
+
+def test_reads_primary(mocker):
+    session = {}
+    assert not reads_primary(request('GET', '/admin/batch/list', session))
+    assert reads_primary(request('GET', '/admin/api/batch/action', session))
+    # Following requests read their writes
+    assert reads_primary(request('GET', '/admin/batch/list', session))
+
+    mocker.patch('chowda.db.time', return_value=session['primary_until'] + 1)
+    assert not reads_primary(request('GET', '/admin/batch/list', session))
+    assert 'primary_until' not in session
+
+
+def test_admin_lists_read_from_the_replica(client: TestClient, replica: Engine, mocker):
+    mocker.patch('chowda.db.read_engine', replica)
+    client.post(
+        '/test/session',
+        json={'user': {'name': 'test user', f'{AUTH0_API_AUDIENCE}/roles': ['admin']}},
+    )
+    name = add_collection()
+
+    def listed() -> bool:
+        response = client.get('/admin/api/collection', params={'limit': 1000})
+        assert response.status_code == 200
+        return name in [collection['name'] for collection in response.json()['items']]
+
+    assert not listed()
+    # After an admin action, the session reads from the primary
+    client.post('/admin/api/collection/action', params={'name': 'unknown'})
+    assert listed()
+
+
+def test_pool_metrics_include_the_replica(
+    client: TestClient, fake_access_token: type, mocker
+):
+    def pools() -> dict:
+        response = client.get(
+            '/api/metrics/',
+            headers={'Authorization': f'Bearer {fake_access_token(["read:metrics"])}'},
+        )
+        assert response.status_code == 200
+        return response.json()['db_pool']
+
+    assert set(pools()) == {'sync', 'async'}
+
+    replica = create_engine(DB_URL, **pool_options(QueuePool))
+    mocker.patch('chowda.routers.metrics.read_engine', replica)
+    try:
+        assert pools()['read_sync']['pool'] == 'TimedQueuePool'
+    finally:
+        replica.dispose()
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+import zipfile
+from os import listdir, path, utime
+from time import time
+
+import pytest
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from chowda.config import AUTH0_API_AUDIENCE, MMIF_S3_BUCKET_NAME
+from chowda.manifests import aria2_manifest, csv_manifest
+from chowda.mmif_cache import MMIFCache
+from chowda.models import MMIF
+from chowda.s3 import get_mmif_object, iter_mmif_objects, mmif_zip_entries
+from chowda.zipstream import zip_stream
+from tests.factories import BatchFactory, MediaFileFactory, factory_session
+
+
+@pytest.fixture
+def cache(s3, tmp_path, mocker: MockerFixture) -> MMIFCache:
+    """A local MMIF cache used by `open_mmif`"""
+    cache = MMIFCache(str(tmp_path / 'cache'), max_size=512)
+    mocker.patch('chowda.s3.mmif_cache', return_value=cache)
+    mocker.patch('chowda.routers.metrics.mmif_cache', return_value=cache)
+    return cache
+
+
+def test_zip_stream_mmifs(mmif_locations: list):
+    objects = iter_mmif_objects([*mmif_locations, 'batch/missing.mmif'], prefetch=4)
+    chunks = list(zip_stream(mmif_zip_entries(objects)))
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        names = archive.namelist()
+        assert names[:-1] == [path.basename(location) for location in mmif_locations]
+        assert names[-1] == 'download_errors.txt'
+        assert mmif_locations[0] in archive.read(names[0]).decode()
+        assert 'batch/missing.mmif' in archive.read('download_errors.txt').decode()
+
+
+def test_zip_stream_duplicate_names():
+    chunks = zip_stream([('a.mmif', [b'1']), ('a.mmif', [b'2', b'3'])])
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.namelist() == ['a.mmif', 'a-1.mmif']
+        assert archive.read('a-1.mmif') == b'23'
+
+
+def read_mmif(cache: MMIFCache, location: str) -> bytes:
+    return cache.open(location, get_mmif_object)['Body'].read()
+
+
+def test_mmif_cache(s3, cache: MMIFCache, mmif_locations: list):
+    location = mmif_locations[0]
+    first = read_mmif(cache, location)
+    second = read_mmif(cache, location)
+    s3.put_object(Bucket=MMIF_S3_BUCKET_NAME, Key=location, Body=b'{"changed": 1}')
+    changed = read_mmif(cache, location)
+
+    assert first == second
+    assert changed == b'{"changed": 1}'
+    assert cache.counters['misses'] == 2
+    assert cache.counters['hits'] == 1
+    assert cache.counters['revalidations'] == 1
+
+
+def test_mmif_cache_releases_entry_before_reading(
+    cache: MMIFCache, mmif_locations: list, mocker: MockerFixture
+):
+    location, entry = mmif_locations[0], cache.entry(mmif_locations[0])
+    body = cache.open(location, get_mmif_object)['Body']
+    # The object is cached, and the entry released, before it is read
+    etag, cached = cache.cached(entry)
+    with cache.locked(f'{entry}.lock', blocking=False) as locked:
+        assert locked
+    with open(cached, 'rb') as file:
+        assert b''.join(body.iter_chunks(8)) == file.read()
+
+    # A failed download is discarded
+    def failing_get_object(mmif_location, etag=None):
+        mmif = get_mmif_object(mmif_location, etag)
+        mmif['Body'].iter_chunks = mocker.Mock(side_effect=ConnectionError)
+        return mmif
+
+    other = cache.entry(mmif_locations[1])
+    with pytest.raises(ConnectionError):
+        cache.open(mmif_locations[1], failing_get_object)
+    assert not cache.cached(other)
+    assert listdir(path.join(cache.directory, 'tmp')) == []
+    with cache.locked(f'{other}.lock', blocking=False) as locked:
+        assert locked
+
+
+def test_mmif_cache_ttl(
+    s3, cache: MMIFCache, mmif_locations: list, mocker: MockerFixture
+):
+    cache.ttl = 60
+    location = mmif_locations[0]
+    first = read_mmif(cache, location)
+    get_object = mocker.Mock(wraps=get_mmif_object)
+
+    # Fresh entries are served without a request to S3
+    assert cache.open(location, get_object)['Body'].read() == first
+    get_object.assert_not_called()
+    assert cache.counters['hits'] == 1
+
+    # Stale entries are revalidated
+    stale = time() - 61
+    utime(cache.entry(location), (stale, stale))
+    assert cache.open(location, get_object)['Body'].read() == first
+    get_object.assert_called_once()
+    assert cache.counters['revalidations'] == 1
+
+
+def test_mmif_cache_serves_cached_after_error(
+    s3, cache: MMIFCache, mmif_locations: list, mocker: MockerFixture
+):
+    location = mmif_locations[0]
+    read_mmif(cache, location)
+    get_object = mocker.Mock(side_effect=ConnectionError('S3 unavailable'))
+
+    assert location in cache.open(location, get_object)['Body'].read().decode()
+    assert cache.counters['hits'] == 1
+
+
+def test_mmif_cache_eviction(cache: MMIFCache, mmif_locations: list):
+    # Each MMIF is ~35 bytes, so only ~14 fit under the 512 byte limit
+    for location in mmif_locations * 2:
+        read_mmif(cache, location)
+
+    assert cache.counters['evictions'] > 0
+    assert 0 < sum(file[1] for file in cache.files()) <= cache.max_size
+    # The most recently used MMIF is still cached
+    assert cache.cached(cache.entry(mmif_locations[-1]))
+    assert not cache.cached(cache.entry(mmif_locations[0]))
+    # Evicted entries are removed with their lock files
+    assert not path.exists(cache.entry(mmif_locations[0]))
+    assert not path.exists(f'{cache.entry(mmif_locations[0])}.lock')
+
+
+@pytest.mark.asyncio
+async def test_mmif_cache_metrics(
+    cache: MMIFCache,
+    mmif_locations: list,
+    async_client: AsyncClient,
+    fake_access_token: type,
+):
+    read_mmif(cache, mmif_locations[0])
+    read_mmif(cache, mmif_locations[0])
+    async with async_client as ac:
+        response = await ac.get(
+            '/api/metrics/',
+            headers={'Authorization': f'Bearer {fake_access_token(["read:metrics"])}'},
+        )
+
+    assert response.status_code == 200
+    assert response.json()['mmif_cache']['hits'] == 1
+    assert response.json()['mmif_cache']['misses'] == 1
+
+
+@pytest.mark.asyncio
+async def test_download_mmif_manifest(mmif_locations: list, async_client: AsyncClient):
+    batch = BatchFactory.create()
+    media_file = MediaFileFactory.create()
+    for location in mmif_locations[:3]:
+        factory_session.add(
+            MMIF(
+                media_file_id=media_file.guid,
+                batch_output_id=batch.id,
+                mmif_location=location,
+            )
+        )
+    factory_session.commit()
+
+    async with async_client as ac:
+        await ac.post(
+            '/test/session',
+            json={'user': {'name': 'test', f'{AUTH0_API_AUDIENCE}/roles': ['admin']}},
+        )
+        response = await ac.post(
+            '/admin/api/batch/action',
+            params={'pks': [batch.id], 'name': 'download_mmif'},
+            data={'format': 'json'},
+        )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    manifest = json.loads(response.content)
+    assert [mmif['mmif_location'] for mmif in manifest['mmifs']] == mmif_locations[:3]
+    assert all('Signature=' in mmif['url'] for mmif in manifest['mmifs'])
+
+
+def test_manifest_formats():
+    mmifs = [
+        {
+            'id': n,
+            'media_file_id': 'cpb-aacip-1',
+            'mmif_location': f'{n}/a.mmif',
+            'filename': name,
+            'url': f'https://s3.example/{n}/a.mmif?Signature=x',
+        }
+        for n, name in enumerate(['a.mmif', 'a-1.mmif'])
+    ]
+
+    rows = list(csv.DictReader(io.StringIO(''.join(csv_manifest(iter(mmifs))))))
+    assert [row['filename'] for row in rows] == ['a.mmif', 'a-1.mmif']
+    assert ''.join(aria2_manifest(iter(mmifs))).splitlines() == [
+        'https://s3.example/0/a.mmif?Signature=x',
+        '  out=a.mmif',
+        'https://s3.example/1/a.mmif?Signature=x',
+        '  out=a-1.mmif',
+    ]
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from chowda.app import app
+from chowda.sessions import MemorySessionStore, PostgresSessionStore, session_key
+
+
+@pytest.fixture
+def store() -> MemorySessionStore:
+    (middleware,) = app.user_middleware
+    return middleware.kwargs['store']
+
+
+def test_sessions_are_stored_server_side(client: TestClient, store: MemorySessionStore):
+    user = {'name': 'test user', 'email': 'test@example.com'}
+    response = client.post('/test/session', json={'user': user})
+    session_id = response.cookies['session']
+
+    # The cookie only holds the session id
+    assert 'test user' not in session_id
+    assert session_key(session_id) in store.sessions
+    assert client.get('/test/session').json() == {'user': user}
+
+    # Unchanged sessions are not written again
+    response = client.get('/test/session')
+    assert 'set-cookie' not in response.headers
+
+    response = client.get('/admin/logout', follow_redirects=False)
+    assert session_key(session_id) not in store.sessions
+    assert 'Max-Age=0' in response.headers['set-cookie']
+
+
+def test_unknown_session_ids_are_replaced(client: TestClient):
+    client.cookies.set('session', 'chosen-by-the-client')
+    response = client.post('/test/session', json={'flash': 'hello'})
+
+    assert response.cookies['session'] != 'chosen-by-the-client'
+
+
+def test_session_ids_are_rotated_at_login(
+    client: TestClient, store: MemorySessionStore
+):
+    response = client.post('/test/session', json={'flash': 'hello'})
+    anonymous_id = response.cookies['session']
+
+    response = client.post('/test/session', json={'user': {'name': 'test user'}})
+    session_id = response.cookies['session']
+
+    assert session_id != anonymous_id
+    assert session_key(anonymous_id) not in store.sessions
+    assert client.get('/test/session').json() == {
+        'flash': 'hello',
+        'user': {'name': 'test user'},
+    }
+
+    # Other changes keep the session id
+    response = client.post('/test/session', json={'flash': 'bye'})
+    assert response.cookies['session'] == session_id
+
+
+@pytest.mark.asyncio
+async def test_postgres_session_store():
+    store = PostgresSessionStore()
+    session_id = uuid4().hex
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    await store.save(session_id, {'user': {'name': 'test user'}}, expires_at)
+    assert await store.load(session_id) == ({'user': {'name': 'test user'}}, expires_at)
+
+    await store.save(session_id, {'flash': 'hello'}, expires_at)
+    assert (await store.load(session_id))[0] == {'flash': 'hello'}
+
+    await store.delete(session_id)
+    assert await store.load(session_id) is None
+
+    await store.save(session_id, {'flash': 'hello'}, datetime.now(timezone.utc))
+    assert await store.load(session_id) is None
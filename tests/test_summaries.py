@@ -0,0 +1,187 @@
+import io
+import json
+import tracemalloc
+from typing import Iterator, List
+
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from chowda.config import MMIF_S3_BUCKET_NAME
+from chowda.contents import distinct_mmif_locations
+from chowda.db import engine
+from chowda.models import MMIF, MMIFSummary
+from chowda.summaries import summarize, summarize_mmifs
+from tests.factories import BatchFactory, MediaFileFactory, factory_session
+
+VOCABULARY = 'http://mmif.clams.ai/vocabulary'
+
+MMIF_JSON = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.4'},
+    'documents': [
+        {
+            '@type': f'{VOCABULARY}/VideoDocument/v1',
+            'properties': {'id': 'd1', 'location': 'file:///cpb-aacip-1.mp4'},
+        }
+    ],
+    'views': [
+        {
+            'id': 'v_0',
+            'metadata': {'app': 'http://apps.clams.ai/swt-detection/v5.0'},
+            'annotations': [
+                {
+                    '@type': f'{VOCABULARY}/Annotation/v6',
+                    'properties': {'document': 'd1', 'duration': 1800.5},
+                },
+                *[
+                    {'@type': f'{VOCABULARY}/TimeFrame/v5', 'properties': {}}
+                    for _ in range(3)
+                ],
+                {'@type': f'{VOCABULARY}/TimePoint/v4', 'properties': {}},
+            ],
+        },
+        {
+            'id': 'v_1',
+            'metadata': {
+                'app': 'http://apps.clams.ai/whisper-wrapper/v10',
+                'error': {'message': 'Out of memory'},
+            },
+            'annotations': [],
+        },
+    ],
+}
+
+
+def test_summarize():
+    data = json.dumps(MMIF_JSON).encode()
+    summary = summarize(io.BytesIO(data))
+
+    assert summary == {
+        'mmif_version': 'http://mmif.clams.ai/1.0.4',
+        'apps': [
+            'http://apps.clams.ai/swt-detection/v5.0',
+            'http://apps.clams.ai/whisper-wrapper/v10',
+        ],
+        'view_count': 2,
+        'error_count': 1,
+        'document_count': 1,
+        'annotation_count': 5,
+        'annotation_types': {'Annotation': 1, 'TimeFrame': 3, 'TimePoint': 1},
+        'durations': {'d1': 1800.5},
+        'size': len(data),
+    }
+
+
+class GeneratedMMIF(io.RawIOBase):
+    """A large MMIF, generated as it is read"""
+
+    def __init__(self, annotations: int):
+        self.chunks = self.generate(annotations)
+        self.buffer = b''
+
+    @staticmethod
+    def generate(annotations: int) -> Iterator[bytes]:
+        yield b'{"metadata": {"mmif": "1.0"}, "documents": [], "views": [{"id": "v",'
+        yield b' "metadata": {"app": "app"}, "annotations": ['
+        annotation = (
+            b'{"@type": "%s/TimeFrame/v5", "properties": {"start": 0, "end": 1}}'
+            % VOCABULARY.encode()
+        )
+        for n in range(annotations // 1000):
+            yield (b',' if n else b'') + b','.join([annotation] * 1000)
+        yield b']}]}'
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while len(self.buffer) < size and (chunk := next(self.chunks, None)):
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def peak_memory(annotations: int) -> int:
+    """Peak memory use while summarizing a generated MMIF"""
+    tracemalloc.start()
+    summary = summarize(GeneratedMMIF(annotations))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert summary['annotation_types'] == {'TimeFrame': annotations}
+    return peak
+
+
+def test_summarize_bounded_memory():
+    # Memory use does not grow with the size of the MMIF: ~400KB vs ~2MB
+    assert peak_memory(20_000) < peak_memory(4_000) * 1.5
+
+
+def test_new_mmifs_are_summarized(mmif_locations: List[str], s3, mocker: MockerFixture):
+    s3.put_object(
+        Bucket=MMIF_S3_BUCKET_NAME, Key=mmif_locations[0], Body=json.dumps(MMIF_JSON)
+    )
+    mocker.patch('chowda.models.MMIF_SUMMARIES', True)
+    executor = mocker.patch('chowda.summaries.summary_executor')
+    executor.return_value.submit.side_effect = lambda fn, *args: fn(*args)
+
+    mmif = MMIF(
+        media_file_id=MediaFileFactory.create().guid,
+        mmif_location=mmif_locations[0],
+    )
+    factory_session.add(mmif)
+    factory_session.commit()
+
+    with Session(engine) as db:
+        summary = db.get(MMIFSummary, mmif.id)
+        assert summary.view_count == 2
+        assert summary.error_count == 1
+        assert summary.annotation_types['TimeFrame'] == 3
+
+
+def test_rolled_back_mmifs_are_not_summarized(mocker: MockerFixture):
+    mocker.patch('chowda.models.MMIF_SUMMARIES', True)
+    submit_summaries = mocker.patch('chowda.summaries.submit_summaries')
+    guid = MediaFileFactory.create().guid
+
+    with Session(engine) as db:
+        db.add(MMIF(media_file_id=guid))
+        db.flush()
+        db.rollback()
+
+        kept = MMIF(media_file_id=guid)
+        db.add(kept)
+        db.commit()
+
+        submit_summaries.assert_called_once_with({kept.id})
+
+
+def test_identical_mmifs_are_linked(mmif_locations: List[str], s3):
+    for location in mmif_locations[:2]:
+        s3.put_object(
+            Bucket=MMIF_S3_BUCKET_NAME, Key=location, Body=json.dumps(MMIF_JSON)
+        )
+    batch = BatchFactory.create()
+    media_file = MediaFileFactory.create()
+    mmifs = [
+        MMIF(
+            media_file_id=media_file.guid,
+            batch_output_id=batch.id,
+            mmif_location=location,
+        )
+        for location in mmif_locations[:3]
+    ]
+    factory_session.add_all(mmifs)
+    factory_session.commit()
+    mmif_ids = [mmif.id for mmif in mmifs]
+
+    assert summarize_mmifs(mmif_ids) == {}
+    with Session(engine) as db:
+        first, second, third = (db.get(MMIF, id) for id in mmif_ids)
+        assert first.content_hash == second.content_hash != third.content_hash
+        assert first.content.mmif_location == mmif_locations[0]
+        assert first.content.size == len(json.dumps(MMIF_JSON))
+        # Identical MMIFs are only downloaded once
+        assert distinct_mmif_locations(db, mmif_ids) == mmif_locations[0:3:2]
+        # or selected by batch, without loading their ids
+        assert (
+            distinct_mmif_locations(db, batch_ids=[batch.id]) == mmif_locations[0:3:2]
+        )